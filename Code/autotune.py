@@ -0,0 +1,291 @@
+import warnings, os, sys, argparse, json, hashlib, socket, subprocess
+warnings.filterwarnings("ignore",category=FutureWarning)
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+from time import time
+
+
+"""
+Autotuning of the CPU thread pools (intra- and inter-op parallelism) of the TF sessions for a given model.
+
+A few training steps (writing and, if trained, reading module) and decoding steps (greedy decoder) of the actual model size
+and batch size are timed for every thread configuration. The training steps read their batches from utils.input_pipeline
+and are compiled with XLA as in run.py, the decoding steps are fed as by utils.greedy_decode. The thread pools of TF are created once per process, hence every
+configuration is benchmarked in a fresh process. The best settings for training and decoding are cached per host and model
+signature (see CACHE) and applied automatically by run.py, eval_model.py and predictor.LdSPredictor once they exist.
+
+The host key contains the amount of cores this process may use (e.g. restricted with taskset) and the amount of runs that
+share the node, which bounds the threads per run and avoids oversubscription of the cores by concurrent runs.
+
+Usage:
+    python run.py ... --autotune True [--runs_per_node 4]
+    python autotune.py --path <run folder> [--runs_per_node 4] [--force True]
+"""
+
+
+CACHE = os.environ.get('LDS_AUTOTUNE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lds_bLSTM', 'autotune.json'))
+
+
+
+def available_cores():
+    """ The amount of cores this process may run on """
+
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+
+def host_key(runs_per_node=1):
+    """ The cache key of the host: hostname, usable cores and the amount of runs sharing them """
+
+    return '{}/{}cores/{}runs'.format(socket.gethostname(), available_cores(), runs_per_node)
+
+
+
+# Settings of the training steps only, they do not affect the cost of a decode step (of one module)
+TRAIN_SETTINGS = ('reading', 'xla')
+
+
+
+def model_spec(inp_len, out_len, x_dict_size, num_classes, input_embed, output_embed, num_layers, nodes, batch_size, fc_size=128,
+    cell_impl='standard', reading=False, xla=''):
+    """
+    The hyperparameters that determine the cost of a training and decoding step (in the order of the meta tags), and the XLA 
+    mode of the training steps (see run.py)
+    """
+
+    return {'inp_len':int(inp_len), 'out_len':int(out_len), 'x_dict_size':int(x_dict_size), 'num_classes':int(num_classes),
+            'input_embed':int(input_embed), 'output_embed':int(output_embed), 'num_layers':int(num_layers), 'nodes':int(nodes),
+            'batch_size':int(batch_size), 'fc_size':int(fc_size), 'cell_impl':str(cell_impl), 'reading':bool(reading), 'xla':str(xla)}
+
+
+
+def decode_spec(spec):
+    """ SPEC without the settings that only affect training (see TRAIN_SETTINGS) """
+
+    return {name:value for name, value in spec.items() if name not in TRAIN_SETTINGS}
+
+
+
+def run_spec(model_args_write):
+    """ model_spec of a trained run, from its meta tags (see utils.read_model_args) """
+
+    return model_spec(*model_args_write[:9], fc_size=model_args_write[25] if len(model_args_write) > 25 else 128,
+        cell_impl=model_args_write[26] if len(model_args_write) > 26 else 'standard', reading=model_args_write[18])
+
+
+
+def signature(spec):
+    """ Short hash of a model_spec """
+
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+
+
+
+def load_cache():
+
+    if not os.path.exists(CACHE):
+        return {}
+    with open(CACHE) as f:
+        return json.load(f)
+
+
+
+def save_entry(key, spec, entry):
+    """ Adds ENTRY to the cache, written atomically (concurrent runs may tune at the same time) """
+
+    cache = load_cache()
+    cache.setdefault(key, {})[signature(spec)] = dict(entry, spec=spec)
+    if not os.path.exists(os.path.dirname(CACHE)):
+        os.makedirs(os.path.dirname(CACHE))
+    tmp = CACHE + '.' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, CACHE)
+
+
+
+def candidates(cores):
+    """ Thread configurations (intra, inter) to benchmark: powers of two and all cores, with 1 or 2 inter-op threads """
+
+    intra = sorted(set([2**k for k in range(int(np.log2(max(cores, 1))) + 1)] + [cores]))
+    return [(i, j) for i in intra for j in [1, 2] if j <= max(cores // i, 1) or j == 1]
+
+
+
+def benchmark(spec, intra, inter, steps=10, warmup=2, decode_batch=1000):
+    """
+    Times training and decoding steps of the model of SPEC with random data in this process. As in run.py, the training
+    steps read their batches from utils.input_pipeline (with the XLA mode of SPEC). Call it in a fresh process per 
+    configuration (see run_benchmark).
+
+    Returns:
+    --------------
+    TIMES           {dict} seconds per training step ('train') and per decoded batch of DECODE_BATCH words ('decode')
+    """
+
+    import tensorflow as tf
+    import utils
+    from bLSTM import bLSTM
+
+    rng = np.random.RandomState(0)
+    bs = spec['batch_size']
+    words = bs * (warmup + steps)
+    # Random words with <GO> (1) in the first column, one epoch of the pipeline covers all timed steps
+    x = np.concatenate([np.ones((words, 1), np.int64), rng.randint(1, spec['x_dict_size'] + 1, (words, spec['inp_len']))], axis=1)
+    y = np.concatenate([np.ones((words, 1), np.int64), rng.randint(1, spec['num_classes'] + 1, (words, spec['out_len']))], axis=1)
+
+    config = utils.session_config(intra, inter)
+    if spec.get('xla') == 'auto':
+        os.environ['TF_XLA_FLAGS'] = os.environ.get('TF_XLA_FLAGS', '') + ' --tf_xla_cpu_global_jit'
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
+    def module(task, in_len, out_len, in_dict, classes, data):
+        with tf.variable_scope('writing' if task == 'write' else 'reading'):
+            model = bLSTM(in_len, out_len, in_dict, classes, spec['input_embed'], spec['output_embed'], spec['num_layers'],
+                spec['nodes'], bs, 'normal', task, 1, fc_size=spec['fc_size'], cell_impl=spec['cell_impl'], 
+                jit=spec.get('xla') == 'jit', data=data)
+            model.forward()
+            model.backward()
+            model.inference(1)
+        return model
+
+    graph = tf.Graph()
+    with graph.as_default():
+        iterator, batch, pipeline_feed = utils.input_pipeline(x, y, bs, pad_remainder=bool(spec.get('xla')))
+        model = module('write', spec['inp_len'], spec['out_len'], spec['x_dict_size'], spec['num_classes'], batch)
+        train_op, feed = model.optimizer, {model.keep_prob:1.0}
+        if spec['reading']:
+            read_batch = {'inputs':model.train_targets, 'outputs':batch['x'][:,:-1], 'targets':batch['inputs'], 'mask':batch['mask']}
+            model_read = module('read', spec['out_len'], spec['inp_len'], spec['num_classes'], spec['x_dict_size'], read_batch)
+            train_op = tf.group(model.optimizer, model_read.optimizer)
+            feed[model_read.keep_prob] = 1.0
+        init = tf.global_variables_initializer()
+    graph.finalize()
+
+    decode_feed = {model.keep_prob:1.0, model.inputs:x[:decode_batch,1:]}
+    times = {}
+    with tf.Session(graph=graph, config=config) as sess:
+        sess.run(init)
+        sess.run(iterator.initializer, feed_dict=pipeline_feed)
+        for name, op, op_feed in [('train', train_op, feed), ('decode', model.greedy_predictions, decode_feed)]:
+            for _ in range(warmup):
+                sess.run(op, feed_dict=op_feed)
+            t = time()
+            for _ in range(steps):
+                sess.run(op, feed_dict=op_feed)
+            times[name] = (time() - t) / steps
+
+    return times
+
+
+
+def run_benchmark(spec, intra, inter, steps=10):
+    """ benchmark in a fresh Python process (inherits the core affinity of this one) """
+
+    job = json.dumps({'spec':spec, 'intra':intra, 'inter':inter, 'steps':steps})
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', job], stdout=subprocess.PIPE,
+        universal_newlines=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+    # The model prints while it is built, the result is the last line
+    return json.loads(result.stdout.strip().split('\n')[-1])
+
+
+
+def tune(spec, runs_per_node=1, steps=10, force=False):
+    """
+    Benchmarks all candidate configurations for the model of SPEC (unless cached) and caches the best ones.
+
+    Parameters:
+    --------------
+    SPEC            {dict} see model_spec
+    RUNS_PER_NODE   {int} amount of concurrent runs on this host, every run gets at most cores // RUNS_PER_NODE threads
+    STEPS           {int} timed steps per configuration
+    FORCE           {bool} benchmark again even if the host and model are cached
+
+    Returns:
+    --------------
+    ENTRY           {dict} the best 'train' and 'decode' configuration ({'intra', 'inter', 'seconds'}) and all timings
+    """
+
+    key = host_key(runs_per_node)
+    cached = load_cache().get(key, {}).get(signature(spec))
+    if cached is not None and not force:
+        return cached
+
+    cores = max(1, available_cores() // runs_per_node)
+    timings = []
+    for intra, inter in candidates(cores):
+        times = run_benchmark(spec, intra, inter, steps)
+        timings.append({'intra':intra, 'inter':inter, 'train':times['train'], 'decode':times['decode']})
+        print("Autotuning - {:>3} intra-op and {} inter-op threads: {:>8.4f} s per train step, {:>8.4f} s per decode batch".format(
+            intra, inter, times['train'], times['decode']))
+
+    entry = {'timings':timings}
+    for mode in ['train', 'decode']:
+        best = min(timings, key=lambda timing: timing[mode])
+        entry[mode] = {'intra':best['intra'], 'inter':best['inter'], 'seconds':best[mode]}
+    print("Autotuning - best for training: ", entry['train'], ", for decoding: ", entry['decode'])
+
+    save_entry(key, spec, entry)
+    return entry
+
+
+
+def tuned_threads(spec, mode='train', runs_per_node=1):
+    """
+    The cached (intra, inter) threads of MODE ('train' or 'decode') for the model of SPEC on this host, None if not tuned.
+    Decoding uses the threads tuned for the model with any training settings (see TRAIN_SETTINGS).
+    """
+
+    entries = load_cache().get(host_key(runs_per_node), {})
+    if mode == 'train':
+        entry = entries.get(signature(spec))
+    else:
+        entry = next((entry for entry in entries.values() if decode_spec(entry['spec']) == decode_spec(spec)), None)
+    if entry is None:
+        return None
+
+    return entry[mode]['intra'], entry[mode]['inter']
+
+
+
+def session_config(model_args_write, mode='decode', runs_per_node=1):
+    """
+    utils.session_config with the cached threads of MODE for the run of MODEL_ARGS_WRITE (see utils.read_model_args), or the
+    TF defaults if the model was not tuned on this host.
+    """
+
+    import utils
+
+    threads = tuned_threads(run_spec(model_args_write), mode, runs_per_node)
+    if threads is None:
+        return utils.session_config()
+    print("Using the autotuned thread configuration (intra, inter) ", threads)
+
+    return utils.session_config(*threads)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of a trained model, its hyperparameters are tuned.')
+    parser.add_argument('--runs_per_node', default=1, type=int,
+                        help='Amount of concurrent runs on this host, they share the cores.')
+    parser.add_argument('--steps', default=10, type=int,
+                        help='Timed steps per configuration.')
+    parser.add_argument('--force', default=False, type=bool,
+                        help='Benchmark again, even if the model was tuned on this host.')
+    parser.add_argument('--worker', default=None, type=str,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        job = json.loads(args.worker)
+        print(json.dumps(benchmark(job['spec'], job['intra'], job['inter'], job['steps'])))
+
+    else:
+        import utils
+        tune(run_spec(utils.read_model_args(args.path)), args.runs_per_node, args.steps, args.force)
@@ -2,12 +2,15 @@ import warnings
 warnings.filterwarnings("ignore",category=FutureWarning)
 
 import inspect
+import contextlib
 import tensorflow as tf 
 import numpy as np 
 
-from tensorflow.contrib.rnn import LSTMCell, LSTMStateTuple, DropoutWrapper
+from tensorflow.contrib.rnn import LSTMCell, LSTMStateTuple, DropoutWrapper, LSTMBlockFusedCell
 from tensorflow.contrib.rnn import stack_bidirectional_dynamic_rnn as bi_rnn
 
+from loss_lds import lds_targets
+
 
 
 # Class with the model. Only forward, no Loss etc.	
@@ -19,11 +22,11 @@ from tensorflow.contrib.rnn import stack_bidirectional_dynamic_rnn as bi_rnn
 class bLSTM(object):
 
 	def __init__(self, input_seq_length, output_seq_length, input_dict_size, num_classes, input_embed_size, output_embed_size, num_layers, num_LSTM_cells, batch_size, 
-		learn_type, task, max_alt_spellings, print_ratio=False, optimization='RMSProp', learning_rate=1e-3, LSTM_initializer=None, momentum=0.01, activation_fn=None, bidirectional=True):
+		learn_type, task, max_alt_spellings, print_ratio=False, optimization='RMSProp', learning_rate=1e-3, LSTM_initializer=None, momentum=0.01, activation_fn=None, bidirectional=True, dropout=True, fc_size=128, cell_impl='standard', jit=False, data=None):
 
 		# Task dependent hyperparamter
-		self.input_seq_length = input_seq_length        # How long is the input sequence (all have equal length, due to padding)
-		self.output_seq_length = output_seq_length		# How long is output sequence (also equal length)
+		self.input_seq_length = input_seq_length        # How long is the input sequence (all have equal length, due to padding; batches may be trimmed to length buckets)
+		self.output_seq_length = output_seq_length		# How long is output sequence (also equal length, maximal decoding length)
 		self.input_dict_size = input_dict_size + 1		# Cardinality of input alphabet 
 		self.num_classes = num_classes + 1				# Cardinality of output alphabet (+1 so 0 does not need to be covered since it causes trouble for tf.edit_dist)
 		self.learn_type = learn_type					# {'normal', 'lds'} specifies the training regime for the reading.
@@ -43,6 +46,12 @@ class bLSTM(object):
 		self.learning_rate = learning_rate				# Learning rate (0.001 by default)
 		self.momentum = momentum 						# Only applied in case the momentum optimizer is used (0.01 by default)
 		self.optimization = optimization				# Set the optimization technique. Choose from 'RMSProp' (default), 'GD', 'Momentum', 'Adam', 'Adadelta', 'Adagrad'
+		self.dropout = dropout 							# {bool}, True per default. If False, an inference-only model without dropout layers is built 
+														# (keep_prob is then a constant 1.0, e.g. for exporting a frozen graph)
+		self.fc_size = fc_size							# Units of the fully connected layer between decoder and logits (128 by default, smaller after pruning)
+		self.cell_impl = cell_impl						# {'standard', 'fused'}. 'fused' runs encoder and decoder with whole-sequence LSTM kernels (LSTMBlockFusedCell), 
+														# dropout is then applied on the inputs outside of the recurrence. Both use the same variables (checkpoints are interchangeable)
+		self.jit = jit 									# {bool}, False per default. If True, encoder, decoder, losses and optimizer update are compiled as explicit XLA clusters
 
 		# Output dependent hyperparameter
 		self.print_ratio = print_ratio					# {bool}, optional, False per default. Only applies if learn_type='lds'. Decides whether the ratio of words
@@ -57,12 +66,28 @@ class bLSTM(object):
 		self.max_alt_spellings = max_alt_spellings
 
 
-		# Placeholder
-		self.inputs = tf.placeholder(tf.int32 , (None,self.input_seq_length),'input')
-		self.outputs = tf.placeholder(tf.int32 , (None,None),'output')
-		self.targets = tf.placeholder(tf.int32 , (None,None),'targets')
-		self.alternative_targets = tf.placeholder(tf.int32, (None,None,None),'alternative_targets') # Orthographically incorrect, but accepted spellings: bs x seq_len x max_alt_targs
-		self.keep_prob = tf.placeholder(tf.float32, name='keep_prob')			# Dropout parameter. Determines what ratio of neurons is used (all per default)
+		# Placeholder. If DATA (the batch tensors of utils.input_pipeline) is given, they default to the next batch of the pipeline
+		data = data if data is not None else {}
+		self.inputs = self.placeholder(data.get('inputs'), tf.int32 , (None,None),'input') 		# Time dimension may vary between batches (length buckets)
+		self.outputs = self.placeholder(data.get('outputs'), tf.int32 , (None,None),'output')
+		self.targets = self.placeholder(data.get('targets'), tf.int32 , (None,None),'targets')
+		# Sorted keys of the orthographically incorrect, but accepted spellings of all words (see utils.spelling_keys and utils.key_table) 
+		# and the index of every word of the batch in them. Unless given, there are none
+		self.alternative_keys = tf.placeholder_with_default(data.get('alternative_keys', tf.constant([-1], tf.int64)), (None,), 'alternative_keys')
+		self.word_ids = self.placeholder(data.get('word_ids', tf.zeros([tf.shape(self.targets)[0]], tf.int64)), tf.int64, (None,), 'word_ids')
+		# 1 for the words of the batch, 0 for rows that only fill up the batch (see utils.input_pipeline). Unless given, all words count
+		self.word_mask = self.placeholder(data.get('mask', tf.ones([tf.shape(self.targets)[0]])), tf.float32, (None,), 'word_mask')
+		self.keep_prob = tf.placeholder(tf.float32, name='keep_prob') if dropout else tf.constant(1.0, name='keep_prob') # Dropout parameter. Determines what ratio of neurons is used
+
+
+
+	@staticmethod
+	def placeholder(default, dtype, shape, name):
+		""" A placeholder, or a placeholder with DEFAULT (a tensor) that is only fed to override the default """
+
+		if default is None:
+			return tf.placeholder(dtype, shape, name)
+		return tf.placeholder_with_default(default, shape, name)
 
 
 
@@ -85,7 +110,7 @@ class bLSTM(object):
 	def forward(self):		
 
 		# Encoder
-		with tf.variable_scope("encoding_"+ self.task) as encoding_scope:
+		with tf.variable_scope("encoding_"+ self.task) as encoding_scope, self.jit_scope():
 
 			self.input_embedding = tf.Variable(tf.random_uniform((self.input_dict_size, self.input_embed_size), -1.0, 1.0), name='enc_embedding')
 			input_embed = tf.nn.embedding_lookup(self.input_embedding, self.inputs)
@@ -93,14 +118,20 @@ class bLSTM(object):
 
 			if self.bidirectional:
 
-				# Define LSTM cells
-				enc_fw_cells = [DropoutWrapper(LSTMCell(self.num_LSTM_cells,initializer=self.LSTM_initializer),input_keep_prob=self.keep_prob) for layer in range(self.num_layers)]
-				enc_bw_cells = [DropoutWrapper(LSTMCell(self.num_LSTM_cells,initializer=self.LSTM_initializer),input_keep_prob=self.keep_prob) for layer in range(self.num_layers)]
+				if self.cell_impl == 'fused':
+
+					( self.enc_output , enc_fw_final, enc_bw_final) = self.fused_encoder(input_embed)
 
+				else:
 
-				# Use the LSTM cells bidirectionally (look forward and backward at input sequence)
-				( self.enc_output , enc_fw_final, enc_bw_final) = tf.contrib.rnn.stack_bidirectional_dynamic_rnn(cells_fw=enc_fw_cells, cells_bw=enc_bw_cells, 
-				                                                   inputs=input_embed, dtype=tf.float32)
+					# Define LSTM cells
+					enc_fw_cells = [self.encoder_cell() for layer in range(self.num_layers)]
+					enc_bw_cells = [self.encoder_cell() for layer in range(self.num_layers)]
+
+
+					# Use the LSTM cells bidirectionally (look forward and backward at input sequence)
+					( self.enc_output , enc_fw_final, enc_bw_final) = tf.contrib.rnn.stack_bidirectional_dynamic_rnn(cells_fw=enc_fw_cells, cells_bw=enc_bw_cells, 
+					                                                   inputs=input_embed, dtype=tf.float32)
 				print("out shaoe", self.enc_output.shape)
 				# Concatenate results
 				for k in range(self.num_layers):
@@ -122,79 +153,460 @@ class bLSTM(object):
 				print("ENC LAST ", enc_fin_c.shape)
 
 
+			elif self.cell_impl == 'fused':
+				raise ValueError("The fused cells are only implemented for the bidirectional encoder.")
+
 			else:
 
 				# Define LSTM cells
-				enc_cells = [DropoutWrapper(LSTMCell(self.num_LSTM_cells,initializer=self.LSTM_initializer), input_keep_prob=keep_prob) for layer in range(self.num_layers)]
+				enc_cells = [self.encoder_cell() for layer in range(self.num_layers)]
 				enc_multi_cell = tf.nn.rnn_cell.MultiRNNCell(enc_cells)
-				self.enc_output, self.enc_last_state = tf.nn.dynamic_rnn(enc_cells, inputs=input_embed, dtype=tf.float32)
+				self.enc_output, self.enc_last_state = tf.nn.dynamic_rnn(enc_multi_cell, inputs=input_embed, dtype=tf.float32)
 
 		# Decoder
-		with tf.variable_scope("decoding_"+self.task) as decoding_scope:
+		with tf.variable_scope("decoding_"+self.task) as decoding_scope, self.jit_scope():
 
 			self.output_embedding = tf.Variable(tf.random_uniform((self.num_classes, self.output_embed_size), -1.0, 1.0), name='dec_embedding')
 			output_embed = tf.nn.embedding_lookup(self.output_embedding, self.outputs)
 
-			if self.bidirectional:
+			if self.bidirectional and self.cell_impl == 'fused':
 
-				dec_cells = tf.contrib.rnn.LSTMCell(2*self.num_layers*self.num_LSTM_cells,initializer=self.LSTM_initializer)
+				dec_cells = LSTMBlockFusedCell(2*self.num_layers*self.num_LSTM_cells, name='lstm_cell')
+				self.dec_state_size = LSTMStateTuple(dec_cells.num_units, dec_cells.num_units)
+
+			elif self.bidirectional:
 
+				dec_cells = tf.contrib.rnn.LSTMCell(2*self.num_layers*self.num_LSTM_cells,initializer=self.LSTM_initializer)
+				self.dec_state_size = dec_cells.state_size
 
 			else:
 				dec_cells_list = [tf.contrib.rnn.LSTMCell(self.num_LSTM_cells,initializer=self.LSTM_initializer) for _ in range(self.num_layers)]
 				dec_cells = tf.nn.rnn_cell.MultiRNNCell(dec_cells_list)
+				self.dec_state_size = dec_cells.state_size
 
-			self.dec_outputs, _ = tf.nn.dynamic_rnn(dec_cells, inputs=output_embed, initial_state=self.enc_last_state)
-
+			# Keep the decoder cell and its scope, the inference graph reuses both (same weights)
+			self.dec_cells = dec_cells
+			self.decoding_scope = decoding_scope
 
+			self.dec_outputs, _ = self.decoder(output_embed, self.enc_last_state)
 
 
 			# Fully connected layer of the decoder outputs to the predictions
-			self.fc1 = tf.contrib.layers.fully_connected(self.dec_outputs, num_outputs=128, activation_fn=self.activation_fn) 
-			self.drop = tf.contrib.layers.dropout(self.fc1, self.keep_prob) 
+			self.fc1, self.logits = self.output_projection(self.dec_outputs)
 			print("DEC OUT SHAPE", self.dec_outputs.shape)
-			self.logits = tf.contrib.layers.fully_connected(self.drop,num_outputs=self.num_classes, activation_fn=self.activation_fn)
 			self.logits = tf.identity(self.logits, name='logits')
 
 
 
-	def backward(self):
+	def jit_scope(self):
+		""" Compiles the ops created in it as one XLA cluster if the model is built with jit=True, otherwise it does nothing """
+
+		return tf.contrib.compiler.jit.experimental_jit_scope() if self.jit else contextlib.ExitStack()
+
+
+
+	def fused_encoder(self, input_embed):
+		"""
+		The bidirectional encoder of forward() with one whole-sequence kernel (LSTMBlockFusedCell) per layer and direction.
+		Gates and weight layout equal those of LSTMCell and the variable scopes those of stack_bidirectional_dynamic_rnn, 
+		so the variables (and checkpoints) are shared with the standard cells. Dropout is applied on the inputs of every 
+		layer (as the DropoutWrapper of encoder_cell, but outside of the recurrence).
+
+		Returns:
+		-------------
+		ENC_OUTPUT 		{tf.Tensor} of shape [batch_size, seq_len, 2*num_LSTM_cells], the outputs of the last layer
+		ENC_FW_FINAL	{list} the final LSTMStateTuple of every forward layer
+		ENC_BW_FINAL	{list} the final LSTMStateTuple of every backward layer
+		"""
+
+		# The fused kernels are time major
+		layer_input = tf.transpose(input_embed, [1, 0, 2])
+		enc_fw_final, enc_bw_final = [], []
+
+		with tf.variable_scope('stack_bidirectional_rnn', initializer=self.LSTM_initializer):
+			for layer in range(self.num_layers):
+				with tf.variable_scope('cell_%d' % layer), tf.variable_scope('bidirectional_rnn'):
+
+					fw_input = tf.nn.dropout(layer_input, self.keep_prob) if self.dropout else layer_input
+					bw_input = tf.nn.dropout(layer_input, self.keep_prob) if self.dropout else layer_input
+
+					with tf.variable_scope('fw'):
+						fw_output, fw_final = LSTMBlockFusedCell(self.num_LSTM_cells, name='lstm_cell')(fw_input, dtype=tf.float32)
+					with tf.variable_scope('bw'):
+						bw_output, bw_final = LSTMBlockFusedCell(self.num_LSTM_cells, name='lstm_cell')(tf.reverse(bw_input, [0]), dtype=tf.float32)
+
+					layer_input = tf.concat((fw_output, tf.reverse(bw_output, [0])), 2)
+					enc_fw_final.append(fw_final)
+					enc_bw_final.append(bw_final)
+
+		return tf.transpose(layer_input, [1, 0, 2]), enc_fw_final, enc_bw_final
+
+
+
+	def decoder(self, dec_embed, initial_state):
+		"""
+		Runs the decoder cell (self.dec_cells) over the embedded output sequence DEC_EMBED [batch_size, seq_len, embed_size], 
+		starting from INITIAL_STATE. Returns the outputs [batch_size, seq_len, dec_units] and the final state.
+		"""
+
+		if self.cell_impl == 'fused':
+			with tf.variable_scope('rnn', initializer=self.LSTM_initializer):
+				dec_outputs, state = self.dec_cells(tf.transpose(dec_embed, [1, 0, 2]), initial_state=initial_state, dtype=tf.float32)
+			return tf.transpose(dec_outputs, [1, 0, 2]), state
+
+		return tf.nn.dynamic_rnn(self.dec_cells, inputs=dec_embed, initial_state=initial_state)
+
+
+
+	def encoder_cell(self):
+		""" LSTM cell of the encoder, with dropout on its inputs unless the model is built without dropout """
+
+		cell = LSTMCell(self.num_LSTM_cells,initializer=self.LSTM_initializer)
+		return DropoutWrapper(cell,input_keep_prob=self.keep_prob) if self.dropout else cell
+
+
+
+	def output_projection(self, dec_outputs, dropout=True):
+		"""
+		Maps decoder outputs onto the output classes (fully connected layer + dropout + logits layer).
+		The layers are created on the first call and shared by all later calls (e.g. from the inference graph).
+
+		Parameters:
+		-------------
+		DEC_OUTPUTS 	{tf.Tensor} of shape [..., dec_units], the outputs of the decoder LSTM
+		DROPOUT 		{bool} whether dropout (self.keep_prob) is applied on the hidden layer, False for inference
+
+		Returns:
+		-------------
+		FC1 			{tf.Tensor} of shape [..., fc_size], the hidden layer
+		LOGITS 			{tf.Tensor} of shape [..., num_classes]
+		"""
+
+		fc1 = tf.contrib.layers.fully_connected(dec_outputs, num_outputs=self.fc_size, activation_fn=self.activation_fn, 
+			scope='fully_connected', reuse=tf.AUTO_REUSE)
+		hidden = tf.contrib.layers.dropout(fc1, self.keep_prob) if dropout and self.dropout else fc1
+		logits = tf.contrib.layers.fully_connected(hidden, num_outputs=self.num_classes, activation_fn=self.activation_fn, 
+			scope='fully_connected_1', reuse=tf.AUTO_REUSE)
+
+		return fc1, logits
+
+
+
+	def decoder_step(self, tokens, state):
+		"""
+		Advances the decoder by one token, reusing the weights of the trained decoder.
+
+		Parameters:
+		-------------
+		TOKENS 			{tf.Tensor} of shape [batch_size] and dtype int32, the previously emitted characters
+		STATE 			{LSTMStateTuple} the current decoder state (the encoder's last state at the first step)
+
+		Returns:
+		-------------
+		LOGITS 			{tf.Tensor} of shape [batch_size, num_classes]
+		STATE 			{LSTMStateTuple} the updated decoder state
+		"""
+
+		with tf.variable_scope(self.decoding_scope, reuse=True):
+			token_embed = tf.nn.embedding_lookup(self.output_embedding, tokens)
+			if self.cell_impl == 'fused':
+				dec_output, state = self.decoder(token_embed[:,None], state)
+				dec_output = dec_output[:,0]
+			else:
+				dec_output, state = self.dec_cells(token_embed, state)
+			_, logits = self.output_projection(dec_output, dropout=False)
+
+		return logits, state
+
+
+
+	def inference(self, go_id):
+		"""
+		Builds the inference graph. Unlike feeding a growing output sequence into self.logits (which recomputes the encoder and 
+		the whole decoder prefix for every character), the encoder is run once and the decoder is advanced one token per step.
+		Call after forward().
+
+		Two interfaces are provided:
+		1) 	Fully in-graph greedy decoding (tf.while_loop): 
+				sess.run(model.greedy_predictions, {model.inputs: ..., model.keep_prob: 1.0})
+		2) 	Step-wise decoding with the decoder state as in- and output: run model.enc_last_state once, then feed 
+				model.dec_step_input and model.dec_state_in and fetch model.dec_step_logits and model.dec_state_out.
+
+		Parameters:
+		-------------
+		GO_ID 			{int} the index of the <GO> token in the output dictionary
+		"""
+
+		self.go_id = go_id
+
+		with tf.name_scope("inference_" + self.task):
+
+			# Number of decoding steps, the output sequence length unless specified otherwise
+			self.decode_length = tf.placeholder_with_default(self.output_seq_length, [], name='decode_length')
+
+			# Single step decoding
+			self.dec_step_input = tf.placeholder(tf.int32, (None,), 'dec_step_input')
+			self.dec_state_in = tf.contrib.framework.nest.map_structure(lambda size: tf.placeholder(tf.float32, (None, size)), 
+				self.dec_state_size)
+			self.dec_step_logits, self.dec_state_out = self.decoder_step(self.dec_step_input, self.dec_state_in)
+
+			# Greedy decoding, looped in-graph
+			start_tokens = tf.fill([tf.shape(self.inputs)[0]], go_id)
+			predictions = tf.TensorArray(tf.int32, size=self.decode_length)
+
+			def greedy_step(t, tokens, state, predictions):
+				logits, state = self.decoder_step(tokens, state)
+				tokens = tf.argmax(logits, axis=-1, output_type=tf.int32)
+				return t + 1, tokens, state, predictions.write(t, tokens)
+
+			_, _, _, predictions = tf.while_loop(lambda t, *_: t < self.decode_length, greedy_step, 
+				(tf.constant(0), start_tokens, self.enc_last_state, predictions))
+
+			# batch_size x decode_length (without the <GO> token)
+			self.greedy_predictions = tf.transpose(predictions.stack(), name='greedy_predictions')
+
+
+
+	def beam_search(self, beam_width):
+		"""
+		Builds an in-graph beam search decoder, vectorized over batch x beam (the beams of all words are one batch of the
+		decoder). As there is no end token, all hypotheses have decode_length tokens and are ranked by their log-likelihood.
+		Call after inference().
+
+		Usage:
+			sess.run([model.beam_predictions, model.beam_scores], {model.inputs: ..., model.keep_prob: 1.0})
+
+		Parameters:
+		-------------
+		BEAM_WIDTH 		{int} amount of hypotheses kept per word (the size of the n-best lists)
+		"""
+
+		self.beam_width = beam_width
+
+		with tf.name_scope("beam_search_" + self.task):
+
+			batch_size = tf.shape(self.inputs)[0]
+			nest = tf.contrib.framework.nest
+
+			# Every word starts with BEAM_WIDTH copies of its encoder state, only the first one is alive (others -inf)
+			init_state = nest.map_structure(lambda s: tf.contrib.seq2seq.tile_batch(s, beam_width), self.enc_last_state)
+			init_scores = tf.tile(tf.concat([[0.0], tf.fill([beam_width - 1], -np.inf)], 0)[None,:], [batch_size, 1])
+			start_tokens = tf.fill([batch_size * beam_width], self.go_id)
+			beam_offsets = (tf.range(batch_size) * beam_width)[:,None]
+
+			step_ids = tf.TensorArray(tf.int32, size=self.decode_length)
+			parent_ids = tf.TensorArray(tf.int32, size=self.decode_length)
+
+			def beam_step(t, tokens, state, scores, step_ids, parent_ids):
+				logits, state = self.decoder_step(tokens, state)
+				log_probs = tf.reshape(tf.nn.log_softmax(logits), [batch_size, beam_width, self.num_classes])
+
+				# Best BEAM_WIDTH continuations among all beams of a word
+				total = tf.reshape(scores[:,:,None] + log_probs, [batch_size, beam_width * self.num_classes])
+				scores, indices = tf.nn.top_k(total, k=beam_width)
+				parents = indices // self.num_classes
+				tokens = indices % self.num_classes
+
+				state = nest.map_structure(lambda s: tf.gather(s, tf.reshape(parents + beam_offsets, [-1])), state)
+				return (t + 1, tf.reshape(tokens, [-1]), state, scores, step_ids.write(t, tokens),
+					parent_ids.write(t, parents))
+
+			_, _, _, scores, step_ids, parent_ids = tf.while_loop(lambda t, *_: t < self.decode_length, beam_step,
+				(tf.constant(0), start_tokens, init_state, init_scores, step_ids, parent_ids))
+
+			# Follow the parent pointers back from the final beams (no token equals the end token -1)
+			sequences = tf.contrib.seq2seq.gather_tree(step_ids.stack(), parent_ids.stack(),
+				tf.fill([batch_size], self.decode_length), end_token=-1)
+
+			# batch_size x beam_width x decode_length, sorted by score
+			self.beam_predictions = tf.transpose(sequences, [1, 2, 0], name='beam_predictions')
+			self.beam_scores = tf.identity(scores, name='beam_scores')
+
+
+
+	def scoring(self, go_id):
+		"""
+		Builds a teacher-forced scoring graph for arbitrary candidate spellings (e.g. all alternative targets of a word).
+		The encoder runs once per word (self.inputs), its last state is gathered for every candidate of that word and all 
+		candidates are scored in one vectorized decoder pass. Call after forward().
+
+		Usage:
+			sess.run(model.candidate_log_likelihood, {model.inputs: words, model.candidates: cands, 
+				model.candidate_words: word index (row of model.inputs) of every candidate, model.keep_prob: 1.0})
+
+		Parameters:
+		-------------
+		GO_ID 			{int} the index of the <GO> token in the output dictionary
+		"""
+
+		with tf.name_scope("scoring_" + self.task):
+
+			self.candidates = tf.placeholder(tf.int32, (None,None), 'candidates') 				# num_candidates x seq_len (without <GO>)
+			self.candidate_words = tf.placeholder(tf.int32, (None,), 'candidate_words') 		# row of self.inputs for every candidate
+
+			# Reuse the encoder state of the word for all its candidates
+			init_state = tf.contrib.framework.nest.map_structure(lambda s: tf.gather(s, self.candidate_words), self.enc_last_state)
+			go_tokens = tf.fill([tf.shape(self.candidates)[0], 1], go_id)
+			dec_inputs = tf.concat([go_tokens, self.candidates[:,:-1]], 1)
+
+			with tf.variable_scope(self.decoding_scope, reuse=True):
+				dec_embed = tf.nn.embedding_lookup(self.output_embedding, dec_inputs)
+				dec_outputs, _ = self.decoder(dec_embed, init_state)
+				_, logits = self.output_projection(dec_outputs, dropout=False)
+
+			# Log-likelihood of every token, summed over the sequence
+			token_log_likelihood = -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=self.candidates, logits=logits)
+			self.candidate_log_likelihood = tf.reduce_sum(token_log_likelihood, 1, name='candidate_log_likelihood')
+
+
+
+	def backward(self, pad_id=0):
+		"""
+		Builds losses and the optimizer. PAD_ID is the <PAD> index of the output dictionary, it is needed to compare the generated 
+		words with the hashes of the alternative spellings (see loss_lds.spelling_hash) independent of the amount of padding.
+
+		There is a single train op (self.optimizer) for both regimes: self.lds_mode (False by default) switches its targets from
+		the true to the LdS-accepted targets. All losses share one log-softmax and the regimes share the optimizer slots, so 
+		switching the regime does not cost anything. self.lds_optimizer is kept as an alias of self.optimizer.
+		"""
 
 		with tf.name_scope("optimization_"+ self.task):
 
-			# Loss function
-			self.loss = tf.contrib.seq2seq.sequence_loss(self.logits, self.targets, tf.ones([self.batch_size, self.output_seq_length]))
-			
-			self.loss_lds, self.read_inps, self.rat_lds, self.rat_corr, self.loss_reg = tf.contrib.seq2seq.sequence_loss_lds(self.logits, self.targets, 
-					tf.ones([self.batch_size, self.output_seq_length]), self.alternative_targets, self.max_alt_spellings)
+			# Loss function. Weights follow the shape of the fed targets (batch size and sequence length may vary), the filling
+			# rows of the batch are masked out
+			self.weights = tf.ones_like(self.targets, dtype=tf.float32) * self.word_mask[:,None]
+			with self.jit_scope():
+				log_probs = tf.nn.log_softmax(self.logits)
+
+			# Only the LdS regime selects its targets: generated words that are accepted spellings become their own targets.
+			# The regime switch stays outside of the compiled clusters
+			self.lds_mode = tf.placeholder_with_default(False, [], 'lds_mode')
+
+			def lds_regime():
+				with self.jit_scope():
+					new_targets, rat_lds, _ = lds_targets(self.logits, self.targets, self.alternative_keys, self.word_ids, pad_id,
+						self.word_mask)
+				return tf.cast(new_targets, tf.int32), rat_lds
+
+			# The targets of the train op (the reading module reads them) and the LdS ratio of the step (0 in the normal regime)
+			self.train_targets, self.train_rat_lds = tf.cond(self.lds_mode, lds_regime, lambda: (self.targets, tf.constant(0.0)))
+
+			# LdS targets, ratios and loss for evaluation in both regimes, they are only computed when fetched
+			self.read_inps, self.rat_lds, self.rat_corr = lds_targets(self.logits, self.targets, self.alternative_keys, self.word_ids, pad_id,
+				self.word_mask)
+
+			with self.jit_scope():
+				self.train_loss = self.cross_entropy(log_probs, self.train_targets, self.weights)
+				self.loss = self.cross_entropy(log_probs, self.targets, self.weights)
+				self.loss_lds = self.cross_entropy(log_probs, self.read_inps, self.weights)
+				self.loss_reg = self.loss
 
 			# Optimizer
 			if self.optimization == 'GD':
-				self.optimizer = tf.train.GradientDescentOptimizer(self.learning_rate).minimize(self.loss)
+				self.train_optimizer = tf.train.GradientDescentOptimizer(self.learning_rate)
 			elif self.optimization == 'Momentum':
 				print("Learning rate and momentum are set.")
-				self.optimizer = tf.train.MomentumOptimizer(self.learning_rate,self.momentum).minimize(self.loss)
+				self.train_optimizer = tf.train.MomentumOptimizer(self.learning_rate,self.momentum)
 			elif self.optimization == 'Adam':
 				print("No learning rate to set.")
-				self.optimizer = tf.train.AdamOptimizer().minimize(self.loss)
-				self.lds_optimizer = tf.train.AdamOptimizer().minimize(self.loss_lds)
+				self.train_optimizer = tf.train.AdamOptimizer()
 			elif self.optimization == 'Adadelta':
 				print("No learning rate to set.")
-				self.optimizer = tf.train.AdadeltaOptimizer().minimize(self.loss)
+				self.train_optimizer = tf.train.AdadeltaOptimizer()
 			elif self.optimization == 'Adagrad':
-				self.optimizer = tf.train.AdagradOptimizer(self.learning_rate).minimize(self.loss)
+				self.train_optimizer = tf.train.AdagradOptimizer(self.learning_rate)
 
 			elif self.optimization == 'RMSProp':
-				self.optimizer = tf.train.RMSPropOptimizer(self.learning_rate).minimize(self.loss)
-				self.lds_optimizer = tf.train.RMSPropOptimizer(self.learning_rate).minimize(self.loss_lds)
+				self.train_optimizer = tf.train.RMSPropOptimizer(self.learning_rate)
+
+			with self.jit_scope():
+				self.optimizer = self.train_optimizer.minimize(self.train_loss)
+			self.lds_optimizer = self.optimizer
+
+
+
+	def replica_gradients(self):
+		"""
+		Splits the train op for data-parallel training (see train_parallel.py): self.gradients are the (dense) gradients of
+		self.train_loss w.r.t. self.train_variables, self.apply_gradients applies the gradients fed to self.gradient_inputs 
+		(e.g. averaged over all replicas) with the optimizer of self.optimizer, i.e. it shares its slots. Call after backward().
+		"""
+
+		with tf.name_scope("replica_"+ self.task):
+
+			grads_and_vars = [(g, v) for g, v in self.train_optimizer.compute_gradients(self.train_loss) if g is not None]
+			self.train_variables = [v for _, v in grads_and_vars]
+			# Embedding gradients are sparse (IndexedSlices), but replicas exchange dense buffers
+			self.gradients = [tf.convert_to_tensor(g) for g, _ in grads_and_vars]
+			self.gradient_inputs = [tf.placeholder(tf.float32, v.shape, name='gradient_input') for v in self.train_variables]
+			self.apply_gradients = self.train_optimizer.apply_gradients(zip(self.gradient_inputs, self.train_variables))
+
+
+
+	def cross_entropy(self, log_probs, targets, weights):
+		""" Weighted mean cross entropy of TARGETS (like sequence_loss), on the log-softmax LOG_PROBS shared by all losses """
+
+		crossent = -tf.squeeze(tf.batch_gather(log_probs, targets[...,None]), -1)
+		return tf.reduce_sum(crossent * weights) / (tf.reduce_sum(weights) + 1e-12)
+
+
+
+	def training_metrics(self, pad_id, lds=True):
+		"""
+		Streaming metrics of the training batches, accumulated in local variables by the training step itself (fetch 
+		self.metrics_update together with the optimizer). This saves a second pass over the training set, but the statistics 
+		are taken with dropout and before every update. Run self.metrics_reset at the beginning of every epoch and read 
+		self.metrics at its end. Call after backward().
+
+		Parameters:
+		--------------
+		PAD_ID          {int} the <PAD> index of the output dictionary (ignored by the accuracies as in utils.acc_new)
+		LDS             {bool} whether the LdS loss and ratio of the LdS regime are tracked (needs the keys of the alternative targets)
+		"""
 
+		with tf.variable_scope("metrics_"+ self.task) as metrics_scope:
 
+			# Edit distances between the predicted and the target tokens (teacher forced), pads are removed
+			predictions = tf.argmax(self.logits, axis=-1, output_type=tf.int32)
+			predictions = tf.where(tf.equal(predictions, pad_id), tf.zeros_like(predictions), predictions)
+			targets = tf.where(tf.equal(self.targets, pad_id), tf.zeros_like(self.targets), self.targets)
+			dists = tf.edit_distance(tf.contrib.layers.dense_to_sparse(predictions), tf.contrib.layers.dense_to_sparse(targets))
+			# Filling rows have no targets (infinite distances), they are masked out
+			dists = tf.where(self.word_mask > 0, dists, tf.zeros_like(dists))
 
+			metrics = {'loss':tf.metrics.mean(self.loss), 'token_acc':tf.metrics.mean(1 - dists, weights=self.word_mask), 
+				'word_acc':tf.metrics.mean(tf.cast(tf.equal(dists, 0), tf.float32), weights=self.word_mask)}
+			if lds:
+				# Taken from the train op, i.e. the regular loss and a ratio of 0 in the normal regime
+				metrics['loss_lds'] = tf.metrics.mean(self.train_loss)
+				metrics['rat_lds'] = tf.metrics.mean(self.train_rat_lds)
 
+			self.metrics = {name:value for name, (value, _) in metrics.items()}
+			self.metrics_update = tf.group(*[update for _, update in metrics.values()])
+			self.metrics_reset = tf.variables_initializer(tf.local_variables(scope=metrics_scope.name))
 
 
 
+	def distillation(self, temperature=2.0, alpha=0.5):
+		"""
+		Knowledge distillation: the model (student) is trained on the softened output distribution of a trained teacher model 
+		(fed per batch to self.teacher_logits, teacher-forced on the same outputs) and on the fed (hard) targets.
+		The soft loss is scaled by TEMPERATURE**2 to keep its gradients in the range of the hard loss. Call after backward().
 
+		Parameters:
+		--------------
+		TEMPERATURE     {float} softens both output distributions (1.0 leaves them unchanged)
+		ALPHA           {float} weight of the soft loss, the hard loss (self.loss) is weighted by 1-ALPHA
+		"""
 
+		with tf.name_scope("distillation_"+ self.task):
 
+			self.teacher_logits = tf.placeholder(tf.float32, (None,None,self.num_classes), 'teacher_logits')
+			soft_targets = tf.stop_gradient(tf.nn.softmax(self.teacher_logits / temperature))
+			soft_crossent = tf.nn.softmax_cross_entropy_with_logits_v2(labels=soft_targets, logits=self.logits / temperature)
+			self.soft_loss = tf.reduce_sum(soft_crossent * self.weights) / (tf.reduce_sum(self.weights) + 1e-12)
+			self.distill_loss = alpha * temperature**2 * self.soft_loss + (1 - alpha) * self.loss
 
+			# The optimizer of backward(), distillation shares its slots
+			with self.jit_scope():
+				self.distill_optimizer = self.train_optimizer.minimize(self.distill_loss)
@@ -0,0 +1,272 @@
+import warnings, os, argparse
+warnings.filterwarnings("ignore",category=FutureWarning)
+import tensorflow as tf
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+from time import time
+
+from loss_lds import lds_targets
+
+
+"""
+TF2 implementation of the bidirectional bLSTM on Keras layers, without tf.contrib. Training step and greedy decoding are
+compiled with tf.function (fixed input signatures, so they are traced once), and the LSTM layers use the fused (oneDNN)
+kernels of Keras: dropout is applied on the inputs of the layers, outside of the recurrence.
+
+The architecture equals bLSTM.py (bidirectional encoder, one decoder LSTM initialized with the concatenated final states of
+all encoder layers, fully connected layer, logits), so the weights of trained TF1 runs (my_test_model-*) can be loaded with
+load_tf1_checkpoint. The LdS targets are selected in-graph as in bLSTM (loss_lds.lds_targets).
+Requires TensorFlow 2.
+
+Usage:
+    model = KerasbLSTM.from_run(<run folder>, 249, 'write', go_id)
+    loss, rat_lds = model.training_step(inputs, outputs, targets, alt_keys, word_ids, lds_mode)
+    predictions = model.greedy_decode(inputs, decode_length)
+
+    python bLSTM_keras.py --path <run folder> --epochs 249 --task write --data ../data/celex.npz
+"""
+
+
+ACTIVATIONS = {'None':None, None:None, 'ReLU':tf.nn.relu, 'ReLU6':tf.nn.relu6, 'Tanh':tf.nn.tanh, 'Sigmoid':tf.sigmoid}
+
+
+
+def keras_optimizer(optimization, learning_rate=1e-3, momentum=0.01):
+    """
+    The Keras counterpart of the tf.train optimizer of bLSTM.backward, with the same hyperparameters (e.g. epsilons). The 
+    update rules are those of Keras, for RMSProp they differ: Keras starts the mean square at 0 and adds epsilon outside of 
+    the square root, tf.train.RMSPropOptimizer starts it at 1 and adds epsilon inside. The first steps after loading a TF1 
+    checkpoint thus differ from those of a continued TF1 run.
+    """
+
+    if optimization == 'GD':
+        return tf.keras.optimizers.SGD(learning_rate)
+    elif optimization == 'Momentum':
+        return tf.keras.optimizers.SGD(learning_rate, momentum=momentum)
+    elif optimization == 'Adam':
+        return tf.keras.optimizers.Adam(1e-3, epsilon=1e-8)
+    elif optimization == 'Adadelta':
+        return tf.keras.optimizers.Adadelta(1e-3, epsilon=1e-8)
+    elif optimization == 'Adagrad':
+        return tf.keras.optimizers.Adagrad(learning_rate)
+    elif optimization == 'RMSProp':
+        return tf.keras.optimizers.RMSprop(learning_rate, rho=0.9, epsilon=1e-10)
+    raise ValueError("Unknown optimization " + str(optimization))
+
+
+
+def convert_lstm_weights(kernel, bias, forget_bias=1.0):
+    """
+    Converts the weights of a TF1 LSTMCell (or LSTMBlockFusedCell) into those of a Keras LSTM layer. The TF1 kernel acts on
+    [inputs, h] with the gates in the order (i, j, f, o) and the forget bias is added at runtime; Keras splits the kernel
+    into input and recurrent kernel, orders the gates (i, f, c, o) and has the forget bias in the bias.
+
+    Parameters:
+    --------------
+    KERNEL          {np.array}  2D  of shape (input_size + units) x 4*units
+    BIAS            {np.array}  1D  of shape 4*units
+    FORGET_BIAS     {float} the forget_bias of the TF1 cell (1.0 by default)
+
+    Returns:
+    --------------
+    WEIGHTS         {list} kernel, recurrent kernel and bias of the Keras LSTM
+    """
+
+    units = kernel.shape[1] // 4
+    i, j, f, o = np.split(kernel, 4, axis=1)
+    kernel = np.concatenate([i, f, j, o], axis=1)
+    b_i, b_j, b_f, b_o = np.split(bias, 4)
+    bias = np.concatenate([b_i, b_f + forget_bias, b_j, b_o])
+
+    return [kernel[:-units], kernel[-units:], bias]
+
+
+
+class KerasbLSTM(tf.keras.Model):
+
+    """
+    Bidirectional encoder-decoder LSTM as bLSTM (bidirectional=True), with the same hyperparameters. DROPOUT is the keep
+    probability during training. PAD_ID and GO_ID are the <PAD> and <GO> indices of the output dictionary.
+    """
+
+    def __init__(self, input_seq_length, output_seq_length, input_dict_size, num_classes, input_embed_size, output_embed_size,
+        num_layers, num_LSTM_cells, task='write', optimization='RMSProp', learning_rate=1e-3, momentum=0.01, activation_fn=None,
+        dropout=1.0, fc_size=128, pad_id=0, go_id=1):
+
+        super(KerasbLSTM, self).__init__(name='writing' if task == 'write' else 'reading')
+
+        self.input_seq_length = input_seq_length
+        self.output_seq_length = output_seq_length
+        self.num_classes = num_classes + 1              # +1 as in bLSTM
+        self.num_layers = num_layers
+        self.num_LSTM_cells = num_LSTM_cells
+        self.task = task
+        self.pad_id = pad_id
+        self.go_id = go_id
+
+        uniform = tf.keras.initializers.RandomUniform(-1.0, 1.0)
+        self.input_embedding = tf.keras.layers.Embedding(input_dict_size + 1, input_embed_size, embeddings_initializer=uniform)
+        self.output_embedding = tf.keras.layers.Embedding(self.num_classes, output_embed_size, embeddings_initializer=uniform)
+
+        self.encoder_dropout = [tf.keras.layers.Dropout(1 - dropout) for _ in range(num_layers)]
+        self.encoder = [tf.keras.layers.Bidirectional(tf.keras.layers.LSTM(num_LSTM_cells, return_sequences=True, return_state=True))
+            for _ in range(num_layers)]
+        self.decoder = tf.keras.layers.LSTM(2 * num_layers * num_LSTM_cells, return_sequences=True, return_state=True)
+
+        activation = ACTIVATIONS[activation_fn]
+        self.fc = tf.keras.layers.Dense(fc_size, activation=activation)
+        self.fc_dropout = tf.keras.layers.Dropout(1 - dropout)
+        self.logits_layer = tf.keras.layers.Dense(self.num_classes, activation=activation)
+
+        self.train_optimizer = keras_optimizer(optimization, learning_rate, momentum)
+
+        # Build all layers (e.g. to load weights before the first step)
+        self(tf.zeros([1, 1], tf.int32), tf.zeros([1, 1], tf.int32))
+
+
+    def encode(self, inputs, training=False):
+        """ Runs the encoder, returns the decoder's initial state [h, c] (final states of all layers, fw then bw) """
+
+        layer_input = self.input_embedding(inputs)
+        final_h, final_c = [], []
+        for dropout, layer in zip(self.encoder_dropout, self.encoder):
+            layer_input, fw_h, fw_c, bw_h, bw_c = layer(dropout(layer_input, training=training))
+            final_h += [fw_h, bw_h]
+            final_c += [fw_c, bw_c]
+
+        return [tf.concat(final_h, 1), tf.concat(final_c, 1)]
+
+
+    def project(self, dec_outputs, training=False):
+        """ Fully connected layer + dropout + logits layer, as bLSTM.output_projection """
+
+        return self.logits_layer(self.fc_dropout(self.fc(dec_outputs), training=training))
+
+
+    def call(self, inputs, outputs, training=False):
+        """ Teacher-forced logits of shape batch_size x seq_len x num_classes (INPUTS and OUTPUTS without <GO> / last token) """
+
+        dec_outputs, _, _ = self.decoder(self.output_embedding(outputs), initial_state=self.encode(inputs, training))
+        return self.project(dec_outputs, training)
+
+
+    def cross_entropy(self, logits, targets):
+        """ Mean cross entropy of TARGETS over all tokens (as bLSTM.cross_entropy with unit weights) """
+
+        return tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=targets, logits=logits))
+
+
+    @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int32), tf.TensorSpec([None, None], tf.int32),
+        tf.TensorSpec([None, None], tf.int32), tf.TensorSpec([None], tf.int64), tf.TensorSpec([None], tf.int64), 
+        tf.TensorSpec([], tf.bool)])
+    def training_step(self, inputs, outputs, targets, alt_keys, word_ids, lds_mode):
+        """
+        One optimization step. In the LdS regime (LDS_MODE), generated words that are accepted spellings (ALT_KEYS, see
+        utils.spelling_keys, of the words WORD_IDS) become their own targets. Returns the loss and the ratio of such words.
+        """
+
+        with tf.GradientTape() as tape:
+            logits = self(inputs, outputs, training=True)
+            read_inps, rat_lds, _ = lds_targets(logits, targets, alt_keys, word_ids, self.pad_id)
+            train_targets = tf.where(lds_mode, tf.cast(read_inps, tf.int32), targets)
+            loss = self.cross_entropy(logits, train_targets)
+
+        gradients = tape.gradient(loss, self.trainable_variables)
+        self.train_optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+
+        return loss, rat_lds
+
+
+    @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int32), tf.TensorSpec([], tf.int32)])
+    def greedy_decode(self, inputs, decode_length):
+        """ Greedy decoding as bLSTM.inference: the encoder runs once and the decoder advances one token per step """
+
+        state = self.encode(inputs)
+        tokens = tf.fill([tf.shape(inputs)[0]], self.go_id)
+        predictions = tf.TensorArray(tf.int32, size=decode_length)
+
+        for t in tf.range(decode_length):
+            dec_output, state = self.decoder.cell(self.output_embedding(tokens), state)
+            tokens = tf.argmax(self.project(dec_output), axis=-1, output_type=tf.int32)
+            predictions = predictions.write(t, tokens)
+
+        # batch_size x decode_length (without the <GO> token)
+        return tf.transpose(predictions.stack())
+
+
+    def load_tf1_checkpoint(self, checkpoint):
+        """ Loads the weights of the module of a TF1 checkpoint (e.g. .../my_test_model-249), see convert_lstm_weights """
+
+        reader = tf.train.load_checkpoint(checkpoint)
+        encoding = self.name + '/encoding_' + self.task + '/'
+        decoding = self.name + '/decoding_' + self.task + '/'
+
+        self.input_embedding.set_weights([reader.get_tensor(encoding + 'enc_embedding')])
+        for layer, bidirectional in enumerate(self.encoder):
+            weights = []
+            for direction in ['fw', 'bw']:
+                cell = encoding + 'stack_bidirectional_rnn/cell_{}/bidirectional_rnn/{}/lstm_cell/'.format(layer, direction)
+                weights += convert_lstm_weights(reader.get_tensor(cell + 'kernel'), reader.get_tensor(cell + 'bias'))
+            bidirectional.set_weights(weights)
+
+        self.output_embedding.set_weights([reader.get_tensor(decoding + 'dec_embedding')])
+        self.decoder.set_weights(convert_lstm_weights(reader.get_tensor(decoding + 'rnn/lstm_cell/kernel'),
+            reader.get_tensor(decoding + 'rnn/lstm_cell/bias')))
+        for layer, scope in [(self.fc, 'fully_connected'), (self.logits_layer, 'fully_connected_1')]:
+            layer.set_weights([reader.get_tensor(decoding + scope + '/weights'), reader.get_tensor(decoding + scope + '/biases')])
+
+
+    @classmethod
+    def from_run(cls, path, epochs, task, go_id, pad_id=0):
+        """ Builds the model of TASK with the hyperparameters of the run in PATH and loads its checkpoint of EPOCHS """
+
+        import utils
+
+        model_args_write = utils.read_model_args(path)
+        if not model_args_write[17]:
+            raise ValueError("Only models with a bidirectional encoder are implemented in Keras.")
+        model_args = model_args_write[:8] if task == 'write' else utils.reading_model_args(model_args_write)[:8]
+
+        model = cls(*model_args, task=task, optimization=model_args_write[12], learning_rate=model_args_write[13],
+            momentum=model_args_write[15], activation_fn=model_args_write[16], dropout=model_args_write[22],
+            fc_size=model_args_write[25] if len(model_args_write) > 25 else 128, pad_id=pad_id, go_id=go_id)
+        model.load_tf1_checkpoint(path + '/my_test_model-' + str(epochs))
+
+        return model
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--task', default='write', type=str,
+                        help="The module to load. Choose from {write, read}.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    args = parser.parse_args()
+
+    import utils
+    from quantize import edit_distances
+
+    data = np.load(args.data)
+    inputs = data['phons'] if args.task == 'write' else data['words']
+    targets = data['words'] if args.task == 'write' else data['phons']
+    output_dict = utils.np_dict_to_dict(data['word_dict'] if args.task == 'write' else data['phon_dict'])
+
+    model = KerasbLSTM.from_run(args.path, args.epochs, args.task, output_dict['<GO>'], output_dict['<PAD>'])
+    test_indices = utils.read_model_args(args.path)[24]
+
+    # The first call traces and compiles the decoder
+    model.greedy_decode(inputs[test_indices[:1],1:].astype(np.int32), model.output_seq_length)
+    t = time()
+    predictions = model.greedy_decode(inputs[test_indices,1:].astype(np.int32), model.output_seq_length).numpy()
+    seconds = time() - t
+
+    dists = edit_distances(predictions, targets[test_indices,1:], output_dict['<PAD>'])
+    print('Keras ' + args.task + ' - Accuracy on test set is for tokens{:>6.3f} and for words {:>6.3f}, {:>7.3f} ms per word'.format(
+        1 - np.mean(dists), np.mean(dists == 0), 1000 * seconds / len(test_indices)))
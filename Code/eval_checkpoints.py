@@ -0,0 +1,259 @@
+import warnings, os, argparse, glob, csv
+warnings.filterwarnings("ignore",category=FutureWarning)
+import multiprocessing as mp
+import tensorflow as tf
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+from time import time
+
+import utils
+
+
+"""
+Evaluates all checkpoints (my_test_model-<epoch>) of a run in parallel and saves a learning curve table to
+<run>/evaluation/learning_curve.csv, with token and word accuracy, LdS ratio and the amount of mistakes per checkpoint,
+task (write, read) and dataset split (train, test).
+
+Every worker process is pinned to its own subset of cores, builds the graph of each task once and only restores the weights
+for every further checkpoint.
+
+Usage:
+    python eval_checkpoints.py --dataset celex --learn_type lds --id 3 --cores_per_worker 4
+"""
+
+
+
+# State of a worker process (session config, graphs, data), see init_worker
+worker = {}
+
+
+
+def init_worker(core_queue):
+    """
+    Pins the worker to the next free subset of cores and configures its thread pools accordingly
+    """
+
+    cores = core_queue.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    worker['config'] = utils.session_config(intra_op_threads=len(cores), inter_op_threads=2)
+
+
+
+def worker_model(task, model_args_write, go_id):
+    """
+    Rebuilds the model of TASK (plus the accuracy graph) once per worker. Returns session, model, saver and accuracy object.
+    """
+
+    if task not in worker:
+        graph = tf.Graph()
+        with graph.as_default():
+            model, saver = utils.rebuild_model(model_args_write, task, go_id)
+            acc_object = utils.acc_new()
+            acc_object.accuracy()
+        graph.finalize()
+        worker[task] = (tf.Session(graph=graph, config=worker['config']), model, saver, acc_object)
+
+    return worker[task]
+
+
+
+def worker_data(path, data_path, alt_path, task, model_args_write):
+    """
+    Loads inputs, targets and dictionaries of TASK once per worker, as well as the length buckets of the run and the tries of
+    the accepted spellings (write only, if alternative targets are given).
+    """
+
+    if ('data', task) not in worker:
+        data = np.load(data_path)
+        phon_dict = utils.np_dict_to_dict(data['phon_dict'])
+        word_dict = utils.np_dict_to_dict(data['word_dict'])
+
+        task_data = {'inputs': data['phons'] if task == 'write' else data['words'],
+                     'targets': data['words'] if task == 'write' else data['phons'],
+                     'output_dict': word_dict if task == 'write' else phon_dict,
+                     'indices': {'train':model_args_write[23], 'test':model_args_write[24]},
+                     'buckets': None, 'tries': {}}
+
+        # Buckets are determined by the length of the input sequence. Runs without reading buckets decode it at full length
+        if os.path.exists(path + '/buckets.npz'):
+            buckets = np.load(path + '/buckets.npz')
+            if task == 'write':
+                task_data['buckets'] = (utils.assign_buckets(data['phons'], phon_dict['<PAD>'], buckets['boundaries']), 
+                    buckets['bucket_lengths'])
+            elif 'read_boundaries' in buckets:
+                task_data['buckets'] = (utils.assign_buckets(data['words'], word_dict['<PAD>'], buckets['read_boundaries']), 
+                    buckets['read_bucket_lengths'])
+
+        if task == 'write' and alt_path is not None and os.path.exists(alt_path):
+            alt_targets = np.load(alt_path)
+            for mode, indices in task_data['indices'].items():
+                task_data['tries'][mode] = utils.SpellingTrie(task_data['targets'][indices,1:],
+                    [np.asarray(alt_targets[ind])[:,1:] for ind in indices])
+
+        worker[('data', task)] = task_data
+
+    return worker[('data', task)]
+
+
+
+def evaluate_checkpoint(job):
+    """
+    Evaluates one checkpoint of one task on the given dataset splits.
+
+    Parameters:
+    --------------
+    JOB             {tuple} (path, epoch, task, data_path, alt_path, modes)
+
+    Returns:
+    --------------
+    ROWS            {list} of dicts, one per mode, the rows of the learning curve table
+    """
+
+    path, epoch, task, data_path, alt_path, modes = job
+    t = time()
+
+    model_args_write = utils.read_model_args(path)
+    data = worker_data(path, data_path, alt_path, task, model_args_write)
+    sess, model, saver, acc_object = worker_model(task, model_args_write, data['output_dict']['<GO>'])
+    saver.restore(sess, path + '/my_test_model-' + str(epoch))
+
+    rows = []
+    for mode in modes:
+        indices = data['indices'][mode]
+        targets = data['targets'][indices,1:]
+        buckets = (data['buckets'][0][indices], data['buckets'][1]) if data['buckets'] is not None else None
+
+        # Decode in chunks of 10000 words
+        predictions = np.concatenate([utils.greedy_decode(sess, model, data['inputs'][indices[k:k+10000],1:],
+            data['output_dict']['<PAD>'], (buckets[0][k:k+10000], buckets[1]) if buckets is not None else None)
+            for k in range(0, len(indices), 10000)])
+
+        fullPred, fullTarg = utils.accuracy_prepare(predictions, targets, data['output_dict'], mode='test')
+        dists, token_acc = sess.run([acc_object.dists, acc_object.token_acc],
+            feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg:fullTarg})
+
+        row = {'epoch':epoch, 'task':task, 'mode':mode, 'samples':len(indices), 'token_acc':token_acc,
+               'word_acc':np.mean(dists == 0), 'mistakes':np.count_nonzero(dists), 'lds_ratio':'', 'lds_mistakes':''}
+
+        if mode in data['tries']:
+            _, rat, matched = utils.lds_compare_trie(predictions, targets, data['tries'][mode])
+            row['lds_ratio'] = rat
+            row['lds_mistakes'] = np.count_nonzero(matched < 0)
+
+        row['seconds'] = time() - t
+        rows.append(row)
+
+    return rows
+
+
+
+def find_checkpoints(path):
+    """ Returns the sorted epochs of all checkpoints my_test_model-<epoch> in PATH """
+
+    files = glob.glob(path + '/my_test_model-*.index')
+    return sorted(int(file[len(path + '/my_test_model-'):-len('.index')]) for file in files)
+
+
+
+def core_subsets(num_workers=None, cores_per_worker=2):
+    """ Splits the available cores into disjoint subsets, one per worker """
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    if num_workers is None:
+        num_workers = max(1, len(cores) // cores_per_worker)
+    num_workers = min(num_workers, len(cores))
+
+    return [subset.tolist() for subset in np.array_split(cores, num_workers)]
+
+
+
+def evaluate_run(path, data_path, alt_path=None, tasks=None, modes=('test',), num_workers=None, cores_per_worker=2):
+    """
+    Evaluates all checkpoints of the run in PATH on a pool of processes and saves the learning curve table.
+
+    Parameters:
+    --------------
+    PATH            {str} the folder of the trained model
+    DATA_PATH       {str} the .npz file of the dataset the model was trained on
+    ALT_PATH        {str} optional, the .npy file with the alternative targets (for the LdS ratio of the writing module)
+    TASKS           {list} from {'write', 'read'}, default is write (and read if the run trained a reading module)
+    MODES           {tuple} dataset splits from {'train', 'test'}
+    NUM_WORKERS     {int} amount of processes, default is as many as CORES_PER_WORKER allows
+    CORES_PER_WORKER{int} size of the core subset of every worker
+
+    Returns:
+    --------------
+    ROWS            {list} of dicts, the rows of the learning curve table
+    """
+
+    epochs = find_checkpoints(path)
+    if not epochs:
+        raise FileNotFoundError("No checkpoints found in " + path)
+
+    if tasks is None:
+        tasks = ['write', 'read'] if utils.read_model_args(path)[18] else ['write']
+
+    jobs = [(path, epoch, task, data_path, alt_path, modes) for task in tasks for epoch in epochs]
+    subsets = core_subsets(num_workers, cores_per_worker)
+    print("Evaluating ", len(epochs), " checkpoints for ", tasks, " on ", len(subsets), " workers with cores ", subsets)
+
+    # Fresh interpreters for the workers (TF is not fork safe)
+    ctx = mp.get_context('spawn')
+    core_queue = ctx.Queue()
+    for subset in subsets:
+        core_queue.put(subset)
+
+    t = time()
+    rows = []
+    with ctx.Pool(len(subsets), initializer=init_worker, initargs=(core_queue,)) as pool:
+        for job_rows in pool.imap_unordered(evaluate_checkpoint, jobs):
+            for row in job_rows:
+                print("Epoch {:>4} {:>5} {:>5} - token acc {:>6.3f}, word acc {:>6.3f}".format(row['epoch'], row['task'],
+                    row['mode'], row['token_acc'], row['word_acc']))
+            rows.extend(job_rows)
+    print("Evaluated ", len(jobs), " checkpoints in ", time()-t, " seconds.")
+
+    rows.sort(key=lambda row: (row['task'], row['mode'], row['epoch']))
+
+    eval_path = path + '/evaluation'
+    if not os.path.exists(eval_path):
+        os.makedirs(eval_path)
+    with open(eval_path + '/learning_curve.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['epoch', 'task', 'mode', 'samples', 'token_acc', 'word_acc', 'mistakes',
+            'lds_ratio', 'lds_mistakes', 'seconds'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print("Learning curve saved to ", eval_path + '/learning_curve.csv')
+
+    return rows
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataset', default='celex', type=str,
+                        help='The dataset on which the model was trained, from {celex, childlex, celex_all}')
+    parser.add_argument('--learn_type', default='normal', type=str,
+                        help='The used learning paradigm. Choose from {normal, lds}.')
+    parser.add_argument('--id', default=0, type=int,
+                        help='The ID of the model that should be examined. Per default 0')
+    parser.add_argument('--path', default=None, type=str,
+                        help='The folder of the trained model. Default is determined from dataset, learn_type and id.')
+    parser.add_argument('--tasks', default=None, nargs='+', type=str,
+                        help="The modules to evaluate, from {write, read}. Default are all modules of the run.")
+    parser.add_argument('--modes', default=['test'], nargs='+', type=str,
+                        help="The dataset splits to evaluate on, from {train, test}.")
+    parser.add_argument('--workers', default=None, type=int,
+                        help='Amount of worker processes. Default is #cores / cores_per_worker.')
+    parser.add_argument('--cores_per_worker', default=2, type=int,
+                        help='Amount of cores every worker is pinned to.')
+    args = parser.parse_args()
+
+    root_local = os.path.expanduser("~")+'/workspace/Models/'
+    path = args.path if args.path is not None else root_local + args.dataset + '/' + args.learn_type + '_run_' + str(args.id)
+
+    evaluate_run(path, root_local + 'data/' + args.dataset + '.npz', root_local + 'data/' + args.dataset + '_alt_targets.npy',
+        args.tasks, tuple(args.modes), args.workers, args.cores_per_worker)
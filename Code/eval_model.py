@@ -5,8 +5,9 @@ import numpy as np
 import matplotlib.pyplot as plt 
 import os, sys, time, argparse
 import utils
+import autotune
 from utils import acc_new 
-from bLSTM import bLSTM
+from predictor import LdSPredictor
 import io
 from time import time
 
@@ -20,29 +21,6 @@ Script to evaluate performance of a model
 
 
 
-if __name__ == '__main__':
-
-	parser = argparse.ArgumentParser()
-
-	parser.add_argument('--dataset', default='celex', type=str,
-						help='The dataset on which the model was trained, from {celex, childlex, celex_all}')
-	parser.add_argument('--learn_type', default='normal', type=str,
-						help='The used learning paradigm. Choose from {normal, lds}.')
-	parser.add_argument('--task', default='write', type=str,
-						help="The task the model solved. Choose from {write, read}.")
-	parser.add_argument('--id', default=0, type=int,
-						help='The ID of the model that should be examined. Per default 0')
-	parser.add_argument('--epochs', default=None, type=int, 
-						help="The timestamp (in epochs) of the model. Default=None (after last epoch).")
-	args = parser.parse_args()
-
-
-
-
-
-
-
-
 class evaluation(object):
 
 	"""
@@ -59,6 +37,7 @@ class evaluation(object):
 		self.task = args.task
 		self.id = args.id 
 		self.epochs = args.epochs - 1 if args.epochs == 250 else args.epochs
+		self.beam_width = args.beam_width
 
 		# Receives the path to the folder of a stored model
 		#self.root_local = os.path.expanduser("~")+'/Desktop/LDS_Data/'
@@ -67,10 +46,9 @@ class evaluation(object):
 		self.path = self.root_local + self.dataset + '/' + self.learn_type + '_run_' + str(self.id)
 		self.eval_path = self.path+'/'+'evaluation'
 
-
-		# Set Accuracy object
-		self.acc_object = acc_new()
-		self.acc_object.accuracy()
+		# Session with the restored model, shared by all analysis methods (see restore)
+		self.sess = None
+		self.embeddings = {}
 
 		# Retrieve relevant data
 		self.retrieve_model_args()
@@ -87,6 +65,8 @@ class evaluation(object):
 		#self.plot_tsne('input')
 		#self.plot_tsne('output')
 
+		self.close()
+
 
 
 
@@ -94,61 +74,13 @@ class evaluation(object):
 		"""
 		Retrieves the hyperparameters of the trained bLSTM (#layers, #nodes, learning rate etc.) which is saved in meta_tags.csv
 		"""
-		import pandas as pd
-
-		df = pd.read_csv(self.path+'/test_tube_data/version_0/meta_tags.csv')
-		raw_args = df['value'].values.tolist()
 
-		self.model_args_write = []
+		self.model_args_write = utils.read_model_args(self.path)
 		self.model_args_read = []
-		types = ['i','i','i','i','i','i','i','i','i','s','s','b','s','f','s','f','s','b','b','i','i','b','f','l','l'] # ends with test_indices
-		for ind,raw_arg in enumerate(raw_args):
-			if types[ind] == 'i':
-				self.model_args_write.append(int(raw_arg))
-			elif types[ind] == 's':
-				self.model_args_write.append(str(raw_arg))
-			elif types[ind] == 'b':
-				self.model_args_write.append(raw_arg==True)  
-			elif types[ind] == 'f':
-				self.model_args_write.append(float(raw_arg))
-			elif types[ind] == 'l':
-				str_inds = list(raw_arg)
-				self.model_args_write.append(self.join_inds(str_inds))
 		
 		# The model parameter ordering refers to the writing module. If reading model should be rebuilt, in- and output are flipped
 		if self.task == 'read':
-
-			# Flip input and output sequence length
-			self.model_args_read.append(self.model_args_write[1]) 
-			self.model_args_read.append(self.model_args_write[0])
-
-			# Flip input and output dict sizes
-			self.model_args_read.append(self.model_args_write[3]) 
-			self.model_args_read.append(self.model_args_write[2])
-
-			# Next arguments are identical for both models
-			self.model_args_read.extend(self.model_args_write[4:9])
-
-			# In reading learn type is always normal, set reading property and set mas=500 (dummy)
-			self.model_args_read.extend(['normal','read',500])
-			self.model_args_read.append(self.model_args_write[-2])
-			self.model_args_read.append(self.model_args_write[-1])
-
-
-
-
-	def join_inds(self,str_inds):
-		""" 
-		Helper method to handle str data from model hyperparameter csv file
-		"""
-
-		number_string = ''.join(str_inds)
-		number_string_list = number_string.split(",")
-		# Remove square brackets
-		number_string_list[0] = number_string_list[0][1:] 
-		number_string_list[-1] = number_string_list[-1][:-1] 
-
-		return list(map(int,number_string_list))
+			self.model_args_read = utils.reading_model_args(self.model_args_write)
 
 
 	def set_hyperparams(self):
@@ -175,192 +107,281 @@ class evaluation(object):
 		#print("OUTPUT DICT", self.output_dict)
 
 
-		self.inp_seq_nat = 'phonetic' if args.task == 'write' else 'orthografic' # To read in a type of sequence
-		self.inp_seq_human = 'spoken' if args.task == 'write' else 'written'
+		self.inp_seq_nat = 'phonetic' if self.task == 'write' else 'orthografic' # To read in a type of sequence
+		self.inp_seq_human = 'spoken' if self.task == 'write' else 'written'
 		self.model_name = 'writing' if self.task == 'write' else 'reading'
-		self.out_seq_len = self.model_args_write[1] if args.task == 'write' else self.model_args_read[1]
+		self.out_seq_len = self.model_args_write[1] if self.task == 'write' else self.model_args_read[1]
 
+		# Length buckets the model was trained with (if any). Buckets are determined by the length of the input sequence
+		self.bucket_ids, self.bucket_lengths = None, None
+		if os.path.exists(self.path + '/buckets.npz'):
+			buckets = np.load(self.path + '/buckets.npz')
+			if self.task == 'write':
+				self.bucket_ids = utils.assign_buckets(self.inputs, self.input_dict['<PAD>'], buckets['boundaries'])
+				self.bucket_lengths = buckets['bucket_lengths']
+			elif 'read_boundaries' in buckets:
+				self.bucket_ids = utils.assign_buckets(self.inputs, self.input_dict['<PAD>'], buckets['read_boundaries'])
+				self.bucket_lengths = buckets['read_bucket_lengths']
+			# Older runs have no reading buckets, the reading module is then decoded with the full sequence lengths
 
 
-	def predict_input(self):
+
+	def build_model(self):
 		"""
-		Use this method for command line interaction with the model (showing its predictions to user-specified input words/phonemes).
-		Leave method with pressing <SPACE>
+		Rebuilds the trained bLSTM (forward pass and inference graph) from its hyperparameters into the default graph.
+		In contrast to tf.train.import_meta_graph this makes the incremental decoder (bLSTM.inference) available also 
+		for models that were saved before it existed. Restore the weights with the returned saver.
+
+		Returns:
+		-------------
+		MODEL 		{bLSTM} the rebuilt model (only forward and inference, no optimization)
+		SAVER 		{tf.train.Saver} to restore the model variables from the checkpoint
 		"""
 
-		loop = True
+		return utils.rebuild_model(self.model_args_write, self.task, self.output_dict['<GO>'], self.beam_width)
 
-		with tf.Session() as sess:
 
-			# Restore model
-			saver = tf.train.import_meta_graph(self.path+'/my_test_model-'+str(self.epochs)+'.meta')
-			print()
-			saver.restore(sess,self.path+'/my_test_model-'+str(self.epochs))
 
+	def restore(self):
+		"""
+		Rebuilds the model and restores the checkpoint once, in an own graph. The session, the model and the accuracy object
+		are cached and shared by show_mistakes, score_alternatives and the embedding analyses.
 
-			#variables_names = [v.name for v in tf.trainable_variables()]
-			#values = sess.run(variables_names)
-			#for v in variables_names:
-			#	print(v)
+		Returns:
+		-------------
+		SESS 		{tf.Session} with the restored model
+		"""
+
+		if self.sess is None:
+			self.graph = tf.Graph()
+			with self.graph.as_default():
+				self.model, saver = self.build_model()
+				self.acc_object = acc_new()
+				self.acc_object.accuracy()
+			self.sess = tf.Session(graph=self.graph, config=autotune.session_config(self.model_args_write, 'decode'))
+			saver.restore(self.sess,self.path+'/my_test_model-'+str(self.epochs))
+			self.graph.finalize()
+			print("Model restored")
+
+		return self.sess
 
-			graph = tf.get_default_graph()
-			keep_prob = graph.get_tensor_by_name(self.model_name+'/keep_prob:0')
-			inputs = graph.get_tensor_by_name(self.model_name+'/input:0')
-			outputs = graph.get_tensor_by_name(self.model_name+'/output:0')
-			logits = graph.get_tensor_by_name(self.model_name+'/decoding_'+args.task+'/logits:0')
 
-			while loop:
 
-				word = input("Please insert a " + self.inp_seq_nat + " sequence: ")
+	def close(self):
+		if self.sess is not None:
+			self.sess.close()
+			self.sess = None
 
-				if word == ' ':
-					loop = False
-					break
 
-				word_num = self.prepare_sequence(word)
-				print(word_num.shape[1],word_num)
-				dec_input = np.zeros([1,1]) + self.output_dict['<GO>']
 
-				for k in range(self.out_seq_len):
-					pred = sess.run(logits, feed_dict={keep_prob:1.0, inputs:word_num, outputs:dec_input})
-					char = pred[:,-1].argmax(axis=-1)
-					dec_input = np.hstack([dec_input, char[:,None]]) # Identical to np.expand_dims(char,1)
-				print(dec_input.shape[1],dec_input)
+	def predict_input(self):
+		"""
+		Use this method for command line interaction with the model (showing its predictions to user-specified input words/phonemes).
+		Leave method with pressing <SPACE>
+		"""
 
-				output = ''.join([self.output_dict_rev[num] if self.output_dict_rev[num]!='<PAD>' else '' for ind,num in enumerate(dec_input[0,1:])])
-				print("The ", self.inp_seq_nat, " sequence ", word, "  =>  ", output, ' num ', dec_input[0,1:])
+		loop = True
 
+		# Restore model (once)
+		predictor = LdSPredictor(self.path, self.epochs, self.task, self.root_local + 'data/' + self.dataset + '.npz')
+		print()
 
+		while loop:
 
-	def prepare_sequence(self,word):
-		"""
-		Prepares a user-inserted word such that it can be feed into the model
+			word = input("Please insert a " + self.inp_seq_nat + " sequence: ")
 
-		Parameters:
-		--------------
-		WORD 		{str}		Can be an orthographic word (if task = read) or a phonetic word (if task = write)
-		"""
-		
-		# Error handling
-		if any(char.isdigit() for char in word):
-			raise TypeError("Please insert a string that contains no numerical values.")
+			if word == ' ':
+				loop = False
+				break
 
-		l = self.model_args_write[0] if args.task == 'write' else self.model_args_read[0] # length of the input sequence 
-		phon_word_num = [self.input_dict[word[-k]] if k<=len(word) else self.input_dict['<PAD>'] for k in range(l,0,-1)]
+			output = predictor.predict([word])[0]
+			print("The ", self.inp_seq_nat, " sequence ", word, "  =>  ", output)
 
-		return np.expand_dims(phon_word_num, axis=0)
+		predictor.close()
 
 
 
-	def show_mistakes(self,mode):
+	def show_mistakes(self, mode, memory_budget=512):
 		"""
-		Show the mistakes of the model on training or testing data and saves the mistakes to a .txt file
+		Show the mistakes of the model on training or testing data and saves the mistakes to a .txt file.
+		The samples are decoded in chunks (sized by MEMORY_BUDGET), mistakes are written per chunk and the accuracy is
+		aggregated over all chunks.
 
 		Parameters:
 		-----------
-		MODE 	{str} either train or test
+		MODE 			{str} either train or test
+		MEMORY_BUDGET 	{int} approximate memory (in MB) used for one chunk
+
+		Returns:
+		-----------
+		TOKEN_ACC 		{float} token accuracy on all samples
+		WORD_ACC 		{float} word accuracy on all samples
 		"""
 
 		# Retrieve indices of samples the model is tested on
-		indices = self.model_args_write[23] if mode=='train' else self.model_args_write[24] # Indices are either train or test indices
-		tested_inputs = self.inputs[indices]
-		tested_targets = self.targets[indices]
+		indices = np.array(self.model_args_write[23] if mode=='train' else self.model_args_write[24]) # Indices are either train or test indices
+		chunk_size = self.chunk_size(memory_budget)
 		t=time()
 
 		if not os.path.exists(self.eval_path):
 			os.makedirs(self.eval_path)
 
-		with tf.Session() as sess: 
+		# Restored model (shared)
+		sess = self.restore()
 
-			# Restore the model
-			saver = tf.train.import_meta_graph(self.path + '/my_test_model-'+str(self.epochs)+'.meta')
-			saver.restore(sess,self.path+'/my_test_model-'+str(self.epochs))
-			graph = tf.get_default_graph()
+		print('\n',"Now printing the mistakes on the ", mode, " dataset")
+		file = io.open(self.eval_path+'/'+self.model_name.upper()+'mistakes_'+mode+'_data_epoch'+str(self.epochs)+'.txt','a',
+			encoding='utf8', buffering=1<<20)
 
+		sum_dists, num_correct, num_mistakes = 0.0, 0, 0
+		for start in range(0, len(indices), chunk_size):
 
-			# Retrieve model variables
-			keep_prob = graph.get_tensor_by_name(self.model_name+'/keep_prob:0')
-			inputs = graph.get_tensor_by_name(self.model_name+'/input:0')
-			outputs = graph.get_tensor_by_name(self.model_name+'/output:0')
-			logits = graph.get_tensor_by_name(self.model_name+'/decoding_'+self.task+'/logits:0')
+			chunk = indices[start:start+chunk_size]
+			tested_inputs = self.inputs[chunk]
+			tested_targets = self.targets[chunk,1:]
+			tested_buckets = (self.bucket_ids[chunk], self.bucket_lengths) if self.bucket_ids is not None else None
 
+			# Encode once, decode in-graph. Output sequence has length of target[1]-1 since <GO> is ignored
+			predictions = utils.greedy_decode(sess, self.model, tested_inputs[:,1:], self.output_dict['<PAD>'], tested_buckets)
 
-			# Prepare model evaluation
-			print("Model restored")
-			if len(tested_inputs) < 10000:
-					
-				dec_input = np.zeros((len(tested_inputs), 1)) + self.output_dict['<GO>']   # len(tested_inputs) = #tested samples
-				for i in range(tested_targets.shape[1]-1): # output sequence has length of target[1] since [0] is batch_size, -1 since <GO> is ignored
-				    test_logits = sess.run(logits, feed_dict={keep_prob:1.0, inputs:tested_inputs[:,1:],outputs:dec_input})
-				    prediction = test_logits[:,-1].argmax(axis=-1)
-				    dec_input = np.hstack([dec_input, prediction[:,None]])
+			# Evaluate performance
+			fullPred, fullTarg = utils.accuracy_prepare(predictions, tested_targets, self.output_dict, mode='test')
+			dists = sess.run(self.acc_object.dists, feed_dict={self.acc_object.fullPred:fullPred, self.acc_object.fullTarg: fullTarg})
+			sum_dists += np.sum(dists)
+			num_correct += np.count_nonzero(dists==0)
 
-				# Evaluate performance
-				fullPred, fullTarg = utils.accuracy_prepare(dec_input[:,1:], tested_targets[:,1:],self.output_dict, mode='test')
-				dists, tokenAcc = sess.run([self.acc_object.dists, self.acc_object.token_acc], feed_dict={self.acc_object.fullPred:fullPred, self.acc_object.fullTarg: fullTarg})
-				wordAcc  = np.count_nonzero(dists==0) / len(dists) 
-				print(self.model_name.upper()+ ' - Accuracy on test set is for tokens{:>6.3f} and for words {:>6.3f}'.format(tokenAcc, wordAcc))
+			# Write the mistakes of the chunk at once
+			mistakes = np.flatnonzero(np.any(predictions != tested_targets, axis=1))
+			num_mistakes += len(mistakes)
+			inp_strs = utils.ids_to_strings(tested_inputs[mistakes], self.input_dict_rev)
+			out_strs = utils.ids_to_strings(predictions[mistakes], self.output_dict_rev)
+			tar_strs = utils.ids_to_strings(tested_targets[mistakes], self.output_dict_rev)
+			file.write(''.join(' '.join(["The ", self.inp_seq_nat, " sequence ", inp_str, "  =>  ", out_str, ' instead of ', tar_str]) + '\n'
+				for inp_str, out_str, tar_str in zip(inp_strs, out_strs, tar_strs)))
 
+		file.close()
 
+		tokenAcc = 1 - sum_dists / max(len(indices), 1)
+		wordAcc = num_correct / max(len(indices), 1)
+		print(self.model_name.upper()+ ' - Accuracy on '+mode+' set is for tokens{:>6.3f} and for words {:>6.3f}'.format(tokenAcc, wordAcc))
+		print("Amount of samples in dataset is ", len(indices), ", amount of mistakes is ", num_mistakes)
+		print("That took ", time()-t)
 
-				print('\n',"Now printing the mistakes on the ", mode, " dataset")
-				file = io.open(self.eval_path+'/'+self.model_name.upper()+'mistakes_'+mode+'_data_epoch'+str(self.epochs)+'.txt','a',encoding='utf8')
+		return tokenAcc, wordAcc
 
-				for ind,pred in enumerate(dec_input[:,1:]):
-					if any(pred != tested_targets[ind,1:]):
 
-						inp_str = ''.join([self.input_dict_rev[k] if self.input_dict_rev[k] != '<PAD>' and self.input_dict_rev[k] != '<GO>'  else '' for k in tested_inputs[ind,:]])
-						out_str = ''.join([self.output_dict_rev[k] if k!=0 and self.output_dict_rev[k] != '<PAD>' else '' for k in pred])
-						tar_str = ''.join([self.output_dict_rev[k] if self.output_dict_rev[k] != '<PAD>' else '' for k in tested_targets[ind,1:]])
-						
-						print("The ", self.inp_seq_nat, " sequence ", inp_str, "  =>  ", out_str, ' instead of ', tar_str, file=file)
-						##print("The ", self.inp_seq_nat, " sequence ", inp_str.encode('utf8') , "  =>  ", out_str.encode('utf8'), ' instead of ', tar_str.encode('utf8'), file=file)
-						#print("The ", self.inp_seq_nat, " sequence ", tested_inputs[ind,:] , "  =>  ",pred, ' instead of ', tested_targets[ind,1:], file=file)
-				print("Amount of samples in dataset is ", str(ind))
-				file.close()
-				print("That took ", time()-t)
 
+	def show_n_best(self, mode, memory_budget=512):
+		"""
+		Decodes the words with beam search and saves the n-best spellings (resp. pronunciations) with their log-likelihoods
+		to a .txt and an .npz file. For the writing module, every hypothesis is also marked whether a LdS teacher would 
+		accept it (true spelling or alternative target).
 
-			else:
-				# Do in batches of size 10000
-				for k in range(len(tested_inputs)//10000):
+		Parameters:
+		-----------
+		MODE 			{str} either train or test
+		MEMORY_BUDGET 	{int} approximate memory (in MB) used for one chunk
+		"""
 
-					tip = tested_inputs[k*10000:(k+1)*10000,:]
-					tar = tested_targets[k*10000:(k+1)*10000,:]
+		if self.beam_width < 1:
+			raise ValueError("The beam search decoder was not built, please set beam_width > 0.")
 
-					dec_input = np.zeros((len(tip), 1)) + self.output_dict['<GO>']   # len(tip) = #tested samples
-					for i in range(tar.shape[1]-1): # output sequence has length of target[1] since [0] is batch_size, -1 since <GO> is ignored
-					    test_logits = sess.run(logits, feed_dict={keep_prob:1.0, inputs:tip[:,1:],outputs:dec_input})
-					    prediction = test_logits[:,-1].argmax(axis=-1)
-					    dec_input = np.hstack([dec_input, prediction[:,None]])
+		indices = np.array(self.model_args_write[23] if mode=='train' else self.model_args_write[24])
+		chunk_size = max(1, self.chunk_size(memory_budget) // self.beam_width)
+		t=time()
 
-					# Evaluate performance
-					fullPred, fullTarg = utils.accuracy_prepare(dec_input[:,1:], tar[:,1:],self.output_dict, mode='test')
-					dists, tokenAcc = sess.run([self.acc_object.dists, self.acc_object.token_acc], feed_dict={self.acc_object.fullPred:fullPred, self.acc_object.fullTarg: fullTarg})
-					wordAcc  = np.count_nonzero(dists==0) / len(dists) 
-					print(self.model_name.upper()+ ' - Accuracy on test set is for tokens{:>6.3f} and for words {:>6.3f}'.format(tokenAcc, wordAcc))
+		if not os.path.exists(self.eval_path):
+			os.makedirs(self.eval_path)
 
+		# Accepted spellings, to mark the LdS correct hypotheses
+		trie = None
+		alt_path = self.root_local + 'data/' + self.dataset + '_alt_targets.npy'
+		if self.task == 'write' and os.path.exists(alt_path):
+			alt_targets = np.load(alt_path)
+			trie = utils.SpellingTrie(self.targets[indices,1:], [np.asarray(alt_targets[ind])[:,1:] for ind in indices])
+
+		sess = self.restore()
+		predictions, scores = [], []
+		for start in range(0, len(indices), chunk_size):
+			chunk = indices[start:start+chunk_size]
+			tested_buckets = (self.bucket_ids[chunk], self.bucket_lengths) if self.bucket_ids is not None else None
+			chunk_predictions, chunk_scores = utils.beam_decode(sess, self.model, self.inputs[chunk,1:], self.output_dict['<PAD>'],
+				tested_buckets)
+			predictions.append(chunk_predictions)
+			scores.append(chunk_scores)
+		predictions, scores = np.concatenate(predictions), np.concatenate(scores)
+
+		num_words, beam_width, seq_len = predictions.shape
+		strings = utils.ids_to_strings(predictions.reshape(-1, seq_len), self.output_dict_rev).reshape(num_words, beam_width)
+		accepted = np.full((num_words, beam_width), -1)
+		if trie is not None:
+			accepted = trie.match(predictions.reshape(-1, seq_len), np.repeat(np.arange(num_words), beam_width)).reshape(num_words, beam_width)
+
+		# Save the n-best lists
+		inp_strs = utils.ids_to_strings(self.inputs[indices], self.input_dict_rev)
+		tar_strs = utils.ids_to_strings(self.targets[indices,1:], self.output_dict_rev)
+		filename = self.eval_path+'/'+self.model_name.upper()+'_n_best_'+mode+'_data_epoch'+str(self.epochs)
+		with io.open(filename + '.txt', 'w', encoding='utf8', buffering=1<<20) as file:
+			file.write(''.join(inp_str + ' (' + tar_str + '):  ' + ',  '.join(hyp + ' {:.3f}'.format(score) + ('*' if acc >= 0 else '')
+				for hyp, score, acc in zip(hyps, word_scores, word_accepted)) + '\n'
+				for inp_str, tar_str, hyps, word_scores, word_accepted in zip(inp_strs, tar_strs, strings, scores, accepted)))
+		np.savez(filename + '.npz', indices=indices, predictions=predictions, scores=scores, accepted=accepted)
+
+		if trie is not None:
+			print(self.model_name.upper() + ' - LdS accepted spellings among the ' + str(beam_width) + ' best: {:>6.3f} per word'.format(
+				np.mean(np.sum(accepted >= 0, axis=1))))
+		print("N-best lists saved to ", filename, ". That took ", time()-t)
+
+
+
+	def chunk_size(self, memory_budget):
+		"""
+		Amount of samples that can be decoded at once within MEMORY_BUDGET (in MB). Estimates the floats of the encoder outputs,
+		the decoder states and logits as well as the ids and strings per sample.
+		"""
 
+		in_len, out_len = self.inputs.shape[1] - 1, self.targets.shape[1] - 1
+		num_layers, num_nodes = self.model_args_write[6], self.model_args_write[7]
+		fc_size = self.model_args_write[25] if len(self.model_args_write) > 25 else 128
 
-					print('\n',"Now printing the mistakes on the ", mode, " dataset")
-					file = io.open(self.eval_path+'/'+self.model_name.upper()+'mistakes_'+mode+'_data_epoch'+str(self.epochs)+'.txt','a',encoding='utf8')
+		floats = in_len * 2 * num_layers * num_nodes + out_len * (len(self.output_dict) + fc_size) + 8 * 2 * num_layers * num_nodes
+		per_sample = 4 * floats + 8 * (in_len + 2 * out_len) + 4 * 4 * (in_len + 2 * out_len)
 
-					for ind,pred in enumerate(dec_input[:,1:]):
-						if any(pred != tar[ind,1:]):
+		return max(1, int(memory_budget * 2**20 // per_sample))
 
-							inp_str = ''.join([self.input_dict_rev[k] if self.input_dict_rev[k] != '<PAD>' and self.input_dict_rev[k] != '<GO>'  else '' for k in tip[ind,:]])
-							out_str = ''.join([self.output_dict_rev[k] if k!=0 and self.output_dict_rev[k] != '<PAD>' else '' for k in pred])
-							tar_str = ''.join([self.output_dict_rev[k] if self.output_dict_rev[k] != '<PAD>' else '' for k in tar[ind,1:]])
-							
-							print("The ", self.inp_seq_nat, " sequence ", inp_str, "  =>  ", out_str, ' instead of ', tar_str, file=file)
-							##print("The ", self.inp_seq_nat, " sequence ", inp_str.encode('utf8') , "  =>  ", out_str.encode('utf8'), ' instead of ', tar_str.encode('utf8'), file=file)
-							#print("The ", self.inp_seq_nat, " sequence ", tip[ind,:] , "  =>  ",pred, ' instead of ', tested_targets[ind,1:], file=file)
-					print("Amount of samples in dataset is ", str(ind))
-					file.close()
-					print("That took ", time()-t)
 
 
+	def score_alternatives(self, mode):
+		"""
+		Scores the true and all alternative spellings of every word with the writing model (teacher forcing, see bLSTM.scoring).
+		Saves the probabilities of writing each word correctly resp. in an accepted alternative way, as well as the ranking of
+		the alternative spellings, to an .npz file.
 
+		Parameters:
+		-----------
+		MODE 	{str} either train or test
+		"""
+
+		if self.task != 'write':
+			raise ValueError("Alternative spellings can only be scored for the writing module.")
+
+		indices = self.model_args_write[23] if mode=='train' else self.model_args_write[24]
+		alt_targets = np.load(self.root_local + 'data/' + self.dataset + '_alt_targets.npy')[indices]
+
+		# Remove the <GO> token of targets and alternative targets
+		spellings = utils.accepted_spellings(self.targets[indices,1:], [np.asarray(alts)[:,1:] for alts in alt_targets])
+
+		if not os.path.exists(self.eval_path):
+			os.makedirs(self.eval_path)
+
+		log_likelihood = utils.score_spellings(self.restore(), self.model, self.inputs[indices,1:], spellings)
+
+		p_correct, p_lds, ranking = utils.lds_acceptance(log_likelihood)
+		print(self.model_name.upper() + ' - Mean probability of correct spelling {:>6.3f} and of LdS accepted spelling {:>6.3f}'.format(
+			np.mean(p_correct), np.mean(p_lds)))
+
+		np.savez(self.eval_path+'/'+self.model_name.upper()+'_lds_acceptance_'+mode+'_data_epoch'+str(self.epochs)+'.npz', 
+			p_correct=p_correct, p_lds=p_lds, ranking=np.array(ranking, dtype=object), log_likelihood=np.array(log_likelihood, dtype=object))
 
 
 
@@ -458,10 +479,10 @@ class evaluation(object):
 	
 		dic = self.input_dict_rev if mode == 'input' else self.output_dict_rev
 
-		t = time.time()
+		t = time()
 		tsne = TSNE(n_components=2, verbose=1, perplexity=perplexity, n_iter=steps, learning_rate=lr, init=init, angle=angle)
 		tsne_results = tsne.fit_transform(weight_vectors)
-		print('t-SNE done! Time elapsed: {} seconds'.format(time.time()-t))
+		print('t-SNE done! Time elapsed: {} seconds'.format(time()-t))
 
 		fig = plt.figure(figsize = (8,8))
 		ax = fig.add_subplot(1,1,1) 
@@ -495,37 +516,44 @@ class evaluation(object):
 		WEIGHT_VECTOR 	{np.array} of shape dict_size x embedding_dimension
 		"""
 
-		
-		with tf.Session() as sess:
 
-			# Restore model
-			saver = tf.train.import_meta_graph(self.path+'/my_test_model-'+str(self.epochs)+'.meta')
-			saver.restore(sess,self.path+'/my_test_model-'+str(self.epochs))
-			graph = tf.get_default_graph()
+		# Name of the embedded sequence type
+		if self.task == 'write' and mode == 'input':
+			plotted = 'phonetic'
+		elif self.task == 'write' and mode == 'output':
+			plotted = 'orthographic'
+		elif self.task == 'read' and mode == 'input':
+			plotted = 'orthographic'
+		elif self.task == 'read' and mode == 'output':
+			plotted = 'phonetic'
 
+		# Read the embedding matrix from the restored model (once)
+		if mode not in self.embeddings:
+			sess = self.restore()
+			self.embeddings[mode] = sess.run(self.model.input_embedding if mode == 'input' else self.model.output_embedding)
+		weight_vectors = self.embeddings[mode]
 
-			# Define variable to restore
-			if self.task == 'write' and mode == 'input':
-				plotted = 'phonetic'
-				enc = 'enc'
-			elif self.task == 'write' and mode == 'output':
-				plotted = 'orthographic'
-				enc = 'dec'
-			elif self.task == 'read' and mode == 'input':
-				plotted = 'orthographic'
-				enc = 'enc'
-			elif self.task == 'read' and mode == 'output':
-				plotted = 'phonetic'
-				enc = 'dec'
+		return weight_vectors, plotted
 
-			variable_path = self.model_name + '/' + enc + 'oding_' + self.task + '/'+enc+'_embedding:0'
 
 
-			# Load data and perform PCA
-			weight_vectors = sess.run(graph.get_tensor_by_name(variable_path))
+if __name__ == '__main__':
 
-		return weight_vectors, plotted
+	parser = argparse.ArgumentParser()
 
+	parser.add_argument('--dataset', default='celex', type=str,
+						help='The dataset on which the model was trained, from {celex, childlex, celex_all}')
+	parser.add_argument('--learn_type', default='normal', type=str,
+						help='The used learning paradigm. Choose from {normal, lds}.')
+	parser.add_argument('--task', default='write', type=str,
+						help="The task the model solved. Choose from {write, read}.")
+	parser.add_argument('--id', default=0, type=int,
+						help='The ID of the model that should be examined. Per default 0')
+	parser.add_argument('--epochs', default=None, type=int, 
+						help="The timestamp (in epochs) of the model. Default=None (after last epoch).")
+	parser.add_argument('--beam_width', default=5, type=int, 
+						help="Size of the n-best lists of the beam search decoder (see show_n_best). 0 disables it.")
+	args = parser.parse_args()
 
+	eva = evaluation(args)
 
-eva = evaluation(args)
@@ -0,0 +1,122 @@
+import warnings, os, argparse, json
+warnings.filterwarnings("ignore",category=FutureWarning)
+import tensorflow as tf
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import utils
+from predictor import onnx_path, checkpoint_hash, bucket_lengths
+
+
+"""
+Exports the writing or reading module of a trained run as inference-only ONNX graph, to be run with onnxruntime
+(see predictor.OnnxPredictor), e.g. on CPU-only machines without TensorFlow.
+
+The model is rebuilt without dropout (keep_prob is a constant 1.0) and without loss and optimizers. The variables of the
+checkpoint are frozen into constants and only the subgraph of the greedy decoder (bLSTM.inference) is kept.
+Requires tf2onnx.
+
+Usage:
+    python export_onnx.py --path <run folder> --epochs 249 --task write --data ../data/celex.npz
+"""
+
+
+
+def freeze_model(path, epochs, task, go_id):
+    """
+    Rebuilds the model of TASK without dropout and with standard cells, restores the checkpoint and freezes the greedy decoder.
+
+    Returns:
+    --------------
+    GRAPH_DEF       {tf.GraphDef} the frozen inference graph
+    MODEL           {bLSTM} the rebuilt model (for the tensor names and sequence lengths)
+    """
+
+    model_args_write = utils.read_model_args(path)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        # Fused (LSTMBlockFused) kernels are neither convertible to ONNX nor quantizable, the standard cells restore the same weights
+        model, saver = utils.rebuild_model(model_args_write, task, go_id, dropout=False, cell_impl='standard')
+
+    with tf.Session(graph=graph) as sess:
+        saver.restore(sess, path + '/my_test_model-' + str(epochs))
+        # Only keeps the nodes the decoder output depends on (no scoring graph, no loss)
+        graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(),
+            [model.greedy_predictions.op.name])
+
+    return graph_def, model
+
+
+
+def export(path, epochs, task, data_path, opset=10):
+    """
+    Exports the model to lds_<task>-<epochs>.onnx in PATH, with a .json file of the metadata OnnxPredictor needs.
+
+    Parameters:
+    --------------
+    PATH            {str} the folder of the trained model
+    EPOCHS          {int} the timestamp (in epochs) of the checkpoint
+    TASK            {str} from {'write', 'read'}
+    DATA_PATH       {str} the .npz file of the dataset the model was trained on
+    OPSET           {int} the ONNX opset (>= 10 for the decoding loop)
+
+    Returns:
+    --------------
+    FILE            {str} the exported .onnx file
+    """
+
+    try:
+        from tf2onnx import tfonnx, optimizer
+    except ImportError:
+        raise ImportError("Exporting to ONNX requires tf2onnx, install it with pip install tf2onnx")
+
+    data = np.load(data_path)
+    output_dict = utils.np_dict_to_dict(data['word_dict'] if task == 'write' else data['phon_dict'])
+
+    graph_def, model = freeze_model(path, epochs, task, output_dict['<GO>'])
+    input_names = [model.inputs.name, model.decode_length.name]
+    output_names = [model.greedy_predictions.name]
+
+    with tf.Graph().as_default() as tf_graph:
+        tf.import_graph_def(graph_def, name='')
+        onnx_graph = tfonnx.process_tf_graph(tf_graph, opset=opset, input_names=input_names, output_names=output_names)
+    onnx_graph = optimizer.optimize_graph(onnx_graph)
+    model_proto = onnx_graph.make_model('LdS bLSTM ' + task + ' module, epoch ' + str(epochs))
+
+    file = onnx_path(path, epochs, task)
+    with open(file, 'wb') as f:
+        f.write(model_proto.SerializeToString())
+
+    # Length buckets the model was trained with (if any)
+    lengths = bucket_lengths(path, task)
+
+    meta = {'input_name':input_names[0], 'length_name':input_names[1], 'output_name':output_names[0],
+            'input_seq_length':model.input_seq_length, 'output_seq_length':model.output_seq_length,
+            'bucket_lengths':lengths.tolist() if lengths is not None else None, 'checkpoint':checkpoint_hash(path, epochs), 'opset':opset}
+    with open(file[:-len('.onnx')] + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print("Exported the " + task + " module to " + file)
+
+    return file
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--task', default='write', type=str,
+                        help="The module to export. Choose from {write, read}.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    parser.add_argument('--opset', default=10, type=int,
+                        help='The ONNX opset.')
+    args = parser.parse_args()
+
+    export(args.path, args.epochs, args.task, args.data, args.opset)
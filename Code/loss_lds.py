@@ -27,11 +27,6 @@ from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import math_ops
 from tensorflow.python.ops import gen_math_ops
 from tensorflow.python.ops import nn_ops
-from tensorflow.python.ops import variables
-from tensorflow.python.ops import control_flow_ops
-from tensorflow.python.ops import script_ops
-from tensorflow.python.client import session
-from tensorflow.contrib.seq2seq.python.ops import lds_utils
 
 import numpy as np
 import warnings, os
@@ -41,53 +36,162 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 
 
-__all__ = ["sequence_loss_lds"]
+__all__ = ["sequence_loss_lds", "lds_targets", "spelling_hash", "spelling_key", "MAX_HASH_LENGTH", "KEY_RANGE"]
+
+
+# Polynomial double hash of a spelling: two hashes (bases 131 and 137, modulo two primes < 2**31) combined into one int64.
+# Pads contribute 0 (all other tokens their index + 1) and the powers count from the end of the sequence, so the hash does 
+# not depend on the amount of leading padding (e.g. of length buckets).
+HASH_BASES = (131, 137)
+HASH_PRIMES = (2147483647, 2147483629)
+MAX_HASH_LENGTH = 1024
+HASH_POWERS = np.array([[pow(base, k, prime) for k in range(MAX_HASH_LENGTH)] for base, prime in zip(HASH_BASES, HASH_PRIMES)], 
+  dtype=np.int64)
+
+# The alternative spellings of all words are one sorted table of keys word_index * KEY_RANGE + hash % KEY_RANGE (see 
+# spelling_key), which holds up to 2**23 words. Missing alternatives take no space and a word is checked by binary search.
+KEY_RANGE = 2**40
+
+
+def spelling_hash(sequences, pad_id=0):
+  """
+  Numpy version of the hash (see sequence_loss_lds), to hash the alternative spellings once on the host.
+
+  Parameters:
+  ------------
+  SEQUENCES   {np.array} of shape [..., sequence_length], integer tokens (without <GO>)
+  PAD_ID      {int} the <PAD> index of the output dictionary
+
+  Returns:
+  ------------
+  HASHES      {np.array} of shape [...] and dtype int64
+  """
+
+  sequences = np.where(sequences == pad_id, 0, sequences.astype(np.int64) + 1)
+  seq_len = sequences.shape[-1]
+  hashes = [np.sum(sequences * powers[:seq_len][::-1], axis=-1) % prime for powers, prime in zip(HASH_POWERS, HASH_PRIMES)]
+
+  return hashes[0] * 2**31 + hashes[1]
+
+
+def _spelling_hash(sequences, pad_id):
+  """ In-graph hash of a batch of SEQUENCES of shape batch_size x sequence_length, see spelling_hash """
+
+  sequences = math_ops.cast(sequences, dtypes.int64)
+  sequences = array_ops.where(gen_math_ops.equal(sequences, pad_id), array_ops.zeros_like(sequences), sequences + 1)
+  seq_len = array_ops.shape(sequences)[1]
+  positions = seq_len - 1 - math_ops.range(seq_len)
+
+  hashes = []
+  for k, prime in enumerate(HASH_PRIMES):
+    powers = array_ops.gather(constant_op.constant(HASH_POWERS[k]), positions)
+    hashes.append(math_ops.floormod(math_ops.reduce_sum(sequences * powers, axis=1), prime))
+
+  return hashes[0] * 2**31 + hashes[1]
+
+
+def spelling_key(word_ids, hashes):
+  """ Key of the spellings with HASHES of the words WORD_IDS in the table of alternative spellings (np.arrays or int64 tensors) """
+
+  return word_ids * KEY_RANGE + hashes % KEY_RANGE
+
+
+def lds_targets(logits, targets, alt_keys, word_ids, pad_id=0, mask=None, name='lds_targets'):
+  """
+  The target selection of sequence_loss_lds without the losses: generated words that match one of the alternative spellings
+  become their own targets. Use it to compute the cross entropies on a shared (log-)softmax.
+
+  Parameters:
+  ------------
+  LOGITS      {tf.Tensor} of shape [batch_size, sequence_length, num_decoder_symbols]
+  TARGETS     {tf.Tensor} of shape [batch_size, sequence_length], the true spellings
+  ALT_KEYS    {tf.Tensor} 1D and of dtype int64, the sorted keys of the alternative spellings of all words (see 
+                  sequence_loss_lds)
+  WORD_IDS    {tf.Tensor} of shape [batch_size] and dtype int64, the index of every word of the batch in ALT_KEYS
+  PAD_ID      {int} the <PAD> index of the output dictionary
+  MASK        {tf.Tensor} optional, of shape [batch_size] and dtype float32, the ratios only count words with a mask of 1
+  NAME        {str}, optional. Name for this operation, defaults to "lds_targets"
+
+  Returns:
+  ------------
+  FIN_TARGETS {tf.Tensor} of shape batch_size x seq_len and dtype int64, the new targets
+  RATIO_LDS   {tf.float32} scalar, ratio of words written in an alternative (but accepted) way
+  RATIO_CORR  {tf.float32} scalar, ratio of words written correctly
+  """
+
+  with ops.name_scope(name, "lds_targets", [logits, targets, alt_keys, word_ids]):
+
+      # IDEA:
+      # For every output word of the batch, check whether it matches to any alternative writing
+      # If so, the generated word becomes the target, else take original target.
+      writings = math_ops.cast(math_ops.argmax(logits,axis=-1),dtypes.int64)
+      targets = math_ops.cast(targets, dtypes.int64)
+      writing_hashes = _spelling_hash(writings, pad_id)
+
+      # Binary search of the key of every generated word in the table of alternative writings (one lookup per word)
+      keys = spelling_key(math_ops.cast(word_ids, dtypes.int64), writing_hashes)
+      pos = math_ops.minimum(array_ops.searchsorted(alt_keys, keys), array_ops.size(alt_keys, out_type=dtypes.int32) - 1)
+      lds_correct = gen_math_ops.equal(array_ops.gather(alt_keys, pos), keys)
+      correct = gen_math_ops.equal(writing_hashes, _spelling_hash(targets, pad_id))
+
+      new_targets = array_ops.where(lds_correct, writings, targets)
+      def ratio(words):
+        if mask is None:
+          return math_ops.reduce_mean(math_ops.cast(words, dtypes.float32))
+        return math_ops.reduce_sum(math_ops.cast(words, dtypes.float32) * mask) / math_ops.maximum(math_ops.reduce_sum(mask), 1.0)
+
+      ratio_lds = ratio(lds_correct)
+      ratio_corr = ratio(correct)
+
+      return new_targets, ratio_lds, ratio_corr
 
 
 def sequence_loss_lds(logits,
                   targets,
                   weights,
-                  alt_targets,
-                  max_alt_spellings,
-                  print_ratio=True,
+                  alt_keys,
+                  word_ids,
+                  pad_id=0,
                   name='sequence_loss_lds'):
   """  
   JANNIS BORN - April 2018
   Modified sequence_loss function for the "Lesen durch Schreiben" project
 
   Modifications include:
-  1)  Handing over ALT_TARGETS, a np.array of alternative writings for every word
+  1)  Handing over ALT_KEYS, the hashes of the alternative writings of all words (see spelling_hash and spelling_key)
   2)  Functioning: softmax output is computed regularly. Then, predictions are gen-
-        erated (tf.argmax) and is compared to the true targets and the alt. targets.
-        If a matching was found, logits are manually set to the right sequence with p=1
+        erated (tf.argmax) and compared to the true targets and the alt. targets.
+        If a matching was found, the prediction itself becomes the target of the word
 
+  The comparison works on hashes: the hash of every predicted word is searched (together with the index of the word) in
+  the sorted keys of the alternative spellings, and the new targets are selected with tf.where. Everything stays in the graph.
 
   Parameters:
   ------------
   LOGITS      {tf.Tensor} of shape [batch_size, sequence_length, num_decoder_symbols] 
                   and dtype float32. Corresponds to the prediction across all classes at
-                  each timestep. If SOFTMAX is True, LOGITS are ]-inf, inf[ if SOFTMAX
-                  is False, LOGITS are indeed softmax outputs [0,1].
-  TARGETS     {tf.Tensor} of shape [batch_size, sequence_length] and dtype int64. TARGETS
+                  each timestep.
+  TARGETS     {tf.Tensor} of shape [batch_size, sequence_length] and dtype int32. TARGETS
                   represent the true orthographic spelling of every word.
   WEIGHTS     {tf.Tensor} of shape [batch_size, sequence_length] and dtype float. 
                   WEIGHTS constitutes the weighting of each prediction in the sequence. 
                   For my case: set all values to 1 (set 0 to skip prediction)
-  ALT_TARGETS {tf.Tensor} of shape [batch_size, sequence_length, max_alt_spellings] and
-                  dtype int32. ALT_TARGETS represent the alternative orthographic spellings
-                  that are also considered as being "correct" by the teacher. 
-                  max_alt_spellings refers to the amount of alternative "correct" spellings
-                  of the word with the most alternative correct spellings. If a word has < 
-                  max_alt_spellings the rest of the 3. dim. should be filled with float('NaN')
-  PRINT_RATIO {bool}, Whether the ratio of words that were orthographically incorrect, but accepted 
-                  from LdS teacher should be printed.
+  ALT_KEYS    {tf.Tensor} 1D and of dtype int64. The sorted keys (see spelling_key) of the
+                  alternative orthographic spellings of all words that are also considered as 
+                  being "correct" by the teacher (see utils.spelling_keys).
+  WORD_IDS    {tf.Tensor} of shape [batch_size] and dtype int64. The index of every word of
+                  the batch in ALT_KEYS.
+  PAD_ID      {int} the <PAD> index of the output dictionary
   NAME        {str}, optional. Name for this operation, defaults to "sequence_loss_lds"
 
 
   Returns:
   ------------
-  CROSSENT    {tf.float32} Tensor of rank 1, carrying the cross entropy.
-  FIN_TARGETS {tf.Tensor} of shape batch_size x seq_len 
+  CROSSENT    {tf.float32} scalar, the cross entropy w.r.t. the new targets.
+  FIN_TARGETS {tf.Tensor} of shape batch_size x seq_len and dtype int64, the new targets
+  RATIO_LDS   {tf.float32} scalar, ratio of words written in an alternative (but accepted) way
+  RATIO_CORR  {tf.float32} scalar, ratio of words written correctly
+  CROSSENT_REG{tf.float32} scalar, the cross entropy w.r.t. the true targets.
 
 
   Raises:
@@ -104,47 +208,13 @@ def sequence_loss_lds(logits,
     raise ValueError("Weights must be a [batch_size x sequence_length] tensor")
 
 
-  with ops.name_scope(name, "sequence_loss_lds", [logits, targets, alt_targets, weights, print_ratio,max_alt_spellings]):
-
+  with ops.name_scope(name, "sequence_loss_lds", [logits, targets, alt_keys, word_ids, weights]):
 
-
-      batch_size = targets.get_shape()[0]
-      seq_len = targets.get_shape()[1]
-      num_classes = logits.get_shape()[2]
+      num_classes = array_ops.shape(logits)[2]
       logits_flat = array_ops.reshape(logits, [-1, num_classes]) # Pseudoflat logits of shape [batch_size*seq_len x num_classes]
-      
-      
-      # IDEA:
-      # For every output word of the batch, check whether it matches to any alternative writing
-      # If so, replace the target by the alternative writing, else take original target.
 
-      # For loops are a hustle in TF, thus we make an elementwise compparison
-      writings = math_ops.cast(math_ops.argmax(logits,axis=-1),dtypes.int32)
-
-
-      # wr is now max_alt_writings x bs x seq_len with the first repeated max_alt_writing times
-      # writings_all is intended to make a comparison with an array that includes REAL target, writings leaves that out.
-      writings_all = array_ops.expand_dims(array_ops.ones([max_alt_spellings+1,1],dtype=dtypes.int32), 1) * writings
-      writings     = array_ops.expand_dims(array_ops.ones([max_alt_spellings,1],dtype=dtypes.int32), 1) * writings
-      # transpose to prepare for elementwise comparison
-      writings_all = array_ops.transpose(writings_all,[1,2,0])
-      writings = array_ops.transpose(writings,[1,2,0])
-      # perform elementwise comparison. Result of shape bs x seq_len x max_alt_writings
-      equal_raw = gen_math_ops.equal(writings,alt_targets)
-      # collapse the seq_len dimension, hape gets bs x max_alt_writings, s.t.row-wise the indices of True hold which
-      # writing was generated.
-      equal = math_ops.reduce_all(equal_raw,1) 
-      # Get these indices. Result is shape ? x 2 but ?=bs if every word was written acc. to 1! alt. writing 
-      equal_ind = array_ops.where(equal)
-
-
-      # Compute ratio of correctly spelled words, concatenate true and lds-true spellings
-      both_targs = array_ops.concat([alt_targets,array_ops.expand_dims(targets,2)],2)
-      equal_both_ind = array_ops.where(math_ops.reduce_all(gen_math_ops.equal(writings_all,both_targs),1))
-
-      # Outsource the target tensor update operation from TF to python/numpy (excluded from tensor graph)
-      new_targets, ratio_lds, ratio_corr  = script_ops.py_func(lds_utils.update_tensor,[targets, alt_targets, equal_ind, equal_both_ind], 
-        [dtypes.int64, dtypes.float64, dtypes.float64])
+      new_targets, ratio_lds, ratio_corr = lds_targets(logits, targets, alt_keys, word_ids, pad_id)
+      targets = math_ops.cast(targets, dtypes.int64)
 
 
       crossent = nn_ops.sparse_softmax_cross_entropy_with_logits(labels=array_ops.reshape(new_targets, [-1]), logits=logits_flat)
@@ -160,4 +230,3 @@ def sequence_loss_lds(logits,
       crossent_reg /= total_size
 
       return crossent, new_targets, ratio_lds, ratio_corr, crossent_reg
-
@@ -0,0 +1,489 @@
+import warnings, os, sys, argparse, glob, hashlib, json
+warnings.filterwarnings("ignore",category=FutureWarning)
+import numpy as np
+from collections import OrderedDict
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+
+"""
+Restore a trained writing or reading module once and use it for many (batched) predictions.
+
+Usage:
+    predictor = LdSPredictor(path_to_run, epochs, 'write', path_to_dataset_npz)
+    predictor.predict(['mama', 'maus'])   # phonetic (write) or orthographic (read) strings
+
+OnnxPredictor has the same API but runs the exported model (see export_onnx.py) with onnxruntime, this module then does
+not import TensorFlow at all.
+
+Known words are answered from a prediction table (built once per checkpoint, see LdSPredictor.build_table or the
+--build_table flag), repeated novel words from an LRU cache, only the remaining ones are decoded by the network.
+"""
+
+
+
+def onnx_path(path, epochs, task, quantized=False):
+    """ The file of the exported (or int8 quantized, see quantize.py) model, its metadata are saved next to it as .json """
+
+    return path + '/lds_' + task + '-' + str(epochs) + ('.int8' if quantized else '') + '.onnx'
+
+
+
+def checkpoint_hash(path, epochs):
+    """
+    SHA1 of the variable files of the checkpoint my_test_model-<EPOCHS> (the .index and .data files)
+    """
+
+    sha = hashlib.sha1()
+    files = sorted(glob.glob(path + '/my_test_model-' + str(epochs) + '.index') +
+        glob.glob(path + '/my_test_model-' + str(epochs) + '.data-*'))
+    if not files:
+        raise FileNotFoundError("No checkpoint my_test_model-" + str(epochs) + " in " + path)
+
+    for file in files:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+
+def bucket_lengths(path, task):
+    """
+    The (input, output) sequence lengths per length bucket of TASK (see utils.length_buckets and utils.reading_buckets), 
+    None if the run has no buckets for it
+    """
+
+    if not os.path.exists(path + '/buckets.npz'):
+        return None
+    buckets = np.load(path + '/buckets.npz')
+    if task == 'write':
+        return buckets['bucket_lengths']
+
+    return buckets['read_bucket_lengths'] if 'read_bucket_lengths' in buckets else None
+
+
+
+class PredictionTable(object):
+
+    """
+    Sorted lookup table from encoded input sequences to predicted strings, valid for one checkpoint (identified by its hash).
+    Every sequence is keyed by its bytes, thus a batch of words is looked up at once with np.searchsorted.
+    """
+
+    def __init__(self, keys, outputs, checkpoint):
+
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.outputs = outputs[order]
+        self.checkpoint = checkpoint
+
+
+    @staticmethod
+    def key(seqs):
+        """ Fixed length byte strings of encoded sequences (shifted by 1 since numpy strips trailing zero bytes) """
+
+        seqs = np.asarray(seqs)
+        if seqs.size and seqs.max() > 253:
+            raise ValueError("Vocabulary too large for the prediction table.")
+        return np.ascontiguousarray(seqs + 1, dtype=np.uint8).view('S' + str(seqs.shape[1])).ravel()
+
+
+    def lookup(self, keys):
+        """
+        Returns a bool array whether the KEYS are in the table and an array with their outputs (arbitrary if not found)
+        """
+
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool), np.full(len(keys), '', dtype=self.outputs.dtype)
+
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[pos] == keys, self.outputs[pos]
+
+
+    def save(self, file):
+        np.savez(file, keys=self.keys, outputs=self.outputs, checkpoint=self.checkpoint)
+
+
+    @classmethod
+    def load(cls, file, checkpoint):
+        """ Loads the table from FILE, None if it does not exist or was built from another checkpoint """
+
+        if not os.path.exists(file):
+            return None
+        table = np.load(file)
+        if str(table['checkpoint']) != checkpoint:
+            print("Prediction table " + file + " is outdated, ignoring it.")
+            return None
+
+        return cls(table['keys'], table['outputs'], checkpoint)
+
+
+
+class Predictor(object):
+
+    """
+    Backend independent part of the predictors: encoding of the strings, length buckets, prediction table, LRU cache and
+    decoding of the predicted indices. Backends load the model (load_model) and decode a batch of sequences (decode_batch).
+    """
+
+    # Distinguishes the prediction tables of model variants of the same checkpoint (e.g. quantized models)
+    table_suffix = ''
+
+    def __init__(self, path, epochs, task, data_path, batch_size=10000, cache_size=100000):
+        """
+        Parameters:
+        --------------
+        PATH            {str} the folder of the trained model (with meta_tags.csv and the checkpoints)
+        EPOCHS          {int} the timestamp (in epochs) of the checkpoint, i.e. my_test_model-<EPOCHS>
+        TASK            {str} from {'write', 'read'}
+        DATA_PATH       {str} the .npz file of the dataset the model was trained on (for the dictionaries)
+        BATCH_SIZE      {int} maximal amount of words decoded per run of the model
+        CACHE_SIZE      {int} amount of novel words whose predictions are kept in the LRU cache (0 disables it)
+        """
+
+        self.path = path
+        self.epochs = epochs
+        self.task = task
+        self.data_path = data_path
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        # Dictionaries
+        data = np.load(data_path)
+        phon_dict = {key:data['phon_dict'].item().get(key) for key in data['phon_dict'].item()}
+        word_dict = {key:data['word_dict'].item().get(key) for key in data['word_dict'].item()}
+        self.input_dict = phon_dict if task == 'write' else word_dict
+        self.output_dict = word_dict if task == 'write' else phon_dict
+        self.output_dict_rev = dict(zip(self.output_dict.values(), self.output_dict.keys()))
+
+        # Lookup table from unicode code points to input indices (-1 for unknown characters)
+        single_chars = {char:num for char,num in self.input_dict.items() if len(char) == 1}
+        self.char_table = np.zeros(max(map(ord, single_chars)) + 2, dtype=np.int64) - 1
+        self.char_table[list(map(ord, single_chars))] = list(single_chars.values())
+
+        # Lookup table from output indices to characters (<PAD>, <GO> and 0 are dropped)
+        self.output_table = np.array([self.output_dict_rev.get(k, '') if self.output_dict_rev.get(k) not in ('<PAD>', '<GO>') 
+            else '' for k in range(max(self.output_dict_rev) + 1)])
+        self.output_table[0] = ''
+
+        # Sets input_seq_length, output_seq_length, bucket_lengths and checkpoint
+        self.load_model()
+
+        # Precomputed predictions of the corpus (if built for this checkpoint)
+        self.table_path = path + '/prediction_table_' + task + '-' + str(epochs) + self.table_suffix + '.npz'
+        self.table = PredictionTable.load(self.table_path, self.checkpoint)
+
+
+    def load_model(self):
+        raise NotImplementedError
+
+
+    def decode_batch(self, seqs, decode_length):
+        """ Greedy decoding of DECODE_LENGTH tokens for a batch of encoded (possibly trimmed) sequences """
+        raise NotImplementedError
+
+
+    def encode(self, words):
+        """
+        Converts a list of strings into index sequences (padded at the beginning, without <GO>), vectorized.
+
+        Parameters:
+        --------------
+        WORDS           {list} of str, phonetic (write) or orthographic (read) sequences
+
+        Returns:
+        --------------
+        SEQS            {np.array}  2D  of shape num_words x input_seq_len
+        """
+
+        # Error handling
+        if any(char.isdigit() for word in words for char in word):
+            raise TypeError("Please insert strings that contain no numerical values.")
+
+        lengths = np.array([len(word) for word in words], dtype=np.int64)
+        if np.any(lengths > self.input_seq_length):
+            raise ValueError("Sequences may have at most " + str(self.input_seq_length) + " characters.")
+
+        codes = np.frombuffer(''.join(words).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        ids = self.char_table[np.minimum(codes, len(self.char_table) - 1)]
+        if np.any(ids < 0):
+            unknown = set(char for word in words for char in word if char not in self.input_dict)
+            raise ValueError("Unknown characters " + str(sorted(unknown)))
+
+        # Scatter the characters such that every word ends in the last column
+        rows = np.repeat(np.arange(len(words)), lengths)
+        cols = self.input_seq_length - np.repeat(lengths, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        seqs = np.zeros((len(words), self.input_seq_length), dtype=np.int64) + self.input_dict['<PAD>']
+        seqs[rows, cols] = ids
+
+        return seqs
+
+
+    def buckets(self, seqs):
+        """
+        Assigns encoded words to the smallest length bucket that fits them (-1 if none does)
+        """
+
+        lengths = np.sum(seqs != self.input_dict['<PAD>'], axis=1)
+        fits = self.bucket_lengths[None,:,0] >= lengths[:,None]
+        bucket_ids = np.where(fits, self.bucket_lengths[None,:,0], np.inf).argmin(axis=1)
+        bucket_ids[~fits.any(axis=1)] = -1
+
+        return bucket_ids
+
+
+    def groups(self, seqs, known=False):
+        """
+        Groups encoded words by length bucket. Returns (members, in_len, out_len) per group, the input and decoding length.
+
+        The output length of a bucket is the longest output of the corpus words in it. It is only used for KNOWN words (of the
+        corpus the model was trained on, e.g. by build_table). The outputs of other words may be longer than those of the
+        corpus words of the same input length, they are decoded with the full output length.
+        """
+
+        if self.bucket_lengths is None:
+            return [(np.arange(len(seqs)), self.input_seq_length, self.output_seq_length)]
+
+        bucket_ids = self.buckets(seqs)
+        groups = [(np.flatnonzero(bucket_ids == bucket), in_len, out_len if known else self.output_seq_length) 
+            for bucket, (in_len, out_len) in enumerate(self.bucket_lengths)]
+
+        return groups + [(np.flatnonzero(bucket_ids < 0), self.input_seq_length, self.output_seq_length)]
+
+
+    def predict_ids(self, seqs, known=False):
+        """
+        Decodes encoded words (see encode) in batches, per length bucket if the model was trained with buckets (see groups).
+        Returns the index sequences of shape num_words x output_seq_len
+        """
+
+        # Sequences are padded at the beginning, so trimming and padding back happens on the left
+        predictions = np.zeros((len(seqs), self.output_seq_length), dtype=np.int32) + self.output_dict['<PAD>']
+        for members, in_len, out_len in self.groups(seqs, known):
+            for start in range(0, len(members), self.batch_size):
+                batch = members[start:start+self.batch_size]
+                predictions[batch,-out_len:] = self.decode_batch(seqs[batch,-in_len:], out_len)
+
+        return predictions
+
+
+    def decode(self, ids):
+        """ Converts predicted index sequences into strings, vectorized """
+
+        chars = self.output_table[np.asarray(ids)]
+        strings = np.full(len(chars), '', dtype=self.output_table.dtype)
+        for t in range(chars.shape[1]):
+            strings = np.char.add(strings, chars[:,t])
+
+        return strings
+
+
+    def predict(self, words):
+        """
+        Predicts the spelling (write) or the pronunciation (read) of a list of strings
+
+        Parameters:
+        --------------
+        WORDS           {list} of str, phonetic (write) or orthographic (read) sequences
+
+        Returns:
+        --------------
+        OUTPUTS         {list} of str
+        """
+
+        seqs = self.encode(words)
+        keys = PredictionTable.key(seqs)
+        outputs = np.empty(len(words), dtype=object)
+        todo = np.ones(len(words), dtype=bool)
+
+        # 1) Prediction table
+        if self.table is not None:
+            found, hits = self.table.lookup(keys)
+            outputs[found] = hits[found]
+            todo = ~found
+
+        # 2) LRU cache
+        for ind in np.flatnonzero(todo):
+            if keys[ind] in self.cache:
+                self.cache.move_to_end(keys[ind])
+                outputs[ind] = self.cache[keys[ind]]
+                todo[ind] = False
+
+        # 3) Network (every distinct sequence once)
+        if np.any(todo):
+            new_keys, first, inverse = np.unique(keys[todo], return_index=True, return_inverse=True)
+            new_outputs = self.decode(self.predict_ids(seqs[todo][first]))
+            outputs[todo] = new_outputs[inverse.ravel()]
+
+            if self.cache_size > 0:
+                for key, output in zip(new_keys, new_outputs):
+                    self.cache[key] = output
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        return [str(output) for output in outputs]
+
+
+    def build_table(self):
+        """
+        Decodes all (distinct) inputs of the corpus once and stores them as prediction table next to the checkpoint.
+        """
+
+        data = np.load(self.data_path)
+        seqs = data['phons'][:,1:] if self.task == 'write' else data['words'][:,1:]
+        seqs = np.unique(seqs, axis=0)
+
+        outputs = self.decode(self.predict_ids(seqs, known=True))
+        self.table = PredictionTable(PredictionTable.key(seqs), outputs, self.checkpoint)
+        self.table.save(self.table_path)
+        print("Saved predictions of " + str(len(seqs)) + " sequences to " + self.table_path)
+
+
+    def close(self):
+        pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+class LdSPredictor(Predictor):
+
+    """
+    Keeps the session and the tensor handles of a restored bLSTM warm and decodes with the in-graph decoder (see 
+    bLSTM.inference).
+    """
+
+    def __init__(self, path, epochs, task, data_path, batch_size=10000, config=None, cache_size=100000):
+        """
+        Parameters as for Predictor, additionally:
+        --------------
+        CONFIG          {tf.ConfigProto} optional, the session configuration. Per default the autotuned one (see autotune.py)
+        """
+
+        self.config = config
+        super(LdSPredictor, self).__init__(path, epochs, task, data_path, batch_size, cache_size)
+
+
+    def load_model(self):
+
+        import tensorflow as tf
+        import utils
+        import autotune
+
+        # Rebuild the model in its own graph and restore it once
+        self.model_args_write = utils.read_model_args(self.path)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.model, saver = utils.rebuild_model(self.model_args_write, self.task, self.output_dict['<GO>'])
+        self.sess = tf.Session(graph=self.graph, config=self.config if self.config is not None else 
+            autotune.session_config(self.model_args_write, 'decode'))
+        saver.restore(self.sess, self.path + '/my_test_model-' + str(self.epochs))
+        self.graph.finalize()
+
+        self.input_seq_length = self.model.input_seq_length
+        self.output_seq_length = self.model.output_seq_length
+
+        # Length buckets the model was trained with (if any)
+        self.bucket_lengths = bucket_lengths(self.path, self.task)
+
+        self.checkpoint = checkpoint_hash(self.path, self.epochs)
+
+
+    def decode_batch(self, seqs, decode_length):
+        return self.sess.run(self.model.greedy_predictions, feed_dict={self.model.inputs:seqs, self.model.keep_prob:1.0,
+            self.model.decode_length:decode_length})
+
+
+    def close(self):
+        self.sess.close()
+
+
+
+class OnnxPredictor(Predictor):
+
+    """
+    Runs the exported inference graph (see export_onnx.py) with onnxruntime on the CPU, no TensorFlow needed.
+    """
+
+    def __init__(self, path, epochs, task, data_path, batch_size=10000, threads=0, cache_size=100000, quantized=False):
+        """
+        Parameters as for Predictor, additionally:
+        --------------
+        THREADS         {int} optional, the amount of intra-op threads of onnxruntime (0 lets onnxruntime choose)
+        QUANTIZED       {bool} optional, whether to load the int8 model (see quantize.py) instead of the float model
+        """
+
+        self.threads = threads
+        self.quantized = quantized
+        self.table_suffix = '.int8' if quantized else ''
+        super(OnnxPredictor, self).__init__(path, epochs, task, data_path, batch_size, cache_size)
+
+
+    def load_model(self):
+
+        import onnxruntime as ort
+
+        file = onnx_path(self.path, self.epochs, self.task, self.quantized)
+        with open(file[:-len('.onnx')] + '.json') as f:
+            meta = json.load(f)
+
+        options = ort.SessionOptions()
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        self.sess = ort.InferenceSession(file, options)
+
+        self.input_name, self.length_name, self.output_name = meta['input_name'], meta['length_name'], meta['output_name']
+        self.input_seq_length = meta['input_seq_length']
+        self.output_seq_length = meta['output_seq_length']
+        self.bucket_lengths = np.array(meta['bucket_lengths']) if meta['bucket_lengths'] is not None else None
+        self.checkpoint = meta['checkpoint']
+
+
+    def decode_batch(self, seqs, decode_length):
+        return self.sess.run([self.output_name], {self.input_name:seqs.astype(np.int32), 
+            self.length_name:np.array(decode_length, dtype=np.int32)})[0]
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--task', default='write', type=str,
+                        help="The task the model solved. Choose from {write, read}.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    parser.add_argument('--backend', default='tf', type=str,
+                        help='The inference backend, from {tf, onnx, onnx_int8}. onnx requires an exported model (see '
+                        'export_onnx.py), onnx_int8 a quantized one (see quantize.py).')
+    parser.add_argument('--build_table', default=False, type=bool,
+                        help='Decode the whole corpus of --data once and save it as prediction table of the checkpoint.')
+    parser.add_argument('words', nargs='*',
+                        help='The sequences to predict. If none are given, they are read from stdin (one per line).')
+    args = parser.parse_args()
+
+    backends = {'tf':LdSPredictor, 'onnx':OnnxPredictor, 'onnx_int8':lambda *args: OnnxPredictor(*args, quantized=True)}
+    backend = backends[args.backend]
+
+    if args.build_table:
+        with backend(args.path, args.epochs, args.task, args.data) as predictor:
+            predictor.build_table()
+        sys.exit(0)
+
+    words = args.words if args.words else [line.strip() for line in sys.stdin if line.strip()]
+
+    with backend(args.path, args.epochs, args.task, args.data) as predictor:
+        for word, output in zip(words, predictor.predict(words)):
+            print(word, '=>', output)
@@ -0,0 +1,333 @@
+import warnings, os, argparse, json
+warnings.filterwarnings("ignore",category=FutureWarning)
+import tensorflow as tf
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import utils
+
+
+"""
+Structured pruning of the writing module of a trained run. Whole LSTM units of encoder and decoder and units of the fully
+connected layer (fc1) are removed and a physically smaller, dense checkpoint is saved (to <run>/pruned). It is fine-tuned
+on the training words for --finetune_epochs epochs (normal regime, to <run>/pruned/my_finetuned_model-<epochs>), or with 
+run.py --init_from (any regime, with the logging of run.py).
+
+Encoder and decoder units are coupled: the decoder is initialized with the concatenated final encoder states (layer by
+layer, forward before backward), so unit j of the encoder cell of layer k and direction d is the decoder unit
+(2k + d) * num_nodes + j and both are kept or removed together. Every encoder cell keeps the same amount of units, such that
+the pruned model is again a bLSTM (with fewer num_nodes and a smaller fc_size).
+
+Units are scored either by the magnitude of their weights or by their mean absolute activation on the training words.
+
+Usage:
+    python prune.py --path <run folder> --epochs 249 --data ../data/celex.npz --keep 0.5 --criterion activation --finetune_epochs 5
+    python run.py --task celex --num_nodes 64 --fc_size 64 --init_from <run folder>/pruned/my_pruned_model --epochs 10 ...
+"""
+
+
+ENCODER = 'writing/encoding_write/stack_bidirectional_rnn/cell_{}/bidirectional_rnn/{}/lstm_cell/'
+DECODER = 'writing/decoding_write/rnn/lstm_cell/'
+FC = 'writing/decoding_write/fully_connected/'
+LOGITS = 'writing/decoding_write/fully_connected_1/'
+DIRECTIONS = ['fw', 'bw']
+
+
+
+def gate_columns(units, num_units):
+    """ Columns of the units in an LSTM kernel (or bias), which holds the four gates i, j, f, o one after another """
+    return np.concatenate([gate * num_units + units for gate in range(4)])
+
+
+
+def magnitude_scores(weights, num_layers, num_nodes):
+    """
+    Scores every unit by the L2 norms of its incoming and outgoing weights.
+
+    Parameters:
+    --------------
+    WEIGHTS         {dict} the values of the writing module variables by name
+    NUM_LAYERS      {int} the amount of encoder layers
+    NUM_NODES       {int} the units per encoder cell
+
+    Returns:
+    --------------
+    ENC_SCORES      {np.array}  3D  of shape num_layers x 2 x num_nodes, for the coupled encoder and decoder units
+    FC_SCORES       {np.array}  1D  of shape fc_size
+    """
+
+    dec_units = 2 * num_layers * num_nodes
+    dec_kernel = weights[DECODER + 'kernel']
+    dec_inputs = dec_kernel.shape[0] - dec_units
+
+    # Decoder: gate weights of the unit, its recurrent and its fully connected weights
+    dec_scores = (np.linalg.norm(dec_kernel.reshape(-1, 4, dec_units), axis=(0,1)) + np.linalg.norm(dec_kernel[dec_inputs:], axis=1)
+        + np.linalg.norm(weights[FC + 'weights'], axis=1))
+
+    enc_scores = dec_scores.reshape(num_layers, 2, num_nodes).copy()
+    for k in range(num_layers):
+        for d, direction in enumerate(DIRECTIONS):
+            kernel = weights[ENCODER.format(k, direction) + 'kernel']
+            enc_scores[k,d] += np.linalg.norm(kernel.reshape(-1, 4, num_nodes), axis=(0,1))
+            enc_scores[k,d] += np.linalg.norm(kernel[-num_nodes:], axis=1)
+            # Inputs of both directions of the next layer
+            if k < num_layers - 1:
+                for next_direction in DIRECTIONS:
+                    next_kernel = weights[ENCODER.format(k+1, next_direction) + 'kernel']
+                    enc_scores[k,d] += np.linalg.norm(next_kernel[d*num_nodes:(d+1)*num_nodes], axis=1)
+
+    fc_scores = np.linalg.norm(weights[FC + 'weights'], axis=0) + np.linalg.norm(weights[LOGITS + 'weights'], axis=1)
+
+    return enc_scores, fc_scores
+
+
+
+def activation_scores(sess, model, inputs, outputs, num_layers, num_nodes, batch_size=1000):
+    """
+    Scores every unit by its mean absolute activation on the given words: the final encoder state plus the decoder
+    outputs for the coupled encoder and decoder units, the hidden layer for the fully connected units.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with the restored model
+    MODEL           {bLSTM} the writing module
+    INPUTS          {np.array}  2D  of shape num_words x input_seq_len (without <GO>)
+    OUTPUTS         {np.array}  2D  of shape num_words x output_seq_len (decoder inputs, with <GO>)
+    NUM_LAYERS      {int} the amount of encoder layers
+    NUM_NODES       {int} the units per encoder cell
+    BATCH_SIZE      {int} amount of words per sess.run
+
+    Returns:
+    --------------
+    ENC_SCORES      {np.array}  3D  of shape num_layers x 2 x num_nodes
+    FC_SCORES       {np.array}  1D  of shape fc_size
+    """
+
+    enc_sum, dec_sum, fc_sum = 0, 0, 0
+    for start in range(0, len(inputs), batch_size):
+        enc_state, dec_outputs, fc1 = sess.run([model.enc_last_state.h, model.dec_outputs, model.fc1], feed_dict={model.keep_prob:1.0,
+            model.inputs:inputs[start:start+batch_size], model.outputs:outputs[start:start+batch_size]})
+        enc_sum += np.abs(enc_state).sum(axis=0)
+        dec_sum += np.abs(dec_outputs).sum(axis=(0,1))
+        fc_sum += np.abs(fc1).sum(axis=(0,1))
+
+    num_words, num_tokens = len(inputs), len(inputs) * outputs.shape[1]
+    enc_scores = (enc_sum / num_words + dec_sum / num_tokens).reshape(num_layers, 2, num_nodes)
+
+    return enc_scores, fc_sum / num_tokens
+
+
+
+def prune_weights(weights, enc_keep, fc_keep, num_layers, num_nodes):
+    """
+    Slices the kept units out of all variables of the writing module.
+
+    Parameters:
+    --------------
+    WEIGHTS         {dict} the values of the writing module variables by name
+    ENC_KEEP        {np.array}  3D  of shape num_layers x 2 x kept_nodes, the sorted kept units of every encoder cell
+    FC_KEEP         {np.array}  1D  the sorted kept units of the fully connected layer
+    NUM_LAYERS      {int} the amount of encoder layers
+    NUM_NODES       {int} the units per encoder cell (before pruning)
+
+    Returns:
+    --------------
+    PRUNED          {dict} the pruned values by name (embeddings and the logits bias are unchanged)
+    """
+
+    pruned = dict(weights)
+
+    for k in range(num_layers):
+        for d, direction in enumerate(DIRECTIONS):
+            kernel = weights[ENCODER.format(k, direction) + 'kernel']
+            num_inputs = kernel.shape[0] - num_nodes
+            # The first layer reads the embeddings, all further layers both directions of the previous layer
+            input_rows = np.arange(num_inputs) if k == 0 else np.concatenate([enc_keep[k-1,0], num_nodes + enc_keep[k-1,1]])
+            rows = np.concatenate([input_rows, num_inputs + enc_keep[k,d]])
+            columns = gate_columns(enc_keep[k,d], num_nodes)
+            pruned[ENCODER.format(k, direction) + 'kernel'] = kernel[rows][:,columns]
+            pruned[ENCODER.format(k, direction) + 'bias'] = weights[ENCODER.format(k, direction) + 'bias'][columns]
+
+    # Positions of the kept units in the concatenated encoder states (= decoder units), in the same order
+    dec_units = 2 * num_layers * num_nodes
+    dec_keep = np.concatenate([(2*k + d) * num_nodes + enc_keep[k,d] for k in range(num_layers) for d in range(2)])
+    dec_kernel = weights[DECODER + 'kernel']
+    dec_inputs = dec_kernel.shape[0] - dec_units
+    columns = gate_columns(dec_keep, dec_units)
+    pruned[DECODER + 'kernel'] = dec_kernel[np.concatenate([np.arange(dec_inputs), dec_inputs + dec_keep])][:,columns]
+    pruned[DECODER + 'bias'] = weights[DECODER + 'bias'][columns]
+
+    pruned[FC + 'weights'] = weights[FC + 'weights'][dec_keep][:,fc_keep]
+    pruned[FC + 'biases'] = weights[FC + 'biases'][fc_keep]
+    pruned[LOGITS + 'weights'] = weights[LOGITS + 'weights'][fc_keep]
+
+    return pruned
+
+
+
+def prune(path, epochs, data_path, keep=0.5, fc_keep=None, criterion='magnitude', samples=10000, finetune_epochs=0):
+    """
+    Prunes the writing module of a trained run and saves the smaller checkpoint to PATH/pruned/my_pruned_model.
+
+    Parameters:
+    --------------
+    PATH            {str} the folder of the trained model
+    EPOCHS          {int} the timestamp (in epochs) of the checkpoint
+    DATA_PATH       {str} the .npz file of the dataset the model was trained on
+    KEEP            {float} ratio of the LSTM units kept per encoder cell (and in the decoder)
+    FC_KEEP         {float} ratio of the kept units of the fully connected layer, defaults to KEEP
+    CRITERION       {str} from {'magnitude', 'activation'}
+    SAMPLES         {int} amount of training words for the activation statistics
+    FINETUNE_EPOCHS {int} optional, fine-tunes the pruned model for this amount of epochs (see finetune)
+
+    Returns:
+    --------------
+    CHECKPOINT      {str} the pruned (and possibly fine-tuned) checkpoint
+    """
+
+    model_args_write = utils.read_model_args(path)
+    if not model_args_write[17]:
+        raise ValueError("Only models with a bidirectional encoder can be pruned.")
+    num_layers, num_nodes = model_args_write[6], model_args_write[7]
+    fc_size = model_args_write[25] if len(model_args_write) > 25 else 128
+    fc_keep = keep if fc_keep is None else fc_keep
+
+    data = np.load(data_path)
+    word_dict = utils.np_dict_to_dict(data['word_dict'])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model, saver = utils.rebuild_model(model_args_write, 'write', word_dict['<GO>'])
+        variables = tf.global_variables(scope='writing')
+
+    with tf.Session(graph=graph, config=utils.session_config()) as sess:
+        saver.restore(sess, path + '/my_test_model-' + str(epochs))
+        weights = dict(zip([var.op.name for var in variables], sess.run(variables)))
+
+        if criterion == 'magnitude':
+            enc_scores, fc_scores = magnitude_scores(weights, num_layers, num_nodes)
+        elif criterion == 'activation':
+            indices = np.random.RandomState(0).permutation(model_args_write[23])[:samples]
+            enc_scores, fc_scores = activation_scores(sess, model, data['phons'][indices,1:], data['words'][indices,:-1],
+                num_layers, num_nodes)
+        else:
+            raise ValueError("Unknown pruning criterion " + criterion + ", choose from {magnitude, activation}.")
+
+    new_nodes = max(1, int(round(keep * num_nodes)))
+    new_fc_size = max(1, int(round(fc_keep * fc_size)))
+    enc_keep = np.sort(np.argsort(-enc_scores, axis=2)[:,:,:new_nodes], axis=2)
+    fc_units = np.sort(np.argsort(-fc_scores)[:new_fc_size])
+    pruned = prune_weights(weights, enc_keep, fc_units, num_layers, num_nodes)
+
+    # Rebuild the physically smaller model and save its weights
+    pruned_args = model_args_write[:25] + [new_fc_size] + model_args_write[26:]
+    pruned_args[7] = new_nodes
+    graph = tf.Graph()
+    with graph.as_default():
+        pruned_model, pruned_saver = utils.rebuild_model(pruned_args, 'write', word_dict['<GO>'])
+        pruned_variables = tf.global_variables(scope='writing')
+
+    pruned_path = path + '/pruned'
+    if not os.path.exists(pruned_path):
+        os.makedirs(pruned_path)
+    checkpoint = pruned_path + '/my_pruned_model'
+
+    with tf.Session(graph=graph, config=utils.session_config()) as sess:
+        for var in pruned_variables:
+            var.load(pruned[var.op.name], sess)
+        pruned_saver.save(sess, checkpoint)
+
+    params = sum(weights[var.op.name].size for var in pruned_variables)
+    pruned_params = sum(pruned[var.op.name].size for var in pruned_variables)
+    print("Pruned the writing module from ", num_nodes, " to ", new_nodes, " units per encoder cell and from ", fc_size, " to ",
+        new_fc_size, " fully connected units (", params, " -> ", pruned_params, " parameters).")
+    print("Fine-tune with: python run.py --num_layers ", num_layers, " --num_nodes ", new_nodes, " --fc_size ", new_fc_size,
+        " --input_embed_size ", model_args_write[4], " --output_embed_size ", model_args_write[5], " --seed ", model_args_write[20],
+        " --init_from ", checkpoint, " ...")
+
+    with open(pruned_path + '/pruning.json', 'w') as f:
+        json.dump({'epochs':epochs, 'criterion':criterion, 'keep':keep, 'fc_keep':fc_keep, 'num_nodes':new_nodes,
+            'fc_size':new_fc_size, 'params':int(params), 'pruned_params':int(pruned_params), 'finetune_epochs':finetune_epochs,
+            'kept_units':enc_keep.tolist(), 'kept_fc_units':fc_units.tolist()}, f, indent=2)
+
+    if finetune_epochs > 0:
+        checkpoint = finetune(checkpoint, pruned_args, data['phons'][model_args_write[23]], data['words'][model_args_write[23]],
+            word_dict['<PAD>'], finetune_epochs)
+
+    return checkpoint
+
+
+
+def finetune(checkpoint, model_args_write, inputs, outputs, pad_id, epochs):
+    """
+    Trains the pruned model of CHECKPOINT (the hyperparameters MODEL_ARGS_WRITE as from utils.read_model_args, with the 
+    pruned sizes) in the normal regime with the optimizer, learning rate, batch size and dropout of the run.
+
+    Parameters:
+    --------------
+    CHECKPOINT      {str} the pruned checkpoint
+    MODEL_ARGS_WRITE    {list} the hyperparameters of the pruned model
+    INPUTS          {np.array} 2D, the training words (phonemes, with <GO>)
+    OUTPUTS         {np.array} 2D, their spellings (with <GO>)
+    PAD_ID          {int} the <PAD> index of the output dictionary
+    EPOCHS          {int} amount of epochs
+
+    Returns:
+    --------------
+    CHECKPOINT      {str} the fine-tuned checkpoint, in the folder of the pruned one
+    """
+    from bLSTM import bLSTM
+
+    graph = tf.Graph()
+    with graph.as_default():
+        with tf.variable_scope('writing'):
+            model = bLSTM(*model_args_write[:11], 500, optimization=model_args_write[12], learning_rate=model_args_write[13],
+                LSTM_initializer=model_args_write[14], momentum=model_args_write[15], activation_fn=model_args_write[16],
+                bidirectional=model_args_write[17], fc_size=model_args_write[25],
+                cell_impl=model_args_write[26] if len(model_args_write) > 26 else 'standard')
+            model.forward()
+            model.backward(pad_id)
+        init = tf.global_variables_initializer()
+        init_saver = utils.checkpoint_saver(checkpoint, 'writing')
+        saver = tf.train.Saver(tf.global_variables(scope='writing'))
+
+    finetuned = os.path.dirname(checkpoint) + '/my_finetuned_model'
+    with tf.Session(graph=graph, config=utils.session_config()) as sess:
+        sess.run(init)
+        init_saver.restore(sess, checkpoint)
+
+        for epoch in range(epochs):
+            losses = []
+            for inp_batch, out_batch in utils.batch_data(inputs, outputs, model_args_write[8]):
+                _, batch_loss = sess.run([model.optimizer, model.loss], feed_dict={model.keep_prob:model_args_write[22], 
+                    model.inputs:inp_batch[:,1:], model.outputs:out_batch[:,:-1], model.targets:out_batch[:,1:]})
+                losses.append(batch_loss)
+            print("Fine-tuning epoch ", epoch + 1, " - loss ", np.mean(losses))
+
+        return saver.save(sess, finetuned, global_step=epochs)
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    parser.add_argument('--keep', default=0.5, type=float,
+                        help='Ratio of the LSTM units that are kept.')
+    parser.add_argument('--fc_keep', default=None, type=float,
+                        help='Ratio of the units of the fully connected layer that are kept. Default is keep.')
+    parser.add_argument('--criterion', default='magnitude', type=str,
+                        help="How units are scored. Choose from {magnitude, activation}.")
+    parser.add_argument('--samples', default=10000, type=int,
+                        help='Amount of training words for the activation statistics.')
+    parser.add_argument('--finetune_epochs', default=0, type=int,
+                        help='Epochs of fine-tuning of the pruned model on the training words (normal regime). 0 only prunes.')
+    args = parser.parse_args()
+
+    prune(args.path, args.epochs, args.data, args.keep, args.fc_keep, args.criterion, args.samples, args.finetune_epochs)
@@ -0,0 +1,211 @@
+import warnings, os, argparse, json
+warnings.filterwarnings("ignore",category=FutureWarning)
+import numpy as np
+from time import time
+
+from predictor import OnnxPredictor, onnx_path
+
+
+"""
+Post-training int8 quantization of an exported writing or reading module (see export_onnx.py).
+
+The weights of the embeddings (Gather), the LSTM kernels and the fully connected layers (MatMul, also inside the decoding
+loop) are quantized to int8, the activation ranges are calibrated on a held-out slice of the test words (see 
+calibration_split). Afterwards the int8 and the float model are compared on the remaining test words (word and token accuracy,
+decoding time).
+Requires onnxruntime (with onnxruntime.quantization).
+
+Usage:
+    python quantize.py --path <run folder> --epochs 249 --task write --data ../data/celex.npz
+    python predictor.py --backend onnx_int8 ...
+"""
+
+
+
+class CalibrationReader(object):
+
+    """
+    Feeds batches of encoded words to the calibration of onnxruntime (a CalibrationDataReader), per length bucket as in
+    Predictor.predict_ids (of corpus words).
+    """
+
+    def __init__(self, predictor, seqs, batch_size=500):
+
+        self.feeds = []
+        for members, in_len, out_len in predictor.groups(seqs, known=True):
+            for start in range(0, len(members), batch_size):
+                batch = members[start:start+batch_size]
+                self.feeds.append({predictor.input_name:seqs[batch,-in_len:].astype(np.int32),
+                                   predictor.length_name:np.array(out_len, dtype=np.int32)})
+        self.iterator = iter(self.feeds)
+
+
+    def get_next(self):
+        return next(self.iterator, None)
+
+
+    def rewind(self):
+        self.iterator = iter(self.feeds)
+
+
+
+def edit_distances(predictions, targets, pad_id):
+    """
+    Levenshtein distances between predicted and target index sequences, normalized by the target length (as tf.edit_distance).
+    <PAD> and 0 are ignored. Vectorized over the words, the dynamic program loops over the sequence positions.
+
+    Parameters:
+    --------------
+    PREDICTIONS     {np.array}  2D  of shape num_words x seq_len
+    TARGETS         {np.array}  2D  of shape num_words x seq_len
+    PAD_ID          {int} the <PAD> index of the output dictionary
+
+    Returns:
+    --------------
+    DISTS           {np.array}  1D  the normalized distances
+    """
+
+    def compact(seqs):
+        # Move the tokens to the front of every row, return them with their amount
+        mask = (seqs != pad_id) & (seqs != 0)
+        order = np.argsort(~mask, axis=1, kind='stable')
+        return np.take_along_axis(seqs, order, axis=1), mask.sum(axis=1)
+
+    preds, pred_lens = compact(predictions)
+    targs, targ_lens = compact(targets)
+    num_words = len(preds)
+
+    # dists[:,j] is the distance between the first i predicted and the first j target tokens
+    dists = np.tile(np.arange(targs.shape[1] + 1), (num_words, 1))
+    final = np.where(pred_lens == 0, targ_lens, 0)
+    for i in range(1, preds.shape[1] + 1):
+        prev = dists
+        dists = np.empty_like(prev)
+        dists[:,0] = i
+        for j in range(1, targs.shape[1] + 1):
+            substitution = prev[:,j-1] + (preds[:,i-1] != targs[:,j-1])
+            dists[:,j] = np.minimum(np.minimum(prev[:,j] + 1, dists[:,j-1] + 1), substitution)
+        final = np.where(pred_lens == i, dists[np.arange(num_words), targ_lens], final)
+
+    return final / np.maximum(targ_lens, 1)
+
+
+
+def accuracy_report(predictor, seqs, targets):
+    """ Word and token accuracy and decoding time per word of PREDICTOR on encoded words SEQS """
+
+    t = time()
+    predictions = predictor.predict_ids(seqs)
+    seconds = time() - t
+
+    pad_id = predictor.output_dict['<PAD>']
+    dists = edit_distances(predictions, targets, pad_id)
+
+    return {'token_acc':float(1 - np.mean(dists)), 'word_acc':float(np.mean(dists == 0)),
+            'ms_per_word':1000 * seconds / max(len(seqs), 1)}
+
+
+
+def calibration_split(test_indices, calibration_size, seed=0):
+    """
+    Splits the test words into CALIBRATION_SIZE calibration words (a random, but fixed slice) and the words of the accuracy
+    report. Both are disjoint and held out from training.
+    """
+
+    if calibration_size >= len(test_indices):
+        raise ValueError("The calibration needs fewer words (" + str(calibration_size) + ") than the test set has (" + 
+            str(len(test_indices)) + ").")
+    shuffled = np.random.RandomState(seed).permutation(test_indices)
+
+    return shuffled[:calibration_size], np.sort(shuffled[calibration_size:])
+
+
+
+def quantize(path, epochs, task, data_path, calibration_size=2000, threads=0):
+    """
+    Quantizes the exported model of TASK and compares it with the float model.
+
+    Parameters:
+    --------------
+    PATH            {str} the folder of the trained model (with the exported model, see export_onnx.py)
+    EPOCHS          {int} the timestamp (in epochs) of the checkpoint
+    TASK            {str} from {'write', 'read'}
+    DATA_PATH       {str} the .npz file of the dataset the model was trained on
+    CALIBRATION_SIZE{int} amount of test words used for the calibration (they are excluded from the comparison)
+    THREADS         {int} intra-op threads of onnxruntime for the comparison (0 lets onnxruntime choose)
+
+    Returns:
+    --------------
+    REPORT          {dict} accuracies and timings of the float and the int8 model
+    """
+
+    from onnxruntime.quantization import quantize_static, QuantType, QuantFormat
+    import utils
+
+    # Held-out calibration words and the remaining test words
+    model_args_write = utils.read_model_args(path)
+    data = np.load(data_path)
+    inputs = data['phons'] if task == 'write' else data['words']
+    targets = data['words'] if task == 'write' else data['phons']
+    calibration_indices, test_indices = calibration_split(model_args_write[24], calibration_size)
+
+    float_predictor = OnnxPredictor(path, epochs, task, data_path, threads=threads, cache_size=0)
+    reader = CalibrationReader(float_predictor, inputs[calibration_indices,1:])
+
+    float_file = onnx_path(path, epochs, task)
+    int8_file = onnx_path(path, epochs, task, quantized=True)
+    t = time()
+    quantize_static(float_file, int8_file, reader, quant_format=QuantFormat.QDQ, op_types_to_quantize=['MatMul', 'Gather'],
+        activation_type=QuantType.QInt8, weight_type=QuantType.QInt8, per_channel=True,
+        extra_options={'EnableSubgraph':True})
+    print("Quantized the model to ", int8_file, " in ", time()-t, " seconds.")
+
+    # Same metadata, but the predictions (table) belong to the quantized model
+    with open(float_file[:-len('.onnx')] + '.json') as f:
+        meta = json.load(f)
+    meta['quantized'] = True
+    with open(int8_file[:-len('.onnx')] + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    int8_predictor = OnnxPredictor(path, epochs, task, data_path, threads=threads, cache_size=0, quantized=True)
+
+    # Compare both models on the test words that were not used for the calibration
+    report = {'float':accuracy_report(float_predictor, inputs[test_indices,1:], targets[test_indices,1:]),
+              'int8':accuracy_report(int8_predictor, inputs[test_indices,1:], targets[test_indices,1:]),
+              'float_mb':os.path.getsize(float_file) / 2**20, 'int8_mb':os.path.getsize(int8_file) / 2**20,
+              'calibration_size':len(calibration_indices), 'test_size':len(test_indices)}
+
+    for name in ['float', 'int8']:
+        print(name.ljust(6) + '- Accuracy on test set is for tokens{:>6.3f} and for words {:>6.3f}, {:>7.3f} ms per word'.format(
+            report[name]['token_acc'], report[name]['word_acc'], report[name]['ms_per_word']))
+    print("Model size {:.2f} MB (float) vs. {:.2f} MB (int8)".format(report['float_mb'], report['int8_mb']))
+
+    eval_path = path + '/evaluation'
+    if not os.path.exists(eval_path):
+        os.makedirs(eval_path)
+    with open(eval_path + '/quantization_' + task + '-' + str(epochs) + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--task', default='write', type=str,
+                        help="The module to quantize. Choose from {write, read}.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    parser.add_argument('--calibration_size', default=2000, type=int,
+                        help='Amount of test words used to calibrate the activation ranges, the others are used for the comparison.')
+    parser.add_argument('--threads', default=0, type=int,
+                        help='Intra-op threads of onnxruntime for the comparison (0 lets onnxruntime choose).')
+    args = parser.parse_args()
+
+    quantize(args.path, args.epochs, args.task, args.data, args.calibration_size, args.threads)
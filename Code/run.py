@@ -2,6 +2,7 @@ import warnings
 import sys
 import os
 import argparse
+import json
 import numpy as np
 import tensorflow as tf
 
@@ -13,6 +14,7 @@ from time import time
 # Import my files
 from utils import acc_new
 import utils
+import autotune
 from bLSTM import bLSTM
 
 #from eval_model import evaluation
@@ -46,6 +48,9 @@ if __name__ == '__main__':
                         help='Max number of samples to save in summaries')
     parser.add_argument('--restore', default=False, type=bool, 
                         help='Restore a pretrained model or initialize a new one (default).')
+    parser.add_argument('--init_from', default='', type=str,
+                        help='Checkpoint to initialize all variables of matching name and shape from, e.g. a pruned checkpoint '
+                        '(see prune.py) to fine-tune it. Use the same seed and test_size as the run it stems from.')
     parser.add_argument('--save_model', default=200, type=int,
                         help='Frequency of iterations before model is saved and stored.')
 
@@ -70,6 +75,11 @@ if __name__ == '__main__':
                         help='Seed for the random number generator')
     parser.add_argument('--print_ratio', default=False, type=bool,
                         help='For LdS training regime, whether ratio of incorrect but accepted words should be printed.')
+    parser.add_argument('--single_pass', default=False, type=bool,
+                        help='Record the training performance with streaming metrics of the training steps instead of a second pass '
+                        'over the training set (statistics are then taken with dropout, while the weights are updated).')
+    parser.add_argument('--exact_train_eval', default=0, type=int,
+                        help='With single_pass, still run the exact (second) pass over the training set every n epochs. 0 (default) never.')
     parser.add_argument('--show_plot', default=False, type=bool,
                         help='Specifies whether Accuracy plots are shown at end of training. Do only if machine you run on has GUI')
 
@@ -84,6 +94,20 @@ if __name__ == '__main__':
                         help='The dimensionality of the LSTM cell')
     parser.add_argument('--num_layers', default=2, type=int,
                         help='The number of layers in both encoder and decoder')
+    parser.add_argument('--fc_size', default=128, type=int,
+                        help='The number of units of the fully connected layer on top of the decoder')
+    parser.add_argument('--xla', default='', type=str,
+                        help="XLA compilation of the training graph. 'auto' clusters the entire graph automatically, 'jit' compiles "
+                        "encoder, decoder, losses and optimizer update in explicit scopes. Either way, the smaller last batch of every epoch "
+                        "(of every bucket) is filled up with masked rows, such that the batch shapes repeat and the compiled clusters are reused.")
+    parser.add_argument('--cell_impl', default='standard', type=str,
+                        help="The LSTM implementation, from {standard, fused}. 'fused' runs encoder and decoder with whole-sequence kernels "
+                        "(faster on CPU), checkpoints of both can be restored by the other.")
+    parser.add_argument('--autotune', default=False, type=bool,
+                        help="Benchmark the intra- and inter-op thread configurations for this model and batch size before training, "
+                        "unless this host already tuned it. Tuned configurations are applied without the flag (see autotune.py).")
+    parser.add_argument('--runs_per_node', default=1, type=int,
+                        help="Amount of runs that share the cores of this host, each one is tuned for its share of the cores.")
     parser.add_argument('--optimization',default='RMSProp', type=str, 
                         help="The optimizer used in the model. 'RMSProp' as default, give as string, alternatives: 'GD', "
                         "'Momentum', 'Adam', 'Adadelta', 'Adagrad' ")
@@ -100,7 +124,20 @@ if __name__ == '__main__':
                         help="Dropout probability of neurons during training.")
     parser.add_argument('--test_size', default=0.05, type=float,
                         help="Percentage of dataset hold back for testing.")
+    parser.add_argument('--buckets', default=0, type=int,
+                        help="Amount of length buckets. Batches are trimmed to the sequence lengths of their bucket. 0 (default) "
+                        "pads all words to the maximal length.")
 
+    # Distillation hyperparameter
+    parser.add_argument('--teacher', default='', type=str,
+                        help="Folder of a trained model. If given, the writing module is trained as (compact) student on the soft "
+                        "logits and the LdS-accepted predictions of the teacher's writing module (knowledge distillation).")
+    parser.add_argument('--teacher_epochs', default=0, type=int,
+                        help="The timestamp (in epochs) of the teacher checkpoint.")
+    parser.add_argument('--distill_temperature', default=2.0, type=float,
+                        help="Temperature that softens the output distributions of teacher and student.")
+    parser.add_argument('--distill_alpha', default=0.5, type=float,
+                        help="Weight of the soft (teacher) loss, the loss on the hard targets is weighted by 1-alpha.")
 
 
 
@@ -150,19 +187,24 @@ if __name__ == '__main__':
 
 
 
+    if args.xla not in ['', 'auto', 'jit']:
+        raise ValueError("Unknown XLA mode " + args.xla + ", choose from {auto, jit}.")
+
     # setting the gpu options if any
+    config = tf.ConfigProto()
     if args.gpu_options == 0:
-        sess = get_growth_allowed_session()
+        config.gpu_options.allow_growth = True
     elif args.gpu_options == 1:
-        sess = get_limited_gpu_session(gpu_fraction=args.gpu_fraction)
+        config.gpu_options.per_process_gpu_memory_fraction = args.gpu_fraction
     else:
-        #gpu_options = tf.GPUOptions(allow_growth=True)
-        #sess = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options))
-        config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
         config.gpu_options.per_process_gpu_memory_fraction = 0.99
         print(config.gpu_options.per_process_gpu_memory_fraction)
-        sess = tf.Session(config = config)
+    if args.xla == 'auto':
+        # Auto-clustering is GPU only unless enabled for the CPU as well
+        os.environ['TF_XLA_FLAGS'] = os.environ.get('TF_XLA_FLAGS', '') + ' --tf_xla_cpu_global_jit'
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+    # The session is created once the model size is known, the thread pools of TF are fixed by the first session (see autotune)
 
 
     # setting a random seed for reproducibility
@@ -173,26 +215,7 @@ if __name__ == '__main__':
     # LOAD DATA
 
 
-    if args.task == 'celex' :
-        ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets) = utils.celex_retrieve()
-        mas = 96
-
-    elif args.task == 'celex_all':
-        ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets) = utils.celex_all_retrieve()
-        mas = 100
-
-    elif args.task == 'childlex':
-        ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets) = utils.childlex_retrieve()
-        mas = 100
-
-    elif args.task == 'childlex_all':
-        ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets) = utils.childlex_all_retrieve()
-        mas = 43200
-
-    elif args.task == 'fibel':
-        ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets) = utils.fibel_retrieve()
-        lektions_inds = [9,14,20,28,36,46,58,77,99,121,154,174]
-        mas = 810
+    ((inputs, targets) , (dict_char2num_x, dict_char2num_y), alt_targets), mas = utils.retrieve_data(args.task)
 
 
 
@@ -202,6 +225,17 @@ if __name__ == '__main__':
     # Set remaining parameter based on the processed data
     x_dict_size, num_classes, x_seq_length, y_seq_length, dict_num2char_x, dict_num2char_y = utils.set_model_params(inputs, targets, dict_char2num_x, dict_char2num_y)
 
+    # The thread configuration tuned for this model, its training input path and this host (in all GPU options)
+    spec = autotune.model_spec(x_seq_length, y_seq_length, x_dict_size, num_classes, args.input_embed_size, args.output_embed_size, 
+        args.num_layers, args.num_nodes, args.batch_size, args.fc_size, args.cell_impl, args.reading, args.xla)
+    if args.autotune:
+        autotune.tune(spec, args.runs_per_node)
+    threads = autotune.tuned_threads(spec, 'train', args.runs_per_node)
+    if threads is not None:
+        print("Using the autotuned thread configuration (intra, inter) ", threads)
+        config.intra_op_parallelism_threads, config.inter_op_parallelism_threads = threads
+    sess = tf.Session(config = config)
+
 
     # Split data into training and testing
     indices = range(len(inputs))
@@ -224,20 +258,74 @@ if __name__ == '__main__':
 
     print(X_train.shape, Y_train.shape, Y_alt_train.shape,'PRESHAPES')
 
+    # Keys (word and hash) of the alternative spellings, the LdS loss looks up the generated words in them in-graph
+    K_alt_train = utils.spelling_keys(Y_alt_train_l, dict_char2num_y['<PAD>'])
+    train_word_ids = np.arange(len(X_train))
+
+    # Accepted spellings of the test words, to check LdS correctness of generated words in O(seq_len)
+    test_trie = utils.SpellingTrie(Y_test[:,1:], Y_alt_test[:,1:])
+
+    # Group words into length buckets (determined on the entire dataset, such that test words are decoded with the same lengths)
+    if args.buckets > 0:
+        bucket_ids, boundaries, bucket_lengths = utils.length_buckets(inputs, targets, dict_char2num_x['<PAD>'], dict_char2num_y['<PAD>'], 
+            args.buckets, alt_targets)
+        train_buckets = (bucket_ids[indices_train], bucket_lengths)
+        test_buckets = (bucket_ids[indices_test], bucket_lengths)
+        # The reading module is bucketed by the length of its (orthographic) inputs, they are assigned when decoding
+        read_boundaries, read_bucket_lengths = utils.reading_buckets(inputs, targets, dict_char2num_x['<PAD>'], dict_char2num_y['<PAD>'], 
+            args.buckets)
+        np.savez(save_path + '/buckets.npz', boundaries=boundaries, bucket_lengths=bucket_lengths, read_boundaries=read_boundaries,
+            read_bucket_lengths=read_bucket_lengths)
+        print("Length buckets (input, output length): ", bucket_lengths.tolist())
+    else:
+        train_buckets, test_buckets, read_boundaries = None, None, None
 
 
+    # Knowledge distillation: the teacher lives in its own graph and session
+    if args.teacher:
+        if args.reading:
+            raise ValueError('Distillation trains the writing module only, do not set reading.')
 
+        teacher_args = utils.read_model_args(args.teacher)
+        if teacher_args[:4] != [x_seq_length, y_seq_length, x_dict_size, num_classes]:
+            raise ValueError('The teacher was trained on another dataset (sequence lengths and dictionary sizes differ).')
+        if len(np.intersect1d(teacher_args[23], indices_test)) > 0:
+            print("WARNING: The teacher was trained on words of the test set, use the same seed and test_size as for the teacher.")
 
-    ############## PREPARATION FOR TRAINING ##############
+        teacher_graph = tf.Graph()
+        with teacher_graph.as_default():
+            teacher, teacher_saver = utils.rebuild_model(teacher_args, 'write', dict_char2num_y['<GO>'])
+        teacher_graph.finalize()
+        teacher_sess = tf.Session(graph=teacher_graph, config=utils.session_config())
+        teacher_saver.restore(teacher_sess, args.teacher + '/my_test_model-' + str(args.teacher_epochs))
 
-    regime = args.learn_type
+        teacher_buckets = None
+        if os.path.exists(args.teacher + '/buckets.npz'):
+            buckets = np.load(args.teacher + '/buckets.npz')
+            teacher_buckets = (utils.assign_buckets(X_train, dict_char2num_x['<PAD>'], buckets['boundaries']), buckets['bucket_lengths'])
+
+        # Hard targets are the teacher's spellings wherever they are accepted in LdS sense
+        train_trie = utils.SpellingTrie(Y_train[:,1:], Y_alt_train[:,1:])
+        t = time()
+        distill_targets, teacher_rat = utils.teacher_targets(teacher_sess, teacher, X_train[:,1:], Y_train[:,1:], train_trie,
+            dict_char2num_y['<PAD>'], teacher_buckets)
+        Y_distill = np.concatenate([Y_train[:,:1], distill_targets.astype(Y_train.dtype)], axis=1)
+        print("The teacher writes ", teacher_rat, " of the training words in an alternative, accepted way (took ", time()-t, " seconds).")
+
+        with open(save_path + '/distillation.json', 'w') as f:
+            json.dump({'teacher':args.teacher, 'teacher_epochs':args.teacher_epochs, 'teacher_layers':teacher_args[6],
+                'teacher_nodes':teacher_args[7], 'temperature':args.distill_temperature, 'alpha':args.distill_alpha,
+                'teacher_lds_ratio':float(teacher_rat)}, f, indent=2)
 
-    if args.learn_type == 'lds' or args.learn_type == 'intervened' or args.learn_type == 'intervened + interleaved' or args.learn_type == 'interleaved':
-        regime = 'lds'
-    elif args.learn_type == 'normal' :
-        regime = 'normal'
-    else:
-        raise ValueError('Wrong learning type given')
+
+
+
+
+    ############## PREPARATION FOR TRAINING ##############
+
+    # The regime of every epoch (raises for unknown learning types)
+    regimes = utils.regime_schedule(args.learn_type, args.epochs)
+    regime = regimes[0]
 
 
     print("REGIME IS ", regime)
@@ -245,35 +333,51 @@ if __name__ == '__main__':
 
 
 
+    # The writing module reads its training batches from a tf.data pipeline (shuffled every epoch, prefetched in the background)
+    train_iterator, train_batch, train_feed = utils.input_pipeline(X_train, Y_train, args.batch_size, train_buckets,
+        pad_remainder=bool(args.xla))
+    alt_table, alt_table_init, alt_table_feed = utils.key_table(K_alt_train)
+
     #tf.reset_default_graph()
     with tf.variable_scope('writing'):
         model_write = bLSTM(x_seq_length, y_seq_length, x_dict_size, num_classes, args.input_embed_size, args.output_embed_size, args.num_layers, args.num_nodes, args.batch_size,
             args.learn_type, 'write', mas, print_ratio=args.print_ratio, optimization=args.optimization ,learning_rate=args.learning_rate, LSTM_initializer=args.LSTM_initializer, 
-            momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional)
+            momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional, fc_size=args.fc_size, 
+            cell_impl=args.cell_impl, jit=args.xla == 'jit', data=dict(train_batch, alternative_keys=alt_table))
         model_write.forward()
-        model_write.backward()
+        model_write.backward(dict_char2num_y['<PAD>'])
+        model_write.inference(dict_char2num_y['<GO>'])
+        model_write.scoring(dict_char2num_y['<GO>'])
+        if args.teacher:
+            model_write.distillation(args.distill_temperature, args.distill_alpha)
+        if args.single_pass:
+            model_write.training_metrics(dict_char2num_y['<PAD>'])
 
 
 
     # Should the reading module be enabled?
     if args.reading:
+        # It is trained on the batches of the writing module: it reads the targets (the LdS-accepted ones in the LdS regime)
+        # and writes the inputs
+        read_batch = {'inputs':model_write.train_targets,
+                      'outputs':train_batch['x'][:,:-1], 'targets':train_batch['inputs'], 'mask':train_batch['mask']}
         with tf.variable_scope('reading'):
             model_read = bLSTM(y_seq_length, x_seq_length, num_classes, x_dict_size, args.input_embed_size, args.output_embed_size, args.num_layers, args.num_nodes,
                 args.batch_size, 'normal', 'read', mas, print_ratio=args.print_ratio, optimization=args.optimization ,learning_rate=args.learning_rate, 
-                LSTM_initializer=args.LSTM_initializer, momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional)
+                LSTM_initializer=args.LSTM_initializer, momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional,
+                fc_size=args.fc_size, cell_impl=args.cell_impl, jit=args.xla == 'jit', data=read_batch)
             model_read.forward()
-            model_read.backward()
+            model_read.backward(dict_char2num_x['<PAD>'])
+            model_read.inference(dict_char2num_x['<GO>'])
+            if args.single_pass:
+                model_read.training_metrics(dict_char2num_x['<PAD>'], lds=False)
 
 
     exp = Experiment(name='', save_dir=test_tube)
     # First K arguments are in the same order like the ones to initialize the bLSTM, this simplifies restoring
     
-    exp.add_meta_tags({'inp_len':x_seq_length, 'out_len':y_seq_length, 'x_dict_size':x_dict_size, 'num_classes':num_classes, 'input_embed':args.input_embed_size,
-                        'output_embed':args.output_embed_size, 'num_layers':args.num_layers, 'nodes/Layer':args.num_nodes, 'batch_size':args.batch_size, 'learn_type':
-                        args.learn_type, 'task': 'write', 'print_ratio':args.print_ratio, 'optimization':str(args.optimization), 'lr': args.learning_rate,
-                        'LSTM_initializer':str(args.LSTM_initializer), 'momentum':args.momentum,'ActFctn':str(args.activation_fn), 'bidirectional': args.bidirectional,  
-                         'Write+Read = ': args.reading, 'epochs': args.epochs,  'seed':args.seed,'restored':args.restore, 'dropout':args.dropout, 'train_indices':
-                         indices_train, 'test_indices':indices_test})
+    exp.add_meta_tags(utils.meta_tags(args, (x_seq_length, y_seq_length, x_dict_size, num_classes), indices_train, indices_test,
+        print_ratio=args.print_ratio, restored=args.restore))
     
 
 
@@ -281,6 +385,16 @@ if __name__ == '__main__':
     acc_object  = acc_new()
     acc_object.accuracy()
 
+    # In single pass mode every training step also updates the streaming metrics
+    write_metrics_update = model_write.metrics_update if args.single_pass else tf.no_op()
+    read_metrics_update = model_read.metrics_update if args.single_pass and args.reading else tf.no_op()
+
+    # Writing and reading module take their steps in the same execution
+    train_op = tf.group(model_write.optimizer, model_read.optimizer) if args.reading else model_write.optimizer
+    train_step_feed = {model_write.keep_prob:args.dropout}
+    if args.reading:
+        train_step_feed[model_read.keep_prob] = args.dropout
+
 
     if args.restore:
         utils.retrieve_model()
@@ -289,12 +403,19 @@ if __name__ == '__main__':
         # tensor to initialize the variables
         init_tensor = tf.global_variables_initializer()
         saver = tf.train.Saver()
+        if args.init_from:
+            init_saver = utils.checkpoint_saver(args.init_from)
 
         # Finalize graph
         g = tf.get_default_graph()
         g.finalize()
         # initializing the variables
         sess.run(init_tensor)
+        if args.init_from:
+            init_saver.restore(sess, args.init_from)
+
+    # The keys of the alternative spellings are not part of the checkpoints
+    sess.run(alt_table_init, feed_dict=alt_table_feed)
 
 
 
@@ -323,53 +444,41 @@ if __name__ == '__main__':
     for epoch in range(args.epochs):
 
         print('Epoch ', epoch + 1)
+        if regimes[epoch] != regime:
+            regime = regimes[epoch]
+            print("Training regime changed to " + regime + "\n")
         lt.append(regime)
         t = time()    
 
+        if args.single_pass:
+            sess.run([model_write.metrics_reset] + ([model_read.metrics_reset] if args.reading else []))
 
-        if regime == 'normal':
-        
-            for k, (write_inp_batch, write_out_batch, write_alt_targs) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size,Y_alt_train)):
-            
-            # Train Writing
-                tt=time()
-                _, batch_loss, w_batch_logits, loss_lds, rat_lds = sess.run([model_write.optimizer, model_write.loss, model_write.logits, 
-                    model_write.loss_lds, model_write.rat_lds], feed_dict = 
-                                                        {model_write.keep_prob: args.dropout, model_write.inputs: write_inp_batch[:, 1:], 
-                                                        model_write.outputs: write_out_batch[:, :-1], model_write.targets: write_out_batch[:, 1:],
-                                                        model_write.alternative_targets: write_alt_targs[:,1:,:]})
-                #print("Time on batch of training took ", time()-tt)
-
-                if args.reading:
+        if args.teacher:
 
-                    read_inp_batch = write_out_batch
-                    read_out_batch = write_inp_batch
+            # The student learns from the teacher's output distribution (teacher forced on the hard targets). Like all fed batches
+            # below, the word mask is fed as well, otherwise it is taken from the (here unused) pipeline
+            for k, (write_inp_batch, write_out_batch, write_word_ids) in enumerate(utils.batch_data(X_train, Y_distill, args.batch_size, train_word_ids, train_buckets)):
 
-                    _, batch_loss, batch_logits = sess.run([model_read.optimizer, model_read.loss, model_read.logits], feed_dict = 
-                                                    {model_read.keep_prob:args.dropout, model_read.inputs: read_inp_batch[:,1:], 
-                                                    model_read.outputs:read_out_batch[:,:-1], model_read.targets:read_out_batch[:,1:]})
-
-
-        elif regime == 'lds':
+                teacher_batch_logits = teacher_sess.run(teacher.logits, feed_dict={teacher.keep_prob:1.0, 
+                    teacher.inputs: write_inp_batch[:,1:], teacher.outputs: write_out_batch[:,:-1]})
 
+                _, _, batch_loss = sess.run([model_write.distill_optimizer, write_metrics_update, model_write.distill_loss], feed_dict = 
+                                                        {model_write.keep_prob: args.dropout, model_write.inputs: write_inp_batch[:, 1:], 
+                                                        model_write.outputs: write_out_batch[:, :-1], model_write.targets: write_out_batch[:, 1:],
+                                                        model_write.word_ids: write_word_ids, model_write.word_mask: np.ones(len(write_inp_batch)),
+                                                        model_write.teacher_logits: teacher_batch_logits})
 
-            for k, (write_inp_batch, write_out_batch, write_alt_targs) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size, Y_alt_train)):
+        else:
 
-                tt=time()
-                _, batch_loss, write_new_targs, rat_lds, rat_corr, batch_loss_reg, w_batch_logits= sess.run([model_write.lds_optimizer, model_write.loss_lds, model_write.read_inps, 
-                    model_write.rat_lds, model_write.rat_corr, model_write.loss_reg, model_write.logits], 
-                                feed_dict = 
-                                                        {model_write.keep_prob:args.dropout, model_write.inputs: write_inp_batch[:,1:], 
-                                                        model_write.outputs: write_out_batch[:, :-1], model_write.targets: write_out_batch[:, 1:], 
-                                                        model_write.alternative_targets: write_alt_targs[:,1:,:]})
+            # Both regimes use the same train op, in the LdS regime on the LdS-accepted targets
+            sess.run(train_iterator.initializer, feed_dict=train_feed)
+            while True:
+                try:
+                    _, _, _, batch_loss = sess.run([train_op, write_metrics_update, read_metrics_update, model_write.train_loss], 
+                        feed_dict = {**train_step_feed, model_write.lds_mode:regime == 'lds'})
+                except tf.errors.OutOfRangeError:
+                    break
 
-                if args.reading:
-                    read_inp_batch = write_new_targs
-                    read_out_batch = write_inp_batch
-                    _, batch_loss, batch_logits = sess.run([model_read.optimizer, model_read.loss, model_read.logits], feed_dict = 
-                                                    {model_read.keep_prob:args.dropout, model_read.inputs: read_inp_batch, 
-                                                    model_read.outputs:read_out_batch[:,:-1], model_read.targets:read_out_batch[:,1:]})
-      
         print("The regular training took: ", time()-t)
         tt=time()
         # ---------------- SHOW TRAINING PERFORMANCE -------------------------
@@ -380,24 +489,44 @@ if __name__ == '__main__':
         read_loss = []
 
         # Allocate variables
-        write_word_accs = np.zeros(len(X_train)// args.batch_size)
-        write_token_accs = np.zeros(len(X_train)// args.batch_size)
-        write_old_accs = np.zeros(len(X_train)// args.batch_size)
-
-        read_word_accs = np.zeros(len(X_train)// args.batch_size)
-        read_token_accs = np.zeros(len(X_train)// args.batch_size)
-        read_old_accs = np.zeros(len(X_train)// args.batch_size)
+        n_batches = utils.num_batches(len(X_train), args.batch_size, train_buckets)
+        write_word_accs = np.zeros(n_batches)
+        write_token_accs = np.zeros(n_batches)
+        write_old_accs = np.zeros(n_batches)
+
+        read_word_accs = np.zeros(n_batches)
+        read_token_accs = np.zeros(n_batches)
+        read_old_accs = np.zeros(n_batches)
             
+        exact_pass = not args.single_pass or (args.exact_train_eval > 0 and epoch % args.exact_train_eval == 0)
 
 
-        if regime == 'normal':
+        if not exact_pass:
+
+            # Statistics accumulated by the training steps (means over the epoch, losses are summed up as below). The LdS
+            # statistics are those of the train op, i.e. a ratio of 0 and the regular loss in the normal regime
+            n_steps = utils.num_batches(len(X_train), args.batch_size, train_buckets)
+            write_metrics = sess.run(model_write.metrics)
+            rats_lds.append(write_metrics['rat_lds'])
+            lds_loss.append(write_metrics['loss_lds'] * n_steps)
+            write_loss.append(write_metrics['loss'] * n_steps)
+            write_token_accs[:] = write_metrics['token_acc']
+            write_word_accs[:] = write_metrics['word_acc']
+
+            if args.reading:
+                read_metrics = sess.run(model_read.metrics)
+                read_loss.append(read_metrics['loss'] * n_steps)
+                read_token_accs[:] = read_metrics['token_acc']
+                read_word_accs[:] = read_metrics['word_acc']
+
+        elif regime == 'normal':
 
-            for k, (write_inp_batch, write_out_batch,write_alt_targs) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size, Y_alt_train)):
+            for k, (write_inp_batch, write_out_batch, write_word_ids) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size, train_word_ids, train_buckets)):
                 batch_loss, w_batch_logits, loss_lds, rat_lds, rat_corr, x = sess.run([model_write.loss, model_write.logits, 
                     model_write.loss_lds, model_write.rat_lds, model_write.rat_corr, model_write.fc1], feed_dict =
                                                          {model_write.keep_prob:1.0, model_write.inputs: write_inp_batch[:,1:], 
                                                          model_write.outputs: write_out_batch[:, :-1], model_write.targets: write_out_batch[:, 1:],
-                                                        model_write.alternative_targets: write_alt_targs[:,1:,:]})
+                                                        model_write.word_ids: write_word_ids, model_write.word_mask: np.ones(len(write_inp_batch))})
 
                 fullPred, fullTarg = utils.accuracy_prepare(w_batch_logits, write_out_batch[:,1:], dict_char2num_y)
                 dists, write_token_accs[k] = sess.run([acc_object.dists, acc_object.token_acc], 
@@ -410,7 +539,7 @@ if __name__ == '__main__':
                 write_loss.append(batch_loss)
 
                 if epoch > theta_min and epoch < theta_max:
-                    utils.num_to_str(write_inp_batch,w_batch_logits,write_out_batch,write_alt_targs,dict_num2char_x,dict_num2char_y)
+                    utils.num_to_str_help(write_inp_batch,w_batch_logits,write_out_batch,dict_num2char_x,dict_num2char_y)
 
                 #print("Time it took compute analysis: ", time()-tt)
 
@@ -422,7 +551,8 @@ if __name__ == '__main__':
 
                     batch_loss, r_batch_logits = sess.run([model_read.loss, model_read.logits], feed_dict =
                                                          {model_read.keep_prob:1.0, model_read.inputs: read_inp_batch[:,1:], 
-                                                         model_read.outputs: read_out_batch[:, :-1], model_read.targets: read_out_batch[:, 1:]})   
+                                                         model_read.outputs: read_out_batch[:, :-1], model_read.targets: read_out_batch[:, 1:],
+                                                         model_read.word_mask: np.ones(len(read_inp_batch))})   
 
                     read_loss.append(batch_loss)
                     
@@ -436,22 +566,21 @@ if __name__ == '__main__':
 
         elif regime == 'lds':
             
-            for k, (write_inp_batch, write_out_batch, write_alt_targs) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size, Y_alt_train)):
+            for k, (write_inp_batch, write_out_batch, write_word_ids) in enumerate(utils.batch_data(X_train, Y_train, args.batch_size, train_word_ids, train_buckets)):
 
 
                 batch_loss, write_new_targs, rat_lds, rat_corr, batch_loss_reg, w_batch_logits = sess.run([model_write.loss_lds, 
                     model_write.read_inps, model_write.rat_lds, model_write.rat_corr, model_write.loss_reg, model_write.logits], 
                                                                     feed_dict = {model_write.keep_prob:1.0, model_write.inputs: write_inp_batch[:,1:], 
                                                                         model_write.outputs: write_out_batch[:, :-1], model_write.targets: write_out_batch[:, 1:],
-                                                                        model_write.alternative_targets: write_alt_targs[:,1:,:]})
+                                                                        model_write.word_ids: write_word_ids, model_write.word_mask: np.ones(len(write_inp_batch))})
                 #print("Ratio of LdS correct words ", str(rat_lds))
                 rats_lds.append(rat_lds)
                 lds_loss.append(batch_loss)
                 write_loss.append(batch_loss_reg)
 
                 if epoch > theta_min and epoch < theta_max:
-                    utils.num_to_str(write_inp_batch,w_batch_logits,write_out_batch,write_alt_targs,dict_num2char_x,dict_num2char_y)
-                _ = utils.lds_compare(w_batch_logits,write_out_batch[:, 1:], write_alt_targs[:,1:,:], dict_num2char_y, 'train')
+                    utils.num_to_str_help(write_inp_batch,w_batch_logits,write_out_batch,dict_num2char_x,dict_num2char_y)
 
                 fullPred, fullTarg = utils.accuracy_prepare(w_batch_logits, write_out_batch[:,1:], dict_char2num_y)
                 
@@ -467,7 +596,8 @@ if __name__ == '__main__':
 
                     batch_loss, r_batch_logits = sess.run([model_read.loss, model_read.logits], feed_dict =
                                                          {model_read.keep_prob:1.0, model_read.inputs: read_inp_batch, 
-                                                         model_read.outputs: read_out_batch[:, :-1], model_read.targets: read_out_batch[:, 1:]})   
+                                                         model_read.outputs: read_out_batch[:, :-1], model_read.targets: read_out_batch[:, 1:],
+                                                         model_read.word_mask: np.ones(len(read_inp_batch))})   
                     read_loss.append(batch_loss)
 
                     fullPred, fullTarg = utils.accuracy_prepare(r_batch_logits, read_out_batch[:,1:], dict_char2num_x)
@@ -488,7 +618,7 @@ if __name__ == '__main__':
         print("RUN - Ratio correct words: " + str(np.mean(write_word_accs))+" and in LdS sense: " + str(lds_ratios[epoch]))
         print("Displayed run - LdS loss is " + str(lds_losses[epoch]) + " while regular loss is" + str(write_losses[epoch]))
 
-        if epoch % args.save_model == 0 and epoch > 1:
+        if epoch % args.save_model == 0 and epoch > 1 and exact_pass:
             np.savez(save_path + '/write_step' + str(epoch)+'.npz', logits=w_batch_logits, dict=dict_char2num_y, targets=write_out_batch[:,1:])
             np.savez(save_path + '/read_step' + str(epoch)+'.npz', logits=r_batch_logits, dict=dict_char2num_x, targets=read_out_batch[:,1:])
 
@@ -513,19 +643,12 @@ if __name__ == '__main__':
         if regime == 'normal':
 
 
-            write_dec_input = np.zeros((len(X_test), 1)) + dict_char2num_y['<GO>']
-            # Generate character by character (for the entire batch, weirdly)
-            for i in range(y_seq_length):
-
-                write_test_logits, x, d= sess.run([model_write.logits, model_write.fc1, model_write.dec_outputs],
-                    feed_dict={model_write.keep_prob:1.0, model_write.inputs:X_test[:,1:], model_write.outputs:write_dec_input})
-                #print("DEC_OUT",d.shape, "HIDDEN 1", x.shape, "LOGITS", write_test_logits.shape)
-                write_prediction = write_test_logits[:,-1].argmax(axis=-1)
-                write_dec_input = np.hstack([write_dec_input, write_prediction[:,None]])
-            write_test_new_targs, tmp = utils.lds_compare(write_dec_input[:,1:],Y_test[:,1:], Y_alt_test[:,1:], dict_num2char_y, 'test')
+            # Encode once and generate character by character in-graph (for the entire test set)
+            write_predictions = utils.greedy_decode(sess, model_write, X_test[:,1:], dict_char2num_y['<PAD>'], test_buckets)
+            write_test_new_targs, tmp, _ = utils.lds_compare_trie(write_predictions, Y_test[:,1:], test_trie)
             lds_ratios_test[epoch] = tmp
 
-            fullPred, fullTarg = utils.accuracy_prepare(write_dec_input[:,1:], Y_test[:,1:],dict_char2num_y, mode='test')
+            fullPred, fullTarg = utils.accuracy_prepare(write_predictions, Y_test[:,1:],dict_char2num_y, mode='test')
             print(fullTarg.shape)
             dists, write_tokenAcc = sess.run([acc_object.dists, acc_object.token_acc], 
                     feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg: fullTarg})
@@ -541,18 +664,11 @@ if __name__ == '__main__':
 
             # Test READING
             if args.reading:
-                read_dec_input = np.zeros((len(X_test), 1)) + dict_char2num_x['<GO>']
-                # Generate character by character (for the entire batch, weirdly)
-                for i in range(x_seq_length):
-                    #print(i)
-                    read_test_logits = sess.run(model_read.logits, 
-                        feed_dict={model_read.keep_prob:1.0, model_read.inputs:Y_test[:,1:], model_read.outputs:read_dec_input})
-                    read_prediction = read_test_logits[:,-1].argmax(axis=-1)
-                    read_dec_input = np.hstack([read_dec_input, read_prediction[:,None]])
-
+                read_test_buckets = (utils.assign_buckets(Y_test[:,1:], dict_char2num_y['<PAD>'], read_boundaries, go=False), 
+                    read_bucket_lengths) if read_boundaries is not None else None
+                read_predictions = utils.greedy_decode(sess, model_read, Y_test[:,1:], dict_char2num_x['<PAD>'], read_test_buckets)
 
-
-                fullPred, fullTarg = utils.accuracy_prepare(read_dec_input[:,1:], X_test[:,1:],dict_char2num_x, mode='test')
+                fullPred, fullTarg = utils.accuracy_prepare(read_predictions, X_test[:,1:],dict_char2num_x, mode='test')
                 dists, read_tokenAcc = sess.run([acc_object.dists, acc_object.token_acc], 
                         feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg: fullTarg})
                 read_wordAcc  = np.count_nonzero(dists==0) / len(dists) 
@@ -565,19 +681,13 @@ if __name__ == '__main__':
 
         elif regime == 'lds':
 
-            write_dec_input = np.zeros((len(X_test), 1)) + dict_char2num_y['<GO>']
-            for i in range(y_seq_length):
-
-                write_test_logits = sess.run(model_write.logits, 
-                    feed_dict={model_write.keep_prob:1.0, model_write.inputs:X_test[:,1:], model_write.outputs:write_dec_input})
-                write_prediction = write_test_logits[:,-1].argmax(axis=-1)
-                write_dec_input = np.hstack([write_dec_input, write_prediction[:,None]])
+            write_predictions = utils.greedy_decode(sess, model_write, X_test[:,1:], dict_char2num_y['<PAD>'], test_buckets)
 
             # Now the generated sequence need to be lds_compareed with the alternative targets:
-            write_test_new_targs, tmp = utils.lds_compare(write_dec_input[:,1:],Y_test[:,1:], Y_alt_test[:,1:], dict_num2char_y, 'test')
+            write_test_new_targs, tmp, _ = utils.lds_compare_trie(write_predictions, Y_test[:,1:], test_trie)
             lds_ratios_test[epoch] = tmp
 
-            fullPred, fullTarg = utils.accuracy_prepare(write_dec_input[:,1:], write_test_new_targs,dict_char2num_y, mode='test')
+            fullPred, fullTarg = utils.accuracy_prepare(write_predictions, write_test_new_targs,dict_char2num_y, mode='test')
             dists, write_tokenAcc = sess.run([acc_object.dists, acc_object.token_acc], 
                     feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg: fullTarg})
 
@@ -591,15 +701,12 @@ if __name__ == '__main__':
 
             # Test READING
             if args.reading:
-                read_dec_input = np.zeros((len(X_test), 1)) + dict_char2num_x['<GO>']
                 read_test_new_inp = write_test_new_targs
-                for i in range(x_seq_length):
-                    read_test_logits = sess.run(model_read.logits, feed_dict={model_read.keep_prob:1.0, 
-                            model_read.inputs:read_test_new_inp, model_read.outputs:read_dec_input})
-                    read_prediction = read_test_logits[:,-1].argmax(axis=-1)
-                    read_dec_input = np.hstack([read_dec_input, read_prediction[:,None]])
+                read_test_buckets = (utils.assign_buckets(read_test_new_inp, dict_char2num_y['<PAD>'], read_boundaries, go=False), 
+                    read_bucket_lengths) if read_boundaries is not None else None
+                read_predictions = utils.greedy_decode(sess, model_read, read_test_new_inp, dict_char2num_x['<PAD>'], read_test_buckets)
 
-                fullPred, fullTarg = utils.accuracy_prepare(read_dec_input[:,1:], X_test[:,1:],dict_char2num_x, mode='test')
+                fullPred, fullTarg = utils.accuracy_prepare(read_predictions, X_test[:,1:],dict_char2num_x, mode='test')
                 dists, read_tokenAcc = sess.run([acc_object.dists, acc_object.token_acc], 
                         feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg: fullTarg})
                 read_wordAcc  = np.count_nonzero(dists==0) / len(dists) 
@@ -626,55 +733,7 @@ if __name__ == '__main__':
                     write_loss=write_losses, read_losses=read_losses, lds_ratios_test=lds_ratios_test)
             saver.save(sess, save_path + '/my_test_model',global_step=epoch)        
 
-        # If lds learning is performed, training regime is changed to normal after half of the epochs 
-        if args.learn_type == 'lds' or args.learn_type == 'intervened':
-
-            if args.epochs // 2 == epoch and regime == 'lds':
-                regime = 'normal'
-                print("Training regime changed to normal\n")
-
-        # In interleaved regime, in regular training (2nd half), every 5th epoch is again LdS epoch
-        if args.learn_type == 'interleaved':
-
-            if epoch > args.epochs // 2 and epoch % 5 == 0:
-                regime = 'lds'
-                print("Training regime changed to lds\n")
-
-            elif epoch > args.epochs // 2 and regime == 'lds':
-                regime = 'normal'
-                print("Training regime changed back to normal\n") 
-
-        # In intervened regime, within LdS training (1st half), every 10th epoch is a regular epoch
-        elif args.learn_type == 'intervened':
-
-            if epoch < args.epochs // 2 and epoch % 10 == 0 and epoch > 0:
-                regime = 'normal'
-                print("Training regime changed to normal\n")
 
-            elif epoch < args.epochs // 2 and regime == 'normal':
-                regime = 'lds'
-                print("Training regime changed back to lds\n") 
-
-        # In intervened+interleaved regime, both other regimes are combined
-        elif args.learn_type == 'intervened + interleaved':
-
-            if epoch < args.epochs // 2 and epoch % 10 == 0 and epoch > 0:
-                regime = 'normal'
-                print("Training regime changed to normal\n")
-
-            elif epoch < args.epochs // 2 and regime == 'normal':
-                regime = 'lds'
-                print("Training regime changed back to lds\n") 
-
-            elif epoch > args.epochs // 2 and epoch % 5 == 0:
-                regime = 'lds'
-                print("Training regime changed to lds\n")
-
-            elif epoch > args.epochs // 2 and regime == 'lds':
-                regime = 'normal'
-                print("Training regime changed back to normal\n") 
-
-    
     saver.save(sess, save_path + '/my_test_model',global_step=epoch)
   
 
@@ -685,6 +744,9 @@ if __name__ == '__main__':
     np.savez(save_path + '/metrics.npz', trainPerf=trainPerf, testPerf=testPerf, lds_ratios=lds_ratios,lds_loss=lds_losses, 
         write_loss=write_losses, read_losses=read_losses, lds_ratios_test=lds_ratios_test, lt=lt)
 
+    if args.teacher:
+        teacher_sess.close()
+
 
 print("Learning types were ", lt)
 print("DONE!")   
@@ -0,0 +1,305 @@
+import warnings, os, argparse, json, socket, threading, queue, asyncio
+warnings.filterwarnings("ignore",category=FutureWarning)
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from time import time
+
+
+"""
+Local inference server for the trained writing and reading modules.
+
+Single-word requests of concurrent clients are queued and flushed into one batched decode, as soon as MAX_BATCH_SIZE words
+are waiting or the oldest one waited MAX_LATENCY seconds. An asyncio front end serves a unix socket (or a TCP port on
+localhost); per module, one worker thread owns the session of the predictor (see predictor.py).
+
+Protocol: one JSON object per line, e.g.
+    {"task": "write", "word": "maus"}           ->  {"output": "maus"}
+    {"task": "read", "words": ["maus", "mia"]}  ->  {"outputs": [...]}
+    {"stats": true}                             ->  {"write": {...}, "read": {...}}
+Failed requests are answered with {"error": "..."}.
+
+Start the server:
+    python server.py --path <run folder> --epochs 249 --data ../data/celex.npz --socket /tmp/lds.sock
+and query it with LdSClient('/tmp/lds.sock').predict(['maus'], 'write') or python server.py --client --socket ... words
+"""
+
+
+
+class MicroBatcher(object):
+
+    """
+    Queues single predictions and runs them in batches on a worker thread (the only thread that calls PREDICT_FN).
+    """
+
+    def __init__(self, predict_fn, max_batch_size=512, max_latency=0.005, history=10000):
+        """
+        Parameters:
+        --------------
+        PREDICT_FN      {callable} maps a list of str to a list of str, e.g. LdSPredictor.predict
+        MAX_BATCH_SIZE  {int} a batch is flushed as soon as this amount of words is waiting
+        MAX_LATENCY     {float} or when the first word of the batch waited this amount of seconds
+        HISTORY         {int} amount of latest requests kept for the latency statistics
+        """
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.queue = queue.Queue()
+        # The worker thread records the latencies, stats reads them on the thread of the server
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history)
+        self.num_requests = 0
+        self.num_batches = 0
+
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+
+    def submit(self, word):
+        """ Queues a word, returns a concurrent.futures.Future with the prediction """
+
+        future = Future()
+        self.queue.put((word, future, time()))
+        return future
+
+
+    def work(self):
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            # Collect further words until the batch is full or the deadline of the first word is reached
+            batch = [item]
+            deadline = item[2] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time()
+                try:
+                    item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+
+            self.run(batch)
+
+
+    def run(self, batch):
+
+        words = [word for word, _, _ in batch]
+        try:
+            outputs = self.predict_fn(words)
+        except Exception:
+            # A single invalid word should not fail the others, thus retry word by word
+            outputs = []
+            for word in words:
+                try:
+                    outputs.append(self.predict_fn([word])[0])
+                except Exception as error:
+                    outputs.append(error)
+
+        done = time()
+        with self.lock:
+            self.latencies.extend(done - start for _, _, start in batch)
+            self.num_requests += len(batch)
+            self.num_batches += 1
+
+        for (_, future, _), output in zip(batch, outputs):
+            if isinstance(output, Exception):
+                future.set_exception(output)
+            else:
+                future.set_result(output)
+
+
+    def stats(self):
+
+        with self.lock:
+            latencies = np.array(list(self.latencies)) * 1000
+            num_requests, num_batches = self.num_requests, self.num_batches
+
+        return {'requests':num_requests, 'batches':num_batches,
+                'mean_batch_size':num_requests / max(num_batches, 1),
+                'p50_ms':float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99_ms':float(np.percentile(latencies, 99)) if len(latencies) else None}
+
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+
+
+
+class LdSServer(object):
+
+    """
+    asyncio front end. BATCHERS maps the tasks ('write', 'read') to their MicroBatcher.
+    """
+
+    def __init__(self, batchers):
+        self.batchers = batchers
+        self.loop = None
+        self.ready = threading.Event()
+
+
+    async def answer(self, request):
+
+        if request.get('stats'):
+            return {task:batcher.stats() for task,batcher in self.batchers.items()}
+
+        task = request.get('task', 'write')
+        if task not in self.batchers:
+            raise ValueError("Unknown task " + str(task) + ", choose from " + str(sorted(self.batchers)))
+
+        words = request['words'] if 'words' in request else [request['word']]
+        futures = [asyncio.wrap_future(self.batchers[task].submit(word)) for word in words]
+        outputs = await asyncio.gather(*futures)
+
+        return {'outputs':list(outputs)} if 'words' in request else {'output':outputs[0]}
+
+
+    async def handle(self, reader, writer):
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                response = await self.answer(json.loads(line.decode('utf8')))
+            except Exception as error:
+                response = {'error':str(error)}
+            writer.write((json.dumps(response) + '\n').encode('utf8'))
+            await writer.drain()
+
+        writer.close()
+
+
+    def serve(self, socket_path=None, port=None):
+        """ Serves forever on the unix socket SOCKET_PATH, or on localhost:PORT if a port is given """
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if port:
+            server = loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', port))
+        else:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = loop.run_until_complete(asyncio.start_unix_server(self.handle, socket_path))
+
+        print("Serving on ", socket_path if not port else '127.0.0.1:' + str(port))
+        self.loop = loop
+        self.ready.set()
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+
+
+    def stop(self):
+        """ Stops serve, from another thread """
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+
+class LdSClient(object):
+
+    """
+    Blocking client for the LdSServer, e.g. for tests and for other tools.
+    """
+
+    def __init__(self, socket_path=None, port=None, timeout=60):
+
+        if port:
+            self.sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rb')
+
+
+    def request(self, request):
+
+        self.sock.sendall((json.dumps(request) + '\n').encode('utf8'))
+        response = json.loads(self.file.readline().decode('utf8'))
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+
+    def predict(self, words, task='write'):
+        return self.request({'task':task, 'words':list(words)})['outputs']
+
+
+    def stats(self):
+        return self.request({'stats':True})
+
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--path', type=str,
+                        help='The folder of the trained model.')
+    parser.add_argument('--epochs', type=int,
+                        help="The timestamp (in epochs) of the checkpoint.")
+    parser.add_argument('--data', type=str,
+                        help='The .npz file of the dataset the model was trained on.')
+    parser.add_argument('--tasks', default=['write', 'read'], nargs='+', type=str,
+                        help="The modules to serve, from {write, read}. Default are both.")
+    parser.add_argument('--socket', default='/tmp/lds.sock', type=str,
+                        help='The unix socket to serve on.')
+    parser.add_argument('--port', default=0, type=int,
+                        help='If given, serve on this TCP port on localhost instead of the unix socket.')
+    parser.add_argument('--max_batch_size', default=512, type=int,
+                        help='Amount of waiting words that triggers a batched decode.')
+    parser.add_argument('--max_latency', default=0.005, type=float,
+                        help='Maximal time (in s) a word waits for further words before it is decoded.')
+    parser.add_argument('--backend', default='tf', type=str,
+                        help='The inference backend, from {tf, onnx, onnx_int8} (see predictor.py).')
+    parser.add_argument('--client', default=False, type=bool,
+                        help='Act as client: send the given words to a running server and print the predictions.')
+    parser.add_argument('--task', default='write', type=str,
+                        help="For the client, the module to query.")
+    parser.add_argument('words', nargs='*',
+                        help='For the client, the sequences to predict.')
+    args = parser.parse_args()
+
+    if args.client:
+        with LdSClient(args.socket, args.port) as client:
+            for word, output in zip(args.words, client.predict(args.words, args.task)):
+                print(word, '=>', output)
+
+    else:
+        from predictor import LdSPredictor, OnnxPredictor
+        backends = {'tf':LdSPredictor, 'onnx':OnnxPredictor, 'onnx_int8':lambda *args: OnnxPredictor(*args, quantized=True)}
+        backend = backends[args.backend]
+
+        batchers = {}
+        for task in args.tasks:
+            predictor = backend(args.path, args.epochs, task, args.data)
+            batchers[task] = MicroBatcher(predictor.predict, args.max_batch_size, args.max_latency)
+
+        LdSServer(batchers).serve(args.socket, args.port)
@@ -0,0 +1,14 @@
+import autotune
+
+
+def test_decode_threads_ignore_training_settings(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(autotune, 'CACHE', str(tmpdir.join('autotune.json')))
+    spec = autotune.model_spec(5, 6, 10, 12, 8, 8, 1, 16, 32)
+    trained = dict(spec, reading=True, xla='jit')
+    autotune.save_entry(autotune.host_key(), trained, {'train':{'intra':2, 'inter':1}, 'decode':{'intra':4, 'inter':2}})
+
+    # A run with --reading True --xla jit was tuned, eval_model and the predictors look it up by its meta tags
+    assert autotune.tuned_threads(trained, 'train') == (2, 1)
+    assert autotune.tuned_threads(spec, 'train') is None
+    assert autotune.tuned_threads(spec, 'decode') == (4, 2)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+pytest.importorskip('tensorflow.contrib')
+import utils
+from bLSTM import bLSTM
+from test_utils import write_run
+
+
+def test_distillation_step(tmpdir):
+
+    # The teacher is rebuilt from the meta tags of a toy run, as in run.py --teacher (5 -> 6 tokens, dictionaries of 7 and 8)
+    write_run(str(tmpdir))
+    teacher_graph = tf.Graph()
+    with teacher_graph.as_default():
+        teacher, _ = utils.rebuild_model(utils.read_model_args(str(tmpdir)), 'write', 1)
+        teacher_init = tf.global_variables_initializer()
+
+    rng = np.random.RandomState(0)
+    x = np.concatenate([np.ones((6, 1)), rng.randint(2, 8, (6, 5))], axis=1).astype(np.int64)
+    y = np.concatenate([np.ones((6, 1)), rng.randint(2, 9, (6, 6))], axis=1).astype(np.int64)
+
+    with tf.Session(graph=teacher_graph) as teacher_sess:
+        teacher_sess.run(teacher_init)
+        teacher_logits = teacher_sess.run(teacher.logits, feed_dict={teacher.keep_prob:1.0, teacher.inputs:x[:,1:],
+            teacher.outputs:y[:,:-1]})
+
+    # The student reads from a pipeline by default (never initialized here), the distillation steps feed their batches
+    with tf.Graph().as_default():
+        iterator, batch, _ = utils.input_pipeline(x, y, 4, pad_remainder=True)
+        with tf.variable_scope('writing'):
+            student = bLSTM(5, 6, 7, 8, 4, 4, 1, 8, 4, 'normal', 'write', 1, fc_size=16, data=batch)
+            student.forward()
+            student.backward()
+            student.distillation()
+        init = tf.global_variables_initializer()
+
+        with tf.Session() as sess:
+            sess.run(init)
+            feed_dict = {student.keep_prob:1.0, student.inputs:x[:,1:], student.outputs:y[:,:-1], student.targets:y[:,1:],
+                student.word_ids:np.arange(len(x)), student.word_mask:np.ones(len(x)), student.teacher_logits:teacher_logits}
+            loss_before = sess.run(student.distill_loss, feed_dict=feed_dict)
+            sess.run(student.distill_optimizer, feed_dict=feed_dict)
+            loss_after = sess.run(student.distill_loss, feed_dict=feed_dict)
+
+    assert np.isfinite(loss_before) and loss_after < loss_before
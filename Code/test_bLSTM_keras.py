@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+from bLSTM_keras import convert_lstm_weights, KerasbLSTM
+from test_utils import write_run
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def tf1_step(x, h, c, kernel, bias, forget_bias=1.0):
+    """ One step of a TF1 LSTMCell: gates (i, j, f, o) on [x, h], forget bias added at runtime """
+
+    i, j, f, o = np.split(np.concatenate([x, h], axis=1).dot(kernel) + bias, 4, axis=1)
+    c = sigmoid(f + forget_bias) * c + sigmoid(i) * np.tanh(j)
+    return sigmoid(o) * np.tanh(c), c
+
+
+def keras_step(x, h, c, kernel, recurrent_kernel, bias):
+    """ One step of a Keras LSTM: gates (i, f, c, o), separate input and recurrent kernel """
+
+    i, f, g, o = np.split(x.dot(kernel) + h.dot(recurrent_kernel) + bias, 4, axis=1)
+    c = sigmoid(f) * c + sigmoid(i) * np.tanh(g)
+    return sigmoid(o) * np.tanh(c), c
+
+
+def test_convert_lstm_weights():
+
+    rng = np.random.RandomState(0)
+    input_size, units, batch_size = 3, 4, 5
+    kernel = rng.randn(input_size + units, 4 * units)
+    bias = rng.randn(4 * units)
+    x, h, c = rng.randn(batch_size, input_size), rng.randn(batch_size, units), rng.randn(batch_size, units)
+
+    weights = convert_lstm_weights(kernel, bias)
+    assert [w.shape for w in weights] == [(input_size, 4 * units), (units, 4 * units), (4 * units,)]
+
+    for expected, converted in zip(tf1_step(x, h, c, kernel, bias), keras_step(x, h, c, *weights)):
+        assert np.allclose(expected, converted)
+    # The forget bias is part of the converted bias
+    assert not np.allclose(tf1_step(x, h, c, kernel, bias, forget_bias=0.0)[1], keras_step(x, h, c, *weights)[1])
+
+
+def write_tf1_checkpoint(prefix, weights):
+    """ Saves the np.arrays WEIGHTS under their names as a TF1 (name based) checkpoint """
+
+    with tf.Graph().as_default():
+        variables = [tf.compat.v1.Variable(value, name=name) for name, value in weights.items()]
+        with tf.compat.v1.Session() as sess:
+            sess.run(tf.compat.v1.global_variables_initializer())
+            tf.compat.v1.train.Saver(variables).save(sess, prefix)
+
+
+def test_from_run(tmpdir):
+
+    if not tf.__version__.startswith('2'):
+        pytest.skip('KerasbLSTM requires TensorFlow 2')
+
+    # The toy run of write_run: 5 -> 6 tokens, dictionaries of 7 and 8 symbols, embeddings of 4, 1 layer of 8 nodes, fc of 16
+    write_run(str(tmpdir))
+    rng = np.random.RandomState(0)
+    encoding, decoding = 'writing/encoding_write/', 'writing/decoding_write/'
+    cell = encoding + 'stack_bidirectional_rnn/cell_0/bidirectional_rnn/{}/lstm_cell/'
+    weights = {encoding + 'enc_embedding':rng.randn(8, 4), decoding + 'dec_embedding':rng.randn(9, 4),
+        decoding + 'rnn/lstm_cell/kernel':rng.randn(4 + 16, 64), decoding + 'rnn/lstm_cell/bias':rng.randn(64),
+        decoding + 'fully_connected/weights':rng.randn(16, 16), decoding + 'fully_connected/biases':rng.randn(16),
+        decoding + 'fully_connected_1/weights':rng.randn(16, 9), decoding + 'fully_connected_1/biases':rng.randn(9)}
+    for direction in ['fw', 'bw']:
+        weights[cell.format(direction) + 'kernel'] = rng.randn(4 + 8, 32)
+        weights[cell.format(direction) + 'bias'] = rng.randn(32)
+    weights = {name:value.astype(np.float32) for name, value in weights.items()}
+    write_tf1_checkpoint(os.path.join(str(tmpdir), 'my_test_model-0'), weights)
+
+    model = KerasbLSTM.from_run(str(tmpdir), 0, 'write', go_id=1)
+
+    assert np.array_equal(model.input_embedding.get_weights()[0], weights[encoding + 'enc_embedding'])
+    expected = convert_lstm_weights(weights[decoding + 'rnn/lstm_cell/kernel'], weights[decoding + 'rnn/lstm_cell/bias'])
+    assert all(np.allclose(w, e) for w, e in zip(model.decoder.get_weights(), expected))
+    assert np.array_equal(model.logits_layer.get_weights()[0], weights[decoding + 'fully_connected_1/weights'])
+    assert model.greedy_decode(np.ones((2, 5), np.int32), 6).shape == (2, 6)
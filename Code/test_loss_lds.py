@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+import utils
+from loss_lds import spelling_hash, _spelling_hash, lds_targets
+
+
+PAD = 1
+
+
+def run(fetches):
+
+    with tf.Session() as sess:
+        return sess.run(fetches)
+
+
+def one_hot_logits(sequences, num_classes=8):
+    return np.eye(num_classes, dtype=np.float32)[sequences]
+
+
+def test_hashes_agree():
+
+    rng = np.random.RandomState(0)
+    sequences = rng.randint(0, 8, (100, 12))
+    sequences[:50,:4] = PAD
+
+    with tf.Graph().as_default():
+        graph_hashes = run(_spelling_hash(tf.constant(sequences), PAD))
+
+    assert np.array_equal(graph_hashes, spelling_hash(sequences, PAD))
+
+
+def test_hashes_ignore_leading_padding():
+
+    word = np.array([[3, 4, 5]])
+    padded = np.array([[PAD, PAD, 3, 4, 5]])
+    assert spelling_hash(word, PAD) == spelling_hash(padded, PAD)
+
+    with tf.Graph().as_default():
+        word_hash, padded_hash = run([_spelling_hash(tf.constant(word), PAD), _spelling_hash(tf.constant(padded), PAD)])
+    assert word_hash == padded_hash
+
+
+def test_class_zero_is_not_padding():
+
+    # A generated 0 is a (wrong) token, not a shorter spelling
+    assert spelling_hash(np.array([[0, 3, 4]]), PAD) != spelling_hash(np.array([[PAD, 3, 4]]), PAD)
+
+
+def test_lds_targets():
+
+    targets = np.array([[PAD, 3, 4], [5, 6, 7], [PAD, 3, 4]])
+    # Word 0 accepts 3 3 4 and (zero-padded) 4 4, word 1 accepts 5 5 5, word 2 has no alternatives
+    alt_targets = [[np.array([2, 3, 3, 4]), np.array([2, 0, 4, 4])], [np.array([2, 5, 5, 5])], []]
+    keys = utils.spelling_keys(alt_targets, PAD)
+    assert len(keys) == 4 and keys[0] == -1 and np.all(np.diff(keys) > 0)
+
+    writings = np.array([[3, 3, 4], [PAD, 4, 4], [3, 3, 4], [0, 4, 4]])
+    word_ids = np.array([0, 0, 2, 0])
+    with tf.Graph().as_default():
+        new_targets, ratio_lds, _ = run(lds_targets(tf.constant(one_hot_logits(writings)), tf.constant(targets[word_ids]),
+            tf.constant(keys), tf.constant(word_ids, tf.int64), PAD))
+
+    # The alternatives of word 0 are only accepted for word 0, a generated 0 does not count as padding
+    assert new_targets.tolist() == [[3, 3, 4], [PAD, 4, 4], [PAD, 3, 4], [PAD, 3, 4]]
+    assert ratio_lds == 0.5
+
+
+def test_lds_targets_mask():
+
+    targets = np.array([[PAD, 3, 4], [PAD, 3, 4]])
+    keys = utils.spelling_keys([[np.array([2, 3, 3, 4])]], PAD)
+    writings = np.array([[3, 3, 4], [0, 0, 0]])
+    with tf.Graph().as_default():
+        _, ratio_lds, ratio_corr = run(lds_targets(tf.constant(one_hot_logits(writings)), tf.constant(targets),
+            tf.constant(keys), tf.constant([0, 0], tf.int64), PAD, mask=tf.constant([1.0, 0.0])))
+
+    # The second (filling) row is not counted
+    assert ratio_lds == 1.0 and ratio_corr == 0.0
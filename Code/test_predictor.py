@@ -0,0 +1,59 @@
+import functools
+import numpy as np
+import pytest
+
+from predictor import Predictor
+
+
+# Both directions share one dictionary, the toy model writes every character twice
+DICT = {'<PAD>':1, '<GO>':2, 'a':3, 'b':4, 'c':5}
+
+
+class DoublingPredictor(Predictor):
+
+    """ Predictor with a toy model instead of a network: the output is the input with every character repeated """
+
+    def load_model(self):
+
+        self.input_seq_length = 4
+        self.output_seq_length = 8
+        # Corpus words of up to 2 characters only had outputs of up to 2 characters
+        self.bucket_lengths = np.array([[2, 2], [4, 8]])
+        self.checkpoint = 'toy'
+        self.decoded_lengths = []
+
+    def decode_batch(self, seqs, decode_length):
+
+        self.decoded_lengths.append(decode_length)
+        predictions = np.zeros((len(seqs), decode_length), dtype=np.int32) + DICT['<PAD>']
+        for row, seq in enumerate(seqs):
+            output = np.repeat(seq[seq != DICT['<PAD>']], 2)[-decode_length:]
+            predictions[row, decode_length - len(output):] = output
+        return predictions
+
+
+@pytest.fixture
+def predictor(tmpdir, monkeypatch):
+
+    # The datasets store the dictionaries as pickled objects (numpy loaded them by default before 1.16.3)
+    monkeypatch.setattr(np, 'load', functools.partial(np.load, allow_pickle=True))
+    data_path = str(tmpdir.join('toy.npz'))
+    np.savez(data_path, phon_dict=np.array(DICT), word_dict=np.array(DICT), phons=np.array([[2, 1, 3, 4]]),
+        words=np.array([[2, 1, 3, 4]]))
+
+    return DoublingPredictor(str(tmpdir), 0, 'write', data_path, cache_size=0)
+
+
+def test_novel_word_longer_than_bucket_output(predictor):
+
+    # 'ab' falls into the first bucket, but its output is longer than the output length of that bucket
+    assert predictor.predict(['ab', 'abc', 'c']) == ['aabb', 'aabbcc', 'cc']
+    assert max(predictor.decoded_lengths) == predictor.output_seq_length
+
+
+def test_known_words_use_bucket_output_length(predictor):
+
+    seqs = predictor.encode(['ab', 'abc'])
+    predictor.predict_ids(seqs, known=True)
+
+    assert sorted(predictor.decoded_lengths) == [2, 8]
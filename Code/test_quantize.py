@@ -0,0 +1,49 @@
+import numpy as np
+
+from quantize import edit_distances, calibration_split
+
+
+def levenshtein(a, b):
+    """ Reference edit distance of two token lists """
+
+    dists = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        prev, dists = dists, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            dists[j] = min(prev[j] + 1, dists[j-1] + 1, prev[j-1] + (a[i-1] != b[j-1]))
+    return dists[len(b)]
+
+
+def test_edit_distances_examples():
+
+    pad = 1
+    predictions = np.array([[1, 1, 3, 4], [3, 4, 5, 6], [1, 1, 1, 1], [1, 3, 0, 4]])
+    targets = np.array([[1, 1, 3, 4], [1, 3, 5, 6], [1, 1, 3, 4], [1, 1, 3, 4]])
+
+    # Equal, one deletion of three tokens, empty prediction, <PAD> and 0 are ignored
+    assert np.allclose(edit_distances(predictions, targets, pad), [0, 1 / 3, 1, 0])
+
+
+def test_edit_distances_random():
+
+    rng = np.random.RandomState(0)
+    pad = 1
+    predictions = rng.randint(0, 6, (200, 7))
+    targets = rng.randint(0, 6, (200, 7))
+
+    expected = []
+    for pred, targ in zip(predictions, targets):
+        pred, targ = [t for t in pred if t not in (0, pad)], [t for t in targ if t not in (0, pad)]
+        expected.append(levenshtein(pred, targ) / max(len(targ), 1))
+
+    assert np.allclose(edit_distances(predictions, targets, pad), expected)
+
+
+def test_calibration_split():
+
+    test_indices = list(range(10, 30))
+    calibration, evaluation = calibration_split(test_indices, 5)
+
+    assert len(calibration) == 5 and len(evaluation) == 15
+    assert sorted(np.concatenate([calibration, evaluation]).tolist()) == test_indices
+    assert np.array_equal(calibration, calibration_split(test_indices, 5)[0])
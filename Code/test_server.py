@@ -0,0 +1,37 @@
+import threading
+import pytest
+
+from server import MicroBatcher, LdSServer, LdSClient
+
+
+def shout(words):
+    """ Stub predictor, fails for empty words """
+
+    if not all(words):
+        raise ValueError('Empty word')
+    return [word.upper() for word in words]
+
+
+def test_round_trip(tmpdir):
+
+    socket_path = str(tmpdir.join('lds.sock'))
+    batcher = MicroBatcher(shout, max_batch_size=4)
+    server = LdSServer({'write':batcher})
+    thread = threading.Thread(target=server.serve, args=(socket_path,), daemon=True)
+    thread.start()
+    assert server.ready.wait(10)
+
+    try:
+        with LdSClient(socket_path, timeout=10) as client:
+            assert client.predict(['maus', 'mia'], 'write') == ['MAUS', 'MIA']
+            assert client.request({'task':'write', 'word':'ei'}) == {'output':'EI'}
+            # An invalid word fails alone
+            with pytest.raises(ValueError, match='Empty word'):
+                client.predict(['ab', ''], 'write')
+            assert client.predict(['ab'], 'write') == ['AB']
+            stats = client.stats()['write']
+            assert stats['requests'] == 6 and stats['p50_ms'] is not None
+    finally:
+        server.stop()
+        thread.join(10)
+        batcher.close()
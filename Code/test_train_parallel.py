@@ -0,0 +1,40 @@
+import multiprocessing as mp
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+from train_parallel import SharedAllReduce
+
+
+SIZE = 5
+
+
+def reduce_worker(rank, reducer, outputs):
+
+    reducer.attach(rank)
+    values = np.arange(SIZE, dtype=np.float32) * (rank + 1)
+    # Two means, so both buffers are used
+    first = reducer.mean(values, 2)
+    second = reducer.mean(values + 1, 2)
+    broadcast = reducer.broadcast(np.full(3, rank + 1, dtype=np.float32))
+    outputs.put((rank, first, second, broadcast, reducer.consistent(rank)))
+
+
+def test_mean_and_broadcast():
+
+    ctx = mp.get_context('spawn')
+    reducer = SharedAllReduce(ctx, 2, SIZE)
+    outputs = ctx.Queue()
+    workers = [ctx.Process(target=reduce_worker, args=(rank, reducer, outputs)) for rank in range(2)]
+    for worker in workers:
+        worker.start()
+    results = sorted(outputs.get(timeout=120) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+
+    for rank, first, second, broadcast, consistent in results:
+        assert np.array_equal(first, np.arange(SIZE) * 1.5)
+        assert np.array_equal(second, np.arange(SIZE) * 1.5 + 1)
+        assert np.array_equal(broadcast, np.ones(3))
+        assert not consistent
@@ -0,0 +1,129 @@
+import argparse, os
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+import utils
+
+
+# Two words of length 4 (0 pads at the end). Word 0 is accepted as 1 2 3 0 and 1 2 4 0, word 1 as 5 6 0 0, 5 7 7 0 and 5 6 6 0
+TARGETS = np.array([[1, 2, 3, 0], [5, 6, 0, 0]])
+ALT_TARGETS = [[np.array([1, 2, 4, 0])], [np.array([5, 7, 7, 0]), np.array([5, 6, 6, 0])]]
+
+
+def test_trie_match():
+
+    trie = utils.SpellingTrie(TARGETS, ALT_TARGETS)
+    predictions = np.array([[1, 2, 3, 0], [1, 2, 4, 0], [1, 2, 5, 0], [5, 6, 0, 0], [5, 7, 7, 0], [5, 6, 6, 0], [5, 6, 6, 6], [1, 2, 3, 0]])
+    words = np.array([0, 0, 0, 1, 1, 1, 1, 1])
+
+    assert trie.match(predictions, words).tolist() == [0, 1, -1, 0, 1, 2, -1, -1]
+
+
+def test_trie_match_array_alternatives():
+
+    # 3D alternative targets (num_words x seq_len x max_alt_spellings), zero columns are no alternatives
+    alt_targets = np.zeros((2, 4, 2), dtype=np.int64)
+    alt_targets[0,:,0] = [1, 2, 4, 0]
+    alt_targets[1,:,1] = [5, 7, 7, 0]
+    trie = utils.SpellingTrie(TARGETS, alt_targets)
+
+    assert trie.match(np.array([[1, 2, 4, 0], [5, 7, 7, 0]])).tolist() == [1, 1]
+    assert trie.match(np.array([[5, 6, 0, 0], [1, 2, 3, 0]])).tolist() == [-1, -1]
+
+
+def test_trie_duplicate_keeps_true_target():
+
+    trie = utils.SpellingTrie(TARGETS[:1], [[TARGETS[0].copy()]])
+
+    assert trie.match(TARGETS[:1]).tolist() == [0]
+
+
+def test_trie_children():
+
+    trie = utils.SpellingTrie(TARGETS, ALT_TARGETS)
+
+    # Roots: word 0 continues with 1, word 1 with 5. Rejected walks (-1) have no continuations
+    rows, tokens, _ = trie.children(np.array([0, 1, -1]))
+    assert rows.tolist() == [0, 1]
+    assert tokens.tolist() == [1, 5]
+
+    # After 5 the spellings of word 1 branch into 6 and 7
+    nodes = trie.step(np.array([1]), [5])
+    rows, tokens, children = trie.children(nodes)
+    assert rows.tolist() == [0, 0]
+    assert sorted(tokens.tolist()) == [6, 7]
+    assert trie.step(np.repeat(nodes, 2), tokens).tolist() == children.tolist()
+
+
+def test_lds_compare_trie():
+
+    trie = utils.SpellingTrie(TARGETS, ALT_TARGETS)
+    predictions = np.array([[1, 2, 4, 0], [5, 5, 5, 5]])
+    new_targets, rat, matched = utils.lds_compare_trie(predictions, TARGETS, trie)
+
+    # Only the accepted alternative becomes its own target
+    assert new_targets.tolist() == [[1, 2, 4, 0], [5, 6, 0, 0]]
+    assert rat == 0.5
+    assert matched.tolist() == [1, -1]
+
+
+def test_input_pipeline_pads_remainder():
+
+    x = np.arange(1, 15).reshape(7, 2)
+    y = np.arange(1, 22).reshape(7, 3)
+    with tf.Graph().as_default():
+        iterator, batch, feed_dict = utils.input_pipeline(x, y, 4, pad_remainder=True)
+
+        with tf.Session() as sess:
+            sess.run(iterator.initializer, feed_dict=feed_dict)
+            batches = [sess.run(batch), sess.run(batch)]
+            with pytest.raises(tf.errors.OutOfRangeError):
+                sess.run(batch)
+
+    # Both batches have the full size, the filling rows are zeros with a mask of 0 and no word is lost
+    assert all(b['x'].shape == (4, 2) and b['y'].shape == (4, 3) for b in batches)
+    masks = np.concatenate([b['mask'] for b in batches])
+    assert masks.tolist().count(0) == 1
+    words = np.concatenate([b['x'] for b in batches])
+    assert sorted(words[masks == 1][:,0].tolist()) == x[:,0].tolist()
+    assert not np.any(words[masks == 0])
+
+
+def write_run(path, **changes):
+    """ Writes the meta tags of a toy run to PATH as test_tube does (see utils.meta_tags), returns the arguments of the run """
+
+    pd = pytest.importorskip('pandas')
+    args = dict(input_embed_size=4, output_embed_size=4, num_layers=1, num_nodes=8, batch_size=2, learn_type='lds',
+        optimization='RMSProp', learning_rate=1e-3, LSTM_initializer=None, momentum=0.01, activation_fn=None, bidirectional=True,
+        reading=True, epochs=1, seed=0, dropout=1.0, fc_size=16, cell_impl='standard')
+    args = argparse.Namespace(**dict(args, **changes))
+    tags = utils.meta_tags(args, (5, 6, 7, 8), [0, 2], [1], print_ratio=True)
+
+    os.makedirs(os.path.join(path, 'test_tube_data', 'version_0'))
+    pd.DataFrame({'key':list(tags.keys()), 'value':list(tags.values())}).to_csv(os.path.join(path, 'test_tube_data', 'version_0',
+        'meta_tags.csv'), index=False)
+    return args
+
+
+def test_read_model_args(tmpdir):
+
+    write_run(str(tmpdir))
+    model_args = utils.read_model_args(str(tmpdir))
+
+    assert model_args[:9] == [5, 6, 7, 8, 4, 4, 1, 8, 2]
+    # The booleans print_ratio, bidirectional, reading and restored
+    assert [model_args[11], model_args[17], model_args[18], model_args[21]] == [True, True, True, False]
+    assert [model_args[14], model_args[16]] == ['None', 'None']
+    assert model_args[23:] == [[0, 2], [1], 16, 'standard']
+
+
+def test_rebuild_model_bidirectional(tmpdir):
+
+    write_run(str(tmpdir))
+    with tf.Graph().as_default():
+        model, _ = utils.rebuild_model(utils.read_model_args(str(tmpdir)), 'write', 1)
+        names = [v.op.name for v in tf.global_variables()]
+
+    assert model.bidirectional
+    assert any('/fw/' in name for name in names) and any('/bw/' in name for name in names)
@@ -0,0 +1,533 @@
+import warnings, os, argparse, zlib, queue
+warnings.filterwarnings("ignore",category=FutureWarning)
+import multiprocessing as mp
+import tensorflow as tf
+import numpy as np
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+from time import time
+from sklearn.model_selection import train_test_split
+
+import utils
+from bLSTM import bLSTM
+from eval_checkpoints import core_subsets
+
+
+"""
+Data-parallel training of the writing (and reading) module on the CPU cores of one machine.
+
+Every worker process is pinned to its own subset of cores and holds a replica of the model(s). All workers draw the same
+(shuffled) batches and every worker computes the gradients on its shard of each batch. The gradients are averaged over
+shared memory (SharedAllReduce) and every replica applies the same averaged gradients, i.e. the batch size is global and
+the training follows a single-process run of the same batch size. The replicas start from the weights of worker 0 and
+their parameters are checked to be bit-identical after every epoch.
+
+Worker 0 evaluates the test set, saves the checkpoints and the meta tags (as run.py, so eval_model.py can be used).
+With --scaling, only a few steps are trained for 1, 2, 4, ... workers and the throughput is reported.
+
+Usage:
+    python train_parallel.py --task celex --learn_type lds --reading True --workers 8
+    python train_parallel.py --task celex --scaling True --scaling_steps 20
+"""
+
+
+
+class SharedAllReduce(object):
+
+    """
+    Mean over the workers of flat float32 buffers, over shared memory. Every call is a reduce-scatter (each worker sums its
+    slice of the contributions of all workers) followed by an all-gather (each worker copies all slices). Every element is
+    summed by one worker only, in the order of the ranks, so all workers obtain bit-identical results. The buffers alternate
+    between calls, hence one barrier per phase suffices.
+    Create it before starting the workers and call attach(rank) in every worker.
+    """
+
+    def __init__(self, ctx, num_workers, size):
+
+        self.num_workers = num_workers
+        self.size = size
+        self.contributions = [ctx.RawArray('f', num_workers * size) for _ in range(2)]
+        self.results = [ctx.RawArray('f', size) for _ in range(2)]
+        self.checksums = ctx.RawArray('d', num_workers)
+        self.barrier = ctx.Barrier(num_workers)
+        self.rank = None
+        self.step = 0
+
+
+    def attach(self, rank):
+
+        self.rank = rank
+        bounds = np.linspace(0, self.size, self.num_workers + 1).astype(int)
+        self.slice = slice(bounds[rank], bounds[rank+1])
+        self.contribution_arrays = [np.frombuffer(buffer, dtype=np.float32).reshape(self.num_workers, self.size)
+            for buffer in self.contributions]
+        self.result_arrays = [np.frombuffer(buffer, dtype=np.float32) for buffer in self.results]
+        self.checksum_array = np.frombuffer(self.checksums, dtype=np.float64)
+
+
+    def mean(self, values, divisor):
+        """ The sum of VALUES {np.array} 1D (of length size) over all workers, divided by DIVISOR """
+
+        contributions = self.contribution_arrays[self.step % 2]
+        results = self.result_arrays[self.step % 2]
+        self.step += 1
+
+        contributions[self.rank] = values
+        self.barrier.wait()
+        results[self.slice] = np.sum(contributions[:,self.slice], axis=0) / np.float32(divisor)
+        self.barrier.wait()
+
+        return results.copy()
+
+
+    def broadcast(self, values):
+        """ Overwrites VALUES {np.array} 1D (at most of length size) of every worker with those of worker 0 """
+
+        results = self.result_arrays[self.step % 2]
+        self.step += 1
+
+        if self.rank == 0:
+            results[:len(values)] = values
+        self.barrier.wait()
+        values[:] = results[:len(values)]
+        self.barrier.wait()
+
+        return values
+
+
+    def consistent(self, checksum):
+        """ Whether CHECKSUM {int} is the same on all workers """
+
+        self.checksum_array[self.rank] = checksum
+        self.barrier.wait()
+        same = bool(np.all(self.checksum_array == self.checksum_array[0]))
+        self.barrier.wait()
+
+        return same
+
+
+
+def physical_cores():
+    """ The amount of physical cores (needs psutil, otherwise the cores available to this process are counted) """
+
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    if cores is None:
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+    return cores
+
+
+
+def load_data(args):
+    """ Loads the dataset of ARGS.task and splits it as run.py does (the same seed and test_size give the same split) """
+
+    ((inputs, targets), (dict_char2num_x, dict_char2num_y), alt_targets), mas = utils.retrieve_data(args.task)
+    x_dict_size, num_classes, x_seq_length, y_seq_length, _, _ = utils.set_model_params(inputs, targets, dict_char2num_x, dict_char2num_y)
+
+    indices = range(len(inputs))
+    X_train, X_test, Y_train, Y_test, Y_alt_train_l, Y_alt_test_l, indices_train, indices_test = train_test_split(inputs, targets,
+        alt_targets, indices, test_size=args.test_size, random_state=args.seed)
+
+    data = {'X_train':X_train, 'X_test':X_test, 'Y_train':Y_train, 'Y_test':Y_test, 'indices_train':indices_train,
+            'indices_test':indices_test, 'dict_x':dict_char2num_x, 'dict_y':dict_char2num_y, 'mas':mas,
+            'dims':(x_seq_length, y_seq_length, x_dict_size, num_classes),
+            'K_alt_train':utils.spelling_keys(Y_alt_train_l, dict_char2num_y['<PAD>']),
+            'test_trie':utils.SpellingTrie(Y_test[:,1:], [np.asarray(alts)[:,1:] for alts in Y_alt_test_l]),
+            'train_buckets':None, 'test_buckets':None, 'read_buckets':None, 'buckets':None}
+
+    if args.buckets > 0:
+        bucket_ids, boundaries, bucket_lengths = utils.length_buckets(inputs, targets, dict_char2num_x['<PAD>'], dict_char2num_y['<PAD>'],
+            args.buckets, alt_targets)
+        data['train_buckets'] = (bucket_ids[indices_train], bucket_lengths)
+        data['test_buckets'] = (bucket_ids[indices_test], bucket_lengths)
+        data['read_buckets'] = utils.reading_buckets(inputs, targets, dict_char2num_x['<PAD>'], dict_char2num_y['<PAD>'], args.buckets)
+        data['buckets'] = (boundaries, bucket_lengths)
+
+    return data
+
+
+
+def build_replicas(args, data, alt_keys=None):
+    """
+    Builds the writing (and reading) module in the default graph as run.py does, with the gradients split from the train op
+    (see bLSTM.replica_gradients). The reading module is trained on the batches of the writing module. ALT_KEYS are the keys
+    of the alternative spellings for the LdS regime (see utils.key_table).
+
+    Returns:
+    --------------
+    MODELS          {list} the bLSTM models, writing module first
+    """
+
+    x_seq_length, y_seq_length, x_dict_size, num_classes = data['dims']
+
+    with tf.variable_scope('writing'):
+        model_write = bLSTM(x_seq_length, y_seq_length, x_dict_size, num_classes, args.input_embed_size, args.output_embed_size, args.num_layers,
+            args.num_nodes, args.batch_size, args.learn_type, 'write', data['mas'], optimization=args.optimization, learning_rate=args.learning_rate,
+            LSTM_initializer=args.LSTM_initializer, momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional,
+            fc_size=args.fc_size, cell_impl=args.cell_impl, data={'alternative_keys':alt_keys} if alt_keys is not None else None)
+        model_write.forward()
+        model_write.backward(data['dict_y']['<PAD>'])
+        model_write.inference(data['dict_y']['<GO>'])
+        model_write.replica_gradients()
+    models = [model_write]
+
+    if args.reading:
+        # It reads the targets (the LdS-accepted ones in the LdS regime) and writes the inputs, only its outputs are fed
+        read_batch = {'inputs':model_write.train_targets,
+                      'targets':model_write.inputs}
+        with tf.variable_scope('reading'):
+            model_read = bLSTM(y_seq_length, x_seq_length, num_classes, x_dict_size, args.input_embed_size, args.output_embed_size, args.num_layers,
+                args.num_nodes, args.batch_size, 'normal', 'read', data['mas'], optimization=args.optimization, learning_rate=args.learning_rate,
+                LSTM_initializer=args.LSTM_initializer, momentum=args.momentum, activation_fn=args.activation_fn, bidirectional=args.bidirectional,
+                fc_size=args.fc_size, cell_impl=args.cell_impl, data=read_batch)
+            model_read.forward()
+            model_read.backward(data['dict_x']['<PAD>'])
+            model_read.inference(data['dict_x']['<GO>'])
+            model_read.replica_gradients()
+        models.append(model_read)
+
+    return models
+
+
+
+def gradient_size(args, data):
+    """ Amount of trainable parameters of the replicas (the length of the flat gradient) """
+
+    with tf.Graph().as_default():
+        models = build_replicas(args, data)
+        return sum(int(np.prod(v.shape.as_list())) for model in models for v in model.train_variables)
+
+
+
+def save_meta_tags(args, data, save_path):
+    """ Saves the meta tags of the run as run.py does (see utils.meta_tags) """
+
+    from test_tube import Experiment
+
+    exp = Experiment(name='', save_dir=save_path)
+    exp.add_meta_tags(utils.meta_tags(args, data['dims'], data['indices_train'], data['indices_test']))
+
+
+
+def test_performance(sess, models, acc_object, data, regime):
+    """
+    Token and word accuracy on the test set (greedy decoding) of every module and the LdS ratio of the writing module. In the
+    LdS regime the accepted spellings count as correct and are read by the reading module, as in run.py.
+    """
+
+    pad_x, pad_y = data['dict_x']['<PAD>'], data['dict_y']['<PAD>']
+    X_test, Y_test = data['X_test'], data['Y_test']
+
+    write_predictions = utils.greedy_decode(sess, models[0], X_test[:,1:], pad_y, data['test_buckets'])
+    write_test_new_targs, rat_lds, _ = utils.lds_compare_trie(write_predictions, Y_test[:,1:], data['test_trie'])
+    targets = write_test_new_targs if regime == 'lds' else Y_test[:,1:]
+
+    fullPred, fullTarg = utils.accuracy_prepare(write_predictions, targets, data['dict_y'], mode='test')
+    dists, token_acc = sess.run([acc_object.dists, acc_object.token_acc], feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg:fullTarg})
+    perf = [token_acc, np.count_nonzero(dists==0) / len(dists)]
+
+    if len(models) > 1:
+        read_inputs = write_test_new_targs if regime == 'lds' else Y_test[:,1:]
+        # Reading buckets are assigned by the length of the spellings that are read
+        read_buckets = None
+        if data['read_buckets'] is not None:
+            read_boundaries, read_bucket_lengths = data['read_buckets']
+            read_buckets = (utils.assign_buckets(read_inputs, pad_y, read_boundaries, go=False), read_bucket_lengths)
+        read_predictions = utils.greedy_decode(sess, models[1], read_inputs, pad_x, read_buckets)
+        fullPred, fullTarg = utils.accuracy_prepare(read_predictions, X_test[:,1:], data['dict_x'], mode='test')
+        dists, token_acc = sess.run([acc_object.dists, acc_object.token_acc], feed_dict={acc_object.fullPred:fullPred, acc_object.fullTarg:fullTarg})
+        perf += [token_acc, np.count_nonzero(dists==0) / len(dists)]
+
+    return perf, rat_lds
+
+
+
+def train_worker(rank, cores, reducer, args, save_path, results, max_steps=None):
+    """
+    Trains one replica. All workers iterate over the same batches and take their shard of every batch.
+
+    Parameters:
+    --------------
+    RANK            {int} the index of the worker, worker 0 evaluates and saves the model
+    CORES           {list} the cores the worker is pinned to
+    REDUCER         {SharedAllReduce} shared between all workers
+    ARGS            {argparse.Namespace} the arguments of the run
+    SAVE_PATH       {str} the folder of the run
+    RESULTS         {mp.Queue} worker 0 puts its timings there
+    MAX_STEPS       {int} optional, stop after this amount of steps (for the scaling benchmark, nothing is saved)
+    """
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    reducer.attach(rank)
+    num_workers = reducer.num_workers
+
+    data = load_data(args)
+    X_train, Y_train = data['X_train'], data['Y_train']
+
+    graph = tf.Graph()
+    with graph.as_default():
+        # Dropout masks differ between the replicas, the initial weights are broadcast anyway
+        tf.set_random_seed(args.seed + rank)
+        alt_table, alt_table_init, alt_table_feed = utils.key_table(data['K_alt_train'])
+        models = build_replicas(args, data, alt_table)
+        model_write = models[0]
+
+        variables = [v for model in models for v in model.train_variables]
+        shapes = [v.shape.as_list() for v in variables]
+        splits = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+        flat_gradients = tf.concat([tf.reshape(g, [-1]) for model in models for g in model.gradients], 0)
+        flat_params = tf.concat([tf.reshape(v, [-1]) for v in variables], 0)
+        gradient_inputs = [ph for model in models for ph in model.gradient_inputs]
+        apply_gradients = tf.group(*[model.apply_gradients for model in models])
+
+        init = tf.global_variables_initializer()
+        if rank == 0:
+            saver = tf.train.Saver()
+            acc_object = utils.acc_new()
+            acc_object.accuracy()
+    graph.finalize()
+
+    sess = tf.Session(graph=graph, config=utils.session_config(intra_op_threads=len(cores), inter_op_threads=2))
+    sess.run(init)
+    sess.run(alt_table_init, feed_dict=alt_table_feed)
+
+    # All replicas start from the weights of worker 0
+    params = reducer.broadcast(sess.run(flat_params))
+    for v, value, shape in zip(variables, np.split(params, splits), shapes):
+        v.load(value.reshape(shape), sess)
+
+    if rank == 0 and max_steps is None:
+        save_meta_tags(args, data, save_path)
+        if data['buckets'] is not None:
+            np.savez(save_path + '/buckets.npz', boundaries=data['buckets'][0], bucket_lengths=data['buckets'][1],
+                read_boundaries=data['read_buckets'][0], read_bucket_lengths=data['read_buckets'][1])
+
+    regimes = utils.regime_schedule(args.learn_type, args.epochs)
+    testPerf = np.zeros([args.epochs//args.print_step + 1, 2 * len(models)])
+    lds_ratios_test = np.zeros((args.epochs//args.print_step + 1, 1))
+    write_losses = np.zeros((args.epochs, 1))
+    words_per_second = np.zeros((args.epochs, 1))
+
+    step = 0
+    t_steps, words = time(), 0
+    for epoch in range(args.epochs):
+
+        t = time()
+        write_loss = 0
+
+        # Same seed on all workers, so the batches are the same
+        np.random.seed(args.seed + epoch)
+        for write_inp_batch, write_out_batch, write_word_ids in utils.batch_data(X_train, Y_train, args.batch_size, np.arange(len(X_train)), 
+            data['train_buckets']):
+
+            # The last entry carries the loss (weighted by the shard size like the gradients)
+            shard = np.array_split(np.arange(len(write_inp_batch)), num_workers)[rank]
+            contribution = np.zeros(reducer.size, dtype=np.float32)
+            if len(shard) > 0:
+                feed_dict = {model_write.keep_prob:args.dropout, model_write.lds_mode:regimes[epoch] == 'lds',
+                    model_write.inputs:write_inp_batch[shard,1:], model_write.outputs:write_out_batch[shard,:-1],
+                    model_write.targets:write_out_batch[shard,1:], model_write.word_ids:write_word_ids[shard]}
+                if args.reading:
+                    feed_dict.update({models[1].keep_prob:args.dropout, models[1].outputs:write_inp_batch[shard,:-1]})
+                gradients, batch_loss = sess.run([flat_gradients, model_write.train_loss], feed_dict=feed_dict)
+                contribution[:-1] = gradients * len(shard)
+                contribution[-1] = batch_loss * len(shard)
+
+            mean = reducer.mean(contribution, len(write_inp_batch))
+            sess.run(apply_gradients, feed_dict={ph:value.reshape(shape) for ph, value, shape in zip(gradient_inputs, np.split(mean[:-1], splits), shapes)})
+            write_loss += mean[-1]
+
+            step += 1
+            if step == 1:
+                # Not timed (graph optimizations, memory allocation)
+                t_steps, words = time(), 0
+            else:
+                words += len(write_inp_batch)
+            if max_steps is not None and step >= max_steps:
+                break
+
+        if max_steps is not None:
+            if step >= max_steps:
+                break
+            continue
+
+        write_losses[epoch] = write_loss
+        words_per_second[epoch] = len(X_train) / (time() - t)
+
+        if not reducer.consistent(zlib.crc32(sess.run(flat_params).tobytes())):
+            raise RuntimeError('The parameters of the replicas diverged in epoch ' + str(epoch + 1))
+
+        if rank == 0:
+            print('Epoch {:>4} ({:>6}) - loss {:>8.3f}, {:>8.1f} words per second on {} workers'.format(epoch + 1, regimes[epoch],
+                write_loss, float(words_per_second[epoch]), num_workers))
+
+            if epoch % args.print_step == 0 or epoch == args.epochs - 1:
+                perf, rat_lds = test_performance(sess, models, acc_object, data, regimes[epoch])
+                testPerf[epoch//args.print_step] = perf
+                lds_ratios_test[epoch//args.print_step] = rat_lds
+                print('Test set - token and word accuracy ', np.round(perf, 3), ', LdS ratio ', rat_lds)
+
+            if (epoch % args.save_model == 0 and epoch > 0) or epoch == args.epochs - 1:
+                np.savez(save_path + '/metrics.npz', testPerf=testPerf, write_loss=write_losses, lds_ratios_test=lds_ratios_test,
+                    words_per_second=words_per_second, lt=regimes[:epoch+1], workers=num_workers)
+                saver.save(sess, save_path + '/my_test_model', global_step=epoch)
+
+    if rank == 0 and max_steps is not None:
+        # Also if the epochs ended before MAX_STEPS, with the timed steps actually taken
+        seconds = time() - t_steps
+        results.put({'workers':num_workers, 'steps':max(step - 1, 0), 'seconds':seconds, 'words_per_second':words / max(seconds, 1e-9)})
+    elif rank == 0:
+        results.put({'workers':num_workers, 'words_per_second':float(np.mean(words_per_second))})
+    sess.close()
+
+
+
+def train(args, num_workers, cores_per_worker=1, save_path=None, max_steps=None):
+    """
+    Starts NUM_WORKERS worker processes (see train_worker) and waits for them. Returns the timings of worker 0.
+    If a worker fails, the others are released from their barrier and a RuntimeError is raised (as if worker 0 does not report).
+    """
+
+    subsets = core_subsets(num_workers, cores_per_worker)
+    data = load_data(args)
+    size = gradient_size(args, data) + 1
+
+    # Fresh interpreters for the workers (TF is not fork safe)
+    ctx = mp.get_context('spawn')
+    reducer = SharedAllReduce(ctx, len(subsets), size)
+    results = ctx.Queue()
+    print("Training on ", len(subsets), " workers with cores ", subsets, ", all-reduce of ", size, " values per step.")
+
+    workers = [ctx.Process(target=train_worker, args=(rank, subset, reducer, args, save_path, results, max_steps))
+        for rank, subset in enumerate(subsets)]
+    for worker in workers:
+        worker.start()
+
+    report = None
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=1)
+            if worker.exitcode not in (None, 0):
+                reducer.barrier.abort()
+                for other in workers:
+                    other.terminate()
+                raise RuntimeError('A worker failed with exit code ' + str(worker.exitcode))
+        if report is None and not results.empty():
+            report = results.get()
+
+    if report is None:
+        # Worker 0 puts its report before it exits, allow for the queue to be flushed
+        try:
+            report = results.get(timeout=60)
+        except queue.Empty:
+            raise RuntimeError('Worker 0 finished without reporting its timings')
+
+    return report
+
+
+
+def scaling(args, cores_per_worker=1, steps=20, max_workers=None):
+    """
+    Trains STEPS steps on 1, 2, 4, ... workers (up to the physical cores) and reports throughput, speedup and efficiency.
+    """
+
+    max_workers = max_workers if max_workers is not None else max(1, physical_cores() // cores_per_worker)
+    counts = sorted(set([2**k for k in range(int(np.log2(max_workers)) + 1)] + [max_workers]))
+
+    rows = []
+    for num_workers in counts:
+        row = train(args, num_workers, cores_per_worker, max_steps=steps)
+        row['speedup'] = row['words_per_second'] / rows[0]['words_per_second'] if rows else 1.0
+        row['efficiency'] = row['speedup'] / num_workers
+        rows.append(row)
+        print("{:>3} workers - {:>10.1f} words per second, speedup {:>5.2f}, efficiency {:>5.2f}".format(num_workers,
+            row['words_per_second'], row['speedup'], row['efficiency']))
+
+    return rows
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    # Parallelization
+    parser.add_argument('--workers', default=None, type=int,
+                        help='Amount of worker processes (replicas). Default is #physical cores / cores_per_worker.')
+    parser.add_argument('--cores_per_worker', default=1, type=int,
+                        help='Amount of cores every worker is pinned to.')
+    parser.add_argument('--scaling', default=False, type=bool,
+                        help='Only benchmark the throughput on 1, 2, 4, ... workers (nothing is saved).')
+    parser.add_argument('--scaling_steps', default=20, type=int,
+                        help='Amount of training steps per worker count of the benchmark.')
+
+    # As in run.py
+    parser.add_argument('--run_id', default=0, type=int,
+                        help='The run id of the current run')
+    parser.add_argument('--save_model', default=200, type=int,
+                        help='Frequency of epochs before model is saved and stored.')
+    parser.add_argument('--task', default='celex', type=str,
+                        help="The dataset, from {celex, celex_all, childlex, childlex_all, fibel}.")
+    parser.add_argument('--learn_type', default='normal', type=str,
+                        help="Determines the training regime. Choose from set {'normal', 'lds', 'interleaved'}.")
+    parser.add_argument('--reading', default=False, type=bool,
+                        help="Specifies whether reading task is also accomplished. Default is False. ")
+    parser.add_argument('--epochs', default=1000, type=int,
+                        help='The number of epochs to train on')
+    parser.add_argument('--print_step', default=10, type=int,
+                        help='Record test accuracy after every n epochs')
+    parser.add_argument('--batch_size', default=1500, type=int,
+                        help='The (global) batch size for training, it is split among the workers')
+    parser.add_argument('--seed', default=42, type=int,
+                        help='Seed for the random number generator')
+    parser.add_argument('--learning_rate', default=1e-03, type=float,
+                        help='The learning rate of the optimizer')
+    parser.add_argument('--input_embed_size', default=96, type=int,
+                        help='The feature space dimensionality for the input characters')
+    parser.add_argument('--output_embed_size', default=96, type=int,
+                        help='The feature space dimensionality for the output characters')
+    parser.add_argument('--num_nodes', default=128, type=int,
+                        help='The dimensionality of the LSTM cell')
+    parser.add_argument('--num_layers', default=2, type=int,
+                        help='The number of layers in both encoder and decoder')
+    parser.add_argument('--fc_size', default=128, type=int,
+                        help='The number of units of the fully connected layer on top of the decoder')
+    parser.add_argument('--cell_impl', default='standard', type=str,
+                        help="The LSTM implementation, from {standard, fused} (whole-sequence kernels, faster on CPU).")
+    parser.add_argument('--optimization',default='RMSProp', type=str,
+                        help="The optimizer used in the model. 'RMSProp' as default, alternatives: 'GD', 'Momentum', 'Adam', 'Adadelta', 'Adagrad' ")
+    parser.add_argument('--LSTM_initializer', default='None', type=str,
+                        help="The weight initializer for the LSTM cells. None as default, alternative 'Xavier' ")
+    parser.add_argument('--activation_fn', default='None', type=str,
+                        help="The activation function of the fully connected layer. None as default.")
+    parser.add_argument('--momentum', default=0.01, type=float,
+                        help="The momentum parameter. Only used in case the momentum optimizer is used.")
+    parser.add_argument('--bidirectional', default=True, type=bool,
+                        help="Basic unit of encoder is bidirectional by default. Set to False to use regular LSTM units.")
+    parser.add_argument('--dropout', default=1.0, type=float,
+                        help="Dropout probability of neurons during training.")
+    parser.add_argument('--test_size', default=0.05, type=float,
+                        help="Percentage of dataset hold back for testing.")
+    parser.add_argument('--buckets', default=0, type=int,
+                        help="Amount of length buckets. 0 (default) pads all words to the maximal length.")
+    args = parser.parse_args()
+
+    if args.scaling:
+        scaling(args, args.cores_per_worker, args.scaling_steps, args.workers)
+
+    else:
+        save_path = os.path.join("../../", 'Models', args.task, args.learn_type + '_run_' + str(args.run_id))
+        while os.path.exists(save_path):
+            args.run_id += 1
+            save_path = os.path.join("../../", 'Models', args.task, args.learn_type + '_run_' + str(args.run_id))
+        os.makedirs(save_path)
+
+        num_workers = args.workers if args.workers is not None else max(1, physical_cores() // args.cores_per_worker)
+        t = time()
+        report = train(args, num_workers, args.cores_per_worker, save_path)
+        print("Training done in ", time()-t, " seconds, ", report['words_per_second'], " words per second on average. Model saved in ",
+            os.path.abspath(save_path))
@@ -6,10 +6,15 @@ import numpy as np
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
 
 
-def batch_data(x, y, BATCH_SIZE, alt_targs=None):
+def batch_data(x, y, BATCH_SIZE, alt_targs=None, buckets=None):
     """
     Receives a batch_size and the entire training data [i.e inputs (x) and labels (y)]
-    Returns a data iterator
+    Returns a data iterator. The last batch holds the remaining words (it may be smaller than BATCH_SIZE).
+
+    If BUCKETS (see length_buckets) are given, every batch only contains words of one length bucket and is trimmed to the 
+    sequence lengths of that bucket (the <GO> column is kept). The order of the batches is shuffled.
+    ALT_TARGS are trimmed like y if they are alternative targets (3D), otherwise (e.g. the word indices for the LdS loss, see
+    spelling_keys) they are kept.
     """
 
     shuffle = np.random.permutation(len(x))
@@ -17,19 +22,276 @@ def batch_data(x, y, BATCH_SIZE, alt_targs=None):
     x = x[shuffle]
     y = y[shuffle]
 
-    if alt_targs is None:
-
-        while start + BATCH_SIZE <= len(x):
+    if buckets is not None:
+        bucket_ids, bucket_lengths = buckets
+        bucket_ids = bucket_ids[shuffle]
+        alt_targs = alt_targs[shuffle] if alt_targs is not None else None
+
+        batches = []
+        for bucket in range(len(bucket_lengths)):
+            members = np.where(bucket_ids == bucket)[0]
+            batches.extend([members[start:start+BATCH_SIZE] for start in range(0, len(members), BATCH_SIZE)])
+
+        for ind in np.random.permutation(len(batches)):
+            batch = batches[ind]
+            in_len, out_len = bucket_lengths[bucket_ids[batch[0]]]
+            if alt_targs is None:
+                yield trim_sequences(x[batch], in_len), trim_sequences(y[batch], out_len)
+            elif alt_targs.ndim < 3:
+                yield trim_sequences(x[batch], in_len), trim_sequences(y[batch], out_len), alt_targs[batch]
+            else:
+                yield trim_sequences(x[batch], in_len), trim_sequences(y[batch], out_len), trim_sequences(alt_targs[batch], out_len)
+
+    elif alt_targs is None:
+
+        while start < len(x):
             yield x[start:start+BATCH_SIZE], y[start:start+BATCH_SIZE]
             start += BATCH_SIZE
 
     else:
         alt_targs = alt_targs[shuffle]
-        while start + BATCH_SIZE <= len(x):
+        while start < len(x):
             yield x[start:start+BATCH_SIZE], y[start:start+BATCH_SIZE], alt_targs[start:start+BATCH_SIZE]
             start += BATCH_SIZE
 
-   
+
+
+def input_pipeline(x, y, BATCH_SIZE, buckets=None, num_parallel_calls=4, prefetch=2, pad_remainder=False):
+    """
+    tf.data counterpart of batch_data: the words are shuffled, batched (the last batch of every bucket may be smaller, see 
+    PAD_REMAINDER), trimmed to their length bucket and split into in- and outputs by a parallel map, and prefetched, such 
+    that the next batches are prepared while the model trains on the current one. The model reads the batches directly if it is built
+    with DATA=BATCH (see bLSTM), every sess.run of a training op then consumes one batch.
+
+    Parameters:
+    --------------
+    X               {np.array}  2D  of shape num_words x (input_seq_len+1), with <GO> in the first column
+    Y               {np.array}  2D  of shape num_words x (output_seq_len+1), with <GO> in the first column
+    BATCH_SIZE      {int} amount of words per batch
+    BUCKETS         {tuple} optional, (bucket_ids, bucket_lengths), see length_buckets
+    NUM_PARALLEL_CALLS  {int} threads that assemble the batches
+    PREFETCH        {int} amount of batches prepared in advance
+    PAD_REMAINDER   {bool} fills up the smaller last batch (of every bucket) with rows of zeros that are masked out, such
+                        that all batches have the same shape (per bucket) and no word is lost. Shapes then repeat and 
+                        compiled (XLA) clusters are reused instead of recompiled
+
+    Returns:
+    --------------
+    ITERATOR        {tf.data.Iterator} run ITERATOR.initializer with FEED_DICT at the beginning of every epoch, the epoch
+                        is over once a tf.errors.OutOfRangeError is raised
+    BATCH           {dict} of tensors, 'inputs', 'outputs', 'targets', 'word_ids' (the rows of X, see spelling_keys) and 
+                        'mask' (1 for the words, 0 for the filling rows) as fed to bLSTM, as well as the (trimmed) words 
+                        'x' and 'y' with <GO>
+    FEED_DICT       {dict} the data for the placeholders of the pipeline
+    """
+
+    data_x = tf.placeholder(x.dtype, x.shape, 'data_x')
+    data_y = tf.placeholder(y.dtype, y.shape, 'data_y')
+    data_ids = tf.placeholder(tf.int64, (len(x),), 'data_word_ids')
+    bucket_ids = buckets[0] if buckets is not None else np.zeros(len(x), dtype=np.int64)
+    data_buckets = tf.placeholder(tf.int64, (len(x),), 'data_buckets')
+    feed_dict = {data_x:x, data_y:y, data_ids:np.arange(len(x)), data_buckets:bucket_ids}
+
+    dataset = tf.data.Dataset.from_tensor_slices((data_x, data_y, data_ids, data_buckets)).shuffle(len(x))
+    if buckets is None:
+        dataset = dataset.batch(BATCH_SIZE)
+    else:
+        dataset = dataset.apply(tf.contrib.data.group_by_window(key_func=lambda x, y, ids, bucket: bucket, 
+            reduce_func=lambda bucket, window: window.batch(BATCH_SIZE), window_size=BATCH_SIZE))
+        bucket_lengths = tf.constant(buckets[1])
+
+    def split(x, y, ids, bucket):
+        # Without buckets the sequence lengths stay static
+        if buckets is not None:
+            in_len, out_len = bucket_lengths[bucket[0]][0], bucket_lengths[bucket[0]][1]
+            x = tf.concat([x[:,:1], x[:,1:][:,-in_len:]], axis=1)
+            y = tf.concat([y[:,:1], y[:,1:][:,-out_len:]], axis=1)
+        x, y = tf.cast(x, tf.int32), tf.cast(y, tf.int32)
+        mask = tf.ones_like(ids, tf.float32)
+        if pad_remainder:
+            missing = BATCH_SIZE - tf.shape(ids)[0]
+            x, y = tf.pad(x, [[0, missing], [0, 0]]), tf.pad(y, [[0, missing], [0, 0]])
+            ids, mask = tf.pad(ids, [[0, missing]]), tf.pad(mask, [[0, missing]])
+            for tensor in [x, y, ids, mask]:
+                tensor.set_shape([BATCH_SIZE] + tensor.shape.as_list()[1:])
+        return {'inputs':x[:,1:], 'outputs':y[:,:-1], 'targets':y[:,1:], 'word_ids':ids, 'mask':mask, 'x':x, 'y':y}
+
+    dataset = dataset.map(split, num_parallel_calls=num_parallel_calls).prefetch(prefetch)
+    iterator = dataset.make_initializable_iterator()
+
+    return iterator, iterator.get_next(), feed_dict
+
+
+
+def num_batches(num_samples, BATCH_SIZE, buckets=None):
+    """ Amount of batches batch_data (or input_pipeline) yields per epoch """
+
+    if buckets is None:
+        return int(np.ceil(num_samples / BATCH_SIZE))
+
+    bucket_ids, bucket_lengths = buckets
+    return sum(int(np.ceil(np.sum(bucket_ids == bucket) / BATCH_SIZE)) for bucket in range(len(bucket_lengths)))
+
+
+
+def length_buckets(inputs, targets, pad_x, pad_y, num_buckets, alt_targets=None):
+    """
+    Groups the words into length buckets. Sequences are padded at the beginning, so the padding of a bucket can be cut by 
+    keeping only the last columns (see trim_sequences). The bucket is determined by the length of the input, such that it 
+    is also known at test time; the output length of a bucket is the longest target (or alternative target) in it.
+
+    Parameters:
+    --------------
+    INPUTS          {np.array}  2D  of shape num_words x (input_seq_len+1), with <GO> in the first column
+    TARGETS         {np.array}  2D  of shape num_words x (output_seq_len+1), with <GO> in the first column
+    PAD_X, PAD_Y    {int} the <PAD> indices of the input and output dictionary
+    NUM_BUCKETS     {int} the amount of buckets (fewer if there are fewer distinct input lengths)
+    ALT_TARGETS     {list} optional, with one list of alternative spellings (each with <GO>) per word
+
+    Returns:
+    --------------
+    BUCKET_IDS      {np.array}  1D  the bucket of every word
+    BOUNDARIES      {np.array}  1D  the maximal input length per bucket (to assign new words, see assign_buckets)
+    BUCKET_LENGTHS  {np.array}  2D  of shape num_buckets x 2 with the (input, output) sequence length per bucket
+    """
+
+    in_lens = np.sum(inputs[:,1:] != pad_x, axis=1)
+    out_lens = np.sum(targets[:,1:] != pad_y, axis=1)
+    if alt_targets is not None:
+        # Columns of alternative targets might be zero-padded as well
+        alt_lens = [max([np.sum((np.asarray(alt)[1:] != pad_y) & (np.asarray(alt)[1:] != 0)) for alt in alts], default=0) for alts in alt_targets]
+        out_lens = np.maximum(out_lens, alt_lens)
+
+    sorted_lens = np.sort(in_lens)
+    quantiles = np.ceil(np.arange(1, num_buckets+1) / num_buckets * len(sorted_lens)).astype(int) - 1
+    boundaries = np.unique(sorted_lens[quantiles])
+    bucket_ids = assign_buckets(inputs, pad_x, boundaries)
+
+    bucket_lengths = np.array([[boundaries[bucket], max(out_lens[bucket_ids == bucket].max(), 1)] for bucket in range(len(boundaries))])
+
+    return bucket_ids, boundaries, bucket_lengths
+
+
+
+def reading_buckets(inputs, targets, pad_x, pad_y, num_buckets):
+    """
+    Length buckets of the reading module. Its inputs are the spellings, so the buckets are determined by the orthographic 
+    length (the phonetic length is the target of the reading module, it is unknown when decoding). The last bucket keeps 
+    the full sequence lengths, decoded spellings (e.g. accepted alternative spellings) may be longer than those of the data.
+
+    Parameters:
+    --------------
+    INPUTS          {np.array}  2D  the phonetic sequences, as for length_buckets
+    TARGETS         {np.array}  2D  the orthographic sequences, as for length_buckets
+    PAD_X, PAD_Y    {int} the <PAD> indices of the phonetic and orthographic dictionary
+    NUM_BUCKETS     {int} the amount of buckets (fewer if there are fewer distinct spelling lengths)
+
+    Returns:
+    --------------
+    BOUNDARIES      {np.array}  1D  the maximal spelling length per bucket (assign the reading inputs with assign_buckets)
+    BUCKET_LENGTHS  {np.array}  2D  of shape num_buckets x 2 with the (orthographic, phonetic) sequence length per bucket
+    """
+
+    _, boundaries, bucket_lengths = length_buckets(targets, inputs, pad_y, pad_x, num_buckets)
+    boundaries[-1] = targets.shape[1] - 1
+    bucket_lengths[-1] = [targets.shape[1] - 1, inputs.shape[1] - 1]
+
+    return boundaries, bucket_lengths
+
+
+
+def assign_buckets(inputs, pad_x, boundaries, go=True):
+    """ 
+    Assigns words to the length buckets given by their maximal input lengths. If GO is True, the first column of the 
+    INPUTS is the <GO> token.
+    """
+
+    in_lens = np.sum((inputs[:,1:] if go else inputs) != pad_x, axis=1)
+    return np.minimum(np.searchsorted(boundaries, in_lens), len(boundaries) - 1)
+
+
+
+def trim_sequences(seqs, length, go=True):
+    """ 
+    Cuts the (leading) padding of a batch of sequences such that LENGTH tokens remain (plus the <GO> token in the first 
+    column if GO is True). Works on the second dimension, i.e. also on alternative targets of shape bs x seq_len x mas.
+    """
+
+    if go:
+        return np.concatenate([seqs[:,:1], seqs[:,1:][:,-length:]], axis=1)
+    return seqs[:,-length:]
+
+
+
+def greedy_decode(sess, model, inputs, pad_id, buckets=None):
+    """
+    Greedy decoding of a dataset (see bLSTM.inference). With BUCKETS, every length bucket is decoded separately with trimmed
+    inputs and only as many steps as needed. The result is padded back to the full output sequence length.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with a restored model
+    MODEL           {bLSTM} with the inference graph built
+    INPUTS          {np.array}  2D  of shape num_words x input_seq_len (without <GO>)
+    PAD_ID          {int} the <PAD> index of the output dictionary
+    BUCKETS         {tuple} optional, (bucket_ids, bucket_lengths) with the (input, output) sequence length of the model 
+                        per bucket (see length_buckets, or reading_buckets for the reading module)
+
+    Returns:
+    --------------
+    PREDICTIONS     {np.array}  2D  of shape num_words x output_seq_len
+    """
+
+    if buckets is None:
+        return sess.run(model.greedy_predictions, feed_dict={model.keep_prob:1.0, model.inputs:inputs})
+
+    bucket_ids, bucket_lengths = buckets
+    predictions = np.zeros((len(inputs), model.output_seq_length), dtype=np.int32) + pad_id
+    for bucket, (in_len, out_len) in enumerate(bucket_lengths):
+        members = np.where(bucket_ids == bucket)[0]
+        if len(members) > 0:
+            predictions[members,-out_len:] = sess.run(model.greedy_predictions, feed_dict={model.keep_prob:1.0, 
+                model.inputs:trim_sequences(inputs[members], in_len, go=False), model.decode_length:out_len})
+
+    return predictions
+
+
+
+def beam_decode(sess, model, inputs, pad_id, buckets=None):
+    """
+    Beam search decoding of a dataset (see bLSTM.beam_search), one sess.run per length bucket (or for all words without
+    BUCKETS). Like greedy_decode, the n-best lists are padded back to the full output sequence length.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with a restored model
+    MODEL           {bLSTM} with the beam search graph built
+    INPUTS          {np.array}  2D  of shape num_words x input_seq_len (without <GO>)
+    PAD_ID          {int} the <PAD> index of the output dictionary
+    BUCKETS         {tuple} optional, (bucket_ids, bucket_lengths), see greedy_decode
+
+    Returns:
+    --------------
+    PREDICTIONS     {np.array}  3D  of shape num_words x beam_width x output_seq_len, best hypothesis first
+    SCORES          {np.array}  2D  of shape num_words x beam_width, the log-likelihoods of the hypotheses
+    """
+
+    if buckets is None:
+        return sess.run([model.beam_predictions, model.beam_scores], feed_dict={model.keep_prob:1.0, model.inputs:inputs})
+
+    bucket_ids, bucket_lengths = buckets
+    predictions = np.zeros((len(inputs), model.beam_width, model.output_seq_length), dtype=np.int32) + pad_id
+    scores = np.zeros((len(inputs), model.beam_width), dtype=np.float32)
+    for bucket, (in_len, out_len) in enumerate(bucket_lengths):
+        members = np.where(bucket_ids == bucket)[0]
+        if len(members) > 0:
+            predictions[members,:,-out_len:], scores[members] = sess.run([model.beam_predictions, model.beam_scores],
+                feed_dict={model.keep_prob:1.0, model.inputs:trim_sequences(inputs[members], in_len, go=False),
+                model.decode_length:out_len})
+
+    return predictions, scores
+
+
 
 
 def accuracy_prepare(logits, labels, char2numY, mode='train'):
@@ -107,6 +369,222 @@ def set_model_params(inputs, targets, dict_char2num_x, dict_char2num_y):
 
 
 
+def read_model_args(path):
+    """
+    Retrieves the hyperparameters of a trained bLSTM (#layers, #nodes, learning rate etc.) which run.py saves in meta_tags.csv.
+    The first arguments are in the order of the bLSTM constructor (writing module).
+
+    Parameters:
+    --------------
+    PATH            {str} the folder of the trained model
+
+    Returns:
+    --------------
+    MODEL_ARGS      {list} the typed hyperparameters, ending with the train and test indices (and the size of the fully 
+                        connected layer and the cell implementation, for runs that saved them)
+    """
+    import pandas as pd
+
+    # 'None' (e.g. of the activation function) would be read as NaN otherwise
+    df = pd.read_csv(path+'/test_tube_data/version_0/meta_tags.csv', keep_default_na=False)
+    raw_args = df['value'].values.tolist()
+
+    model_args = []
+    types = ['i','i','i','i','i','i','i','i','i','s','s','b','s','f','s','f','s','b','b','i','i','b','f','l','l','i','s'] # test_indices, fc_size, cell_impl (if saved)
+    for ind,raw_arg in enumerate(raw_args[:len(types)]):
+        if types[ind] == 'i':
+            model_args.append(int(raw_arg))
+        elif types[ind] == 's':
+            model_args.append(str(raw_arg))
+        elif types[ind] == 'b':
+            # pandas reads the column of mixed types as strings
+            model_args.append(str(raw_arg) == 'True')
+        elif types[ind] == 'f':
+            model_args.append(float(raw_arg))
+        elif types[ind] == 'l':
+            model_args.append(join_inds(list(raw_arg)))
+
+    return model_args
+
+
+
+def meta_tags(args, dims, indices_train, indices_test, print_ratio=False, restored=False):
+    """
+    The meta tags of a training run (run.py, train_parallel.py) in the order read_model_args expects. The first ones are 
+    in the order of the bLSTM constructor, this simplifies restoring.
+
+    Parameters:
+    --------------
+    ARGS            {argparse.Namespace} the arguments of the run
+    DIMS            {tuple} x_seq_length, y_seq_length, x_dict_size, num_classes (see set_model_params)
+    INDICES_TRAIN   {list} the indices of the training words in the dataset
+    INDICES_TEST    {list} the indices of the test words in the dataset
+    PRINT_RATIO     {bool} optional, whether the ratio of LdS-accepted words is printed
+    RESTORED        {bool} optional, whether the run continued a saved model
+
+    Returns:
+    --------------
+    META_TAGS       {dict} for test_tube.Experiment.add_meta_tags
+    """
+
+    x_seq_length, y_seq_length, x_dict_size, num_classes = dims
+    return {'inp_len':x_seq_length, 'out_len':y_seq_length, 'x_dict_size':x_dict_size, 'num_classes':num_classes, 'input_embed':args.input_embed_size,
+            'output_embed':args.output_embed_size, 'num_layers':args.num_layers, 'nodes/Layer':args.num_nodes, 'batch_size':args.batch_size, 'learn_type':
+            args.learn_type, 'task': 'write', 'print_ratio':print_ratio, 'optimization':str(args.optimization), 'lr': args.learning_rate,
+            'LSTM_initializer':str(args.LSTM_initializer), 'momentum':args.momentum,'ActFctn':str(args.activation_fn), 'bidirectional': args.bidirectional,
+            'Write+Read = ': args.reading, 'epochs': args.epochs,  'seed':args.seed,'restored':restored, 'dropout':args.dropout, 'train_indices':
+            indices_train, 'test_indices':indices_test, 'fc_size':args.fc_size, 'cell_impl':args.cell_impl}
+
+
+def reading_model_args(model_args_write):
+    """
+    The model parameter ordering of meta_tags.csv refers to the writing module. For the reading module in- and output are flipped.
+    """
+
+    # Flip input and output sequence length and input and output dict sizes
+    model_args_read = [model_args_write[1], model_args_write[0], model_args_write[3], model_args_write[2]]
+
+    # Next arguments are identical for both models
+    model_args_read.extend(model_args_write[4:9])
+
+    # In reading learn type is always normal, set reading property and set mas=500 (dummy)
+    model_args_read.extend(['normal','read',500])
+    model_args_read.extend(model_args_write[23:25])
+
+    return model_args_read
+
+
+
+def join_inds(str_inds):
+    """ 
+    Helper method to handle str data from model hyperparameter csv file
+    """
+
+    number_string = ''.join(str_inds)
+    number_string_list = number_string.split(",")
+    # Remove square brackets
+    number_string_list[0] = number_string_list[0][1:] 
+    number_string_list[-1] = number_string_list[-1][:-1] 
+
+    return list(map(int,number_string_list))
+
+
+
+def rebuild_model(model_args_write, task, go_id, beam_width=0, dropout=True, cell_impl=None):
+    """
+    Rebuilds a trained bLSTM (forward pass, inference and scoring graph, no optimization) from its hyperparameters into the 
+    default graph. In contrast to tf.train.import_meta_graph this makes the inference graph available also for models that 
+    were saved before it existed. Restore the weights with the returned saver.
+
+    Parameters:
+    --------------
+    MODEL_ARGS_WRITE    {list} from read_model_args
+    TASK                {str} from {'write', 'read'}
+    GO_ID               {int} the index of the <GO> token in the output dictionary
+    BEAM_WIDTH          {int} optional, if > 0 the beam search graph (see bLSTM.beam_search) is built as well
+    DROPOUT             {bool} optional, False builds the model without dropout layers (inference only, e.g. for export)
+    CELL_IMPL           {str} optional, from {'standard', 'fused'}, default is the one the model was trained with. Both 
+                            restore the same checkpoints (e.g. evaluate a model trained with standard cells with fused kernels)
+
+    Returns:
+    --------------
+    MODEL               {bLSTM} the rebuilt model
+    SAVER               {tf.train.Saver} to restore the model variables from the checkpoint
+    """
+    from bLSTM import bLSTM
+
+    model_name = 'writing' if task == 'write' else 'reading'
+    model_args = model_args_write[:11] if task == 'write' else reading_model_args(model_args_write)[:11]
+
+    with tf.variable_scope(model_name):
+        model = bLSTM(*model_args, 500, print_ratio=model_args_write[11], LSTM_initializer=model_args_write[14], 
+            activation_fn=model_args_write[16], bidirectional=model_args_write[17], dropout=dropout, 
+            fc_size=model_args_write[25] if len(model_args_write) > 25 else 128,
+            cell_impl=cell_impl or (model_args_write[26] if len(model_args_write) > 26 else 'standard'))
+        model.forward()
+        model.inference(go_id)
+        model.scoring(go_id)
+        if beam_width > 0:
+            model.beam_search(beam_width)
+
+    return model, tf.train.Saver(tf.global_variables(scope=model_name))
+
+
+
+def checkpoint_saver(checkpoint, scope=None):
+    """
+    Saver for the variables of the default graph that are stored in CHECKPOINT with the same name and shape, e.g. to
+    initialize a model from a pruned checkpoint (see prune.py). Optimizer slots and other variables of other sizes are 
+    skipped, but LSTM and fully connected weights of other sizes raise a ValueError (the model sizes, e.g. num_nodes and 
+    fc_size, have to match the checkpoint).
+
+    Parameters:
+    --------------
+    CHECKPOINT      {str} the checkpoint prefix (e.g. .../my_test_model-249)
+    SCOPE           {str} optional, only variables of this scope (e.g. 'writing')
+
+    Returns:
+    --------------
+    SAVER           {tf.train.Saver} restoring the matching variables
+    """
+
+    shapes = dict(tf.train.list_variables(checkpoint))
+    mismatches = [var.op.name for var in tf.global_variables(scope=scope) if var.op.name in shapes and 
+        shapes[var.op.name] != var.shape.as_list()]
+    layer_mismatches = [name for name in mismatches if 'lstm_cell' in name or 'fully_connected' in name]
+    if layer_mismatches:
+        raise ValueError("The sizes of " + ', '.join(layer_mismatches) + " differ from " + checkpoint + 
+            " (check --num_nodes and --fc_size).")
+    var_list = [var for var in tf.global_variables(scope=scope) if shapes.get(var.op.name) == var.shape.as_list()]
+    if not var_list:
+        raise ValueError("No variable of the model matches a variable in " + checkpoint + " (check the sizes of the model).")
+    print("Initializing ", len(var_list), " variables from ", checkpoint)
+
+    return tf.train.Saver(var_list)
+
+
+
+def session_config(intra_op_threads=0, inter_op_threads=0, allow_growth=True):
+    """
+    Session configuration with explicit thread pools (0 lets TF choose, i.e. uses all cores). Useful if several sessions
+    share one machine, e.g. one worker per core subset.
+    """
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads, inter_op_parallelism_threads=inter_op_threads)
+    config.gpu_options.allow_growth = allow_growth
+
+    return config
+
+
+
+def ids_to_strings(ids, dict_num2char):
+    """
+    Converts a batch of index sequences into strings. Vectorized: the indices are mapped through a character table and the
+    columns are concatenated, <PAD>, <GO> and 0 are dropped.
+
+    Parameters:
+    --------------
+    IDS             {np.array}  2D  of shape batch_size x seq_len
+    DICT_NUM2CHAR   {dict} mapping indices to characters
+
+    Returns:
+    --------------
+    STRINGS         {np.array}  1D  of shape batch_size (dtype str)
+    """
+
+    table = np.array([dict_num2char.get(k, '') if dict_num2char.get(k) not in ('<PAD>', '<GO>') else '' 
+        for k in range(max(dict_num2char) + 1)])
+    table[0] = ''
+    chars = table[np.asarray(ids)]
+
+    strings = np.full(len(chars), '', dtype=table.dtype)
+    for t in range(chars.shape[1]):
+        strings = np.char.add(strings, chars[:,t])
+
+    return strings
+
+
+
 def extract_celex(path):
     """
     Reads in data from the CELEX corpus
@@ -239,6 +717,26 @@ def childlex_retrieve():
     return ( (data['phons'], data['words']) , (phon_dict, word_dict), alt_targs )
 
 
+def childlex_all_retrieve():
+    """
+    Retrives the previously saved data from the childlex database (all words)
+    """
+
+    data = np.load('data/childlex_all.npz')
+    phon_dict = np_dict_to_dict(data['phon_dict'])
+    word_dict = np_dict_to_dict(data['word_dict'])
+
+    path = 'data/childlex_all_alt_targets.npy'
+
+    print("Loading alternative targets ...")
+    alt_targs_raw = np.load(path)
+
+    alt_targs = np.array([np.array(d,dtype=np.int8) for d in alt_targs_raw])
+    print("Alternative targets successfully loaded.")
+
+    return ( (data['phons'], data['words']) , (phon_dict, word_dict), alt_targs )
+
+
 def fibel_retrieve():
 
     data = np.load('data/fibel.npz')
@@ -255,7 +753,62 @@ def fibel_retrieve():
     print("Alternative targets successfully loaded.")
 
     return ( (data['phons'], data['words']) , (phon_dict, word_dict), alt_targs )
- 
+
+
+def retrieve_data(task):
+    """
+    Retrieves the dataset of TASK (from {celex, celex_all, childlex, childlex_all, fibel}). Returns the data as the
+    *_retrieve functions and the maximal amount of alternative spellings (mas) of the dataset.
+    """
+
+    datasets = {'celex':(celex_retrieve, 96), 'celex_all':(celex_all_retrieve, 100), 'childlex':(childlex_retrieve, 100),
+                'childlex_all':(childlex_all_retrieve, 43200), 'fibel':(fibel_retrieve, 810)}
+    if task not in datasets:
+        raise ValueError('Unknown task ' + task + ', choose from ' + str(sorted(datasets)))
+
+    retrieve, mas = datasets[task]
+    return retrieve(), mas
+
+
+def regime_schedule(learn_type, epochs):
+    """ The training regime ('normal' or 'lds') of every epoch of run.py and train_parallel.py for LEARN_TYPE """
+
+    if learn_type not in ['normal', 'lds', 'intervened', 'interleaved', 'intervened + interleaved']:
+        raise ValueError('Wrong learning type given')
+
+    regime = 'normal' if learn_type == 'normal' else 'lds'
+    half = epochs // 2
+    regimes = []
+    for epoch in range(epochs):
+        regimes.append(regime)
+
+        if learn_type in ['lds', 'intervened'] and epoch == half and regime == 'lds':
+            regime = 'normal'
+
+        if learn_type == 'interleaved':
+            if epoch > half and epoch % 5 == 0:
+                regime = 'lds'
+            elif epoch > half and regime == 'lds':
+                regime = 'normal'
+
+        elif learn_type == 'intervened':
+            if epoch < half and epoch % 10 == 0 and epoch > 0:
+                regime = 'normal'
+            elif epoch < half and regime == 'normal':
+                regime = 'lds'
+
+        elif learn_type == 'intervened + interleaved':
+            if epoch < half and epoch % 10 == 0 and epoch > 0:
+                regime = 'normal'
+            elif epoch < half and regime == 'normal':
+                regime = 'lds'
+            elif epoch > half and epoch % 5 == 0:
+                regime = 'lds'
+            elif epoch > half and regime == 'lds':
+                regime = 'normal'
+
+    return regimes
+
 
 def get_last_id(dataset):
 
@@ -341,6 +894,341 @@ def lds_compare(logits, targets, alt_targets, dict_out, mode):
 
     return new_targets if mode == 'train' else new_targets, rat
 
+def spelling_keys(alt_targets, pad_id):
+    """
+    Sorted keys of the alternative spellings of all words for the LdS loss (see loss_lds.lds_targets), one per spelling 
+    (the index of its word and its hash, see loss_lds.spelling_key). They are computed once, instead of feeding and comparing 
+    the alternative spellings themselves in every training step. Words take as much space as they have alternatives.
+
+    Parameters:
+    --------------
+    ALT_TARGETS     {list} with one list of alternative spellings (each with <GO>) per word, or an np.array (3D) of shape 
+                        num_words x output_seq_len x max_alt_spellings (without <GO>, zero-filled for missing alternatives)
+    PAD_ID          {int} the <PAD> index of the output dictionary
+
+    Returns:
+    --------------
+    KEYS            {np.array}  1D  sorted int64 keys, starting with -1 (which matches no word) such that it is never empty
+    """
+    from loss_lds import spelling_hash, spelling_key
+
+    if isinstance(alt_targets, np.ndarray):
+        spellings = np.moveaxis(alt_targets, 2, 1).reshape(-1, alt_targets.shape[1])
+        word_ids = np.repeat(np.arange(len(alt_targets)), alt_targets.shape[2])
+    else:
+        counts = [len(alts) for alts in alt_targets]
+        spellings = np.concatenate([np.asarray(alts)[:,1:] for alts in alt_targets if len(alts) > 0] or 
+            [np.zeros((0, 1), dtype=np.int64)])
+        word_ids = np.repeat(np.arange(len(alt_targets)), counts)
+
+    # Empty slots are all zero, spellings might be zero-padded as well
+    found = np.any(spellings != 0, axis=1)
+    spellings = np.where(spellings[found] == 0, pad_id, spellings[found])
+    keys = spelling_key(word_ids[found].astype(np.int64), spelling_hash(spellings, pad_id))
+
+    return np.concatenate([[-1], np.unique(keys)]).astype(np.int64)
+
+
+
+def key_table(keys, name='alternative_keys'):
+    """
+    Keeps the KEYS of the alternative spellings (see spelling_keys) in the graph, as a variable that is not saved with the
+    model. Pass TABLE to bLSTM (DATA) and run INITIALIZER with FEED_DICT once after the variables are initialized.
+    """
+
+    data = tf.placeholder(tf.int64, keys.shape, name + '_data')
+    table = tf.Variable(data, trainable=False, collections=[], name=name)
+
+    return table, table.initializer, {data:keys}
+
+
+
+def accepted_spellings(targets, alt_targets):
+    """
+    Collects the accepted spellings of every word, i.e. the true target followed by its alternative targets.
+
+    Parameters:
+    --------------
+    TARGETS         {np.array}  2D  of shape num_words x seq_len
+    ALT_TARGETS     {np.array, list}  3D  of shape num_words x seq_len x max_alt_writings (columns of zeros are ignored)
+                        or a list with one sequence of alternative spellings (each of length seq_len) per word
+
+    Returns:
+    --------------
+    SPELLINGS       {list} with one list of np.arrays (each of length seq_len) per word
+    """
+
+    spellings = []
+    for wo_ind in range(len(targets)):
+        if isinstance(alt_targets, np.ndarray):
+            alts = [alt_targets[wo_ind,:,k] for k in range(alt_targets.shape[2]) if alt_targets[wo_ind,:,k].any()]
+        else:
+            alts = [np.asarray(alt) for alt in alt_targets[wo_ind]]
+        spellings.append([targets[wo_ind]] + alts)
+
+    return spellings
+
+
+
+class SpellingTrie(object):
+    """
+    Prefix trie over the accepted spellings of a set of words, i.e. the true target and all alternative targets (LdS sense).
+    The tries of all words share one flat transition table (sorted keys node*vocab+token), so checking a whole batch of 
+    predictions is a vectorized walk of seq_len steps. Unlike lds_compare, the cost does not depend on max_alt_spellings.
+
+    Matched spelling indices are -1 (rejected), 0 (true target) or k > 0 (alternative target k-1).
+    """
+
+    def __init__(self, targets, alt_targets):
+        """
+        Parameters:
+        --------------
+        TARGETS         {np.array}  2D  of shape num_words x seq_len
+        ALT_TARGETS     {np.array, list}  3D  of shape num_words x seq_len x max_alt_writings (columns of zeros are ignored)
+                            or a list with one sequence of alternative spellings (each of length seq_len) per word
+        """
+
+        self.seq_len = targets.shape[1]
+        spellings = accepted_spellings(targets, alt_targets)
+        self.vocab = max(int(spelling.max()) + 1 for word_spellings in spellings for spelling in word_spellings)
+
+        # Insert all spellings. Node 0,...,num_words-1 are the roots of the individual words
+        children = {}
+        num_nodes = len(targets)
+        terminal = {}
+        for wo_ind, word_spellings in enumerate(spellings):
+            for sp_ind, spelling in enumerate(word_spellings):
+                node = wo_ind
+                for token in spelling:
+                    key = node * self.vocab + int(token)
+                    if key not in children:
+                        children[key] = num_nodes
+                        num_nodes += 1
+                    node = children[key]
+                terminal.setdefault(node, sp_ind) # Duplicates keep the first (i.e. the true) spelling
+
+        keys = np.array(sorted(children), dtype=np.int64)
+        self.keys = keys
+        self.values = np.array([children[key] for key in keys], dtype=np.int64)
+        self.terminal = np.full(num_nodes, -1, dtype=np.int64)
+        self.terminal[list(terminal.keys())] = list(terminal.values())
+        self.roots = np.arange(len(targets), dtype=np.int64)
+
+
+    def step(self, nodes, tokens):
+        """
+        Advances the walk of every word by one token. Nodes of rejected words are -1 (and stay -1).
+        """
+
+        tokens = np.asarray(tokens, dtype=np.int64)
+        keys = nodes * self.vocab + tokens
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = (nodes >= 0) & (tokens >= 0) & (tokens < self.vocab) & (self.keys[idx] == keys)
+
+        return np.where(found, self.values[idx], -1)
+
+
+    def children(self, nodes):
+        """
+        Returns the allowed continuations of the given nodes as (row, token, child) triples, one per edge.
+        """
+
+        nodes = np.asarray(nodes)
+        start = np.searchsorted(self.keys, np.maximum(nodes, 0) * self.vocab)
+        end = np.searchsorted(self.keys, (np.maximum(nodes, 0) + 1) * self.vocab)
+        counts = np.where(nodes >= 0, end - start, 0) # rejected words have no continuations
+
+        rows = np.repeat(np.arange(len(nodes)), counts)
+        pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+
+        return rows, self.keys[pos] % self.vocab, self.values[pos]
+
+
+    def match(self, predictions, words=None):
+        """
+        Checks which predictions are accepted spellings
+
+        Parameters:
+        --------------
+        PREDICTIONS     {np.array}  2D  of shape batch_size x seq_len
+        WORDS           {np.array}  1D  indices of the words (as given to the constructor) the predictions refer to. 
+                            Defaults to all words (in order).
+
+        Returns:
+        --------------
+        MATCHED         {np.array}  1D  of shape batch_size with the matched spelling indices (-1 if rejected)
+        """
+
+        nodes = self.roots.copy() if words is None else self.roots[words]
+        for t in range(predictions.shape[1]):
+            nodes = self.step(nodes, predictions[:,t])
+
+        return np.where(nodes >= 0, self.terminal[np.maximum(nodes, 0)], -1)
+
+
+
+def lds_compare_trie(predictions, targets, trie, words=None):
+    """
+    Like lds_compare (mode='test'), but checks the predictions with a SpellingTrie instead of comparing them to every 
+    alternative target.
+
+    Parameters:
+    --------------
+    PREDICTIONS     {np.array}  2D  of shape batch_size x seq_len
+    TARGETS         {np.array}  2D  of shape batch_size x seq_len
+    TRIE            {SpellingTrie} built from the targets and the alternative targets
+    WORDS           {np.array}  1D  optional, the indices of the words in the trie (defaults to all words, in order)
+
+    Returns:
+    --------------
+    NEW_TARGETS     {np.array}  2D  of shape batch_size x seq_len (the prediction if it was accepted in LdS sense)
+    RAT             {float} ratio of words written in an alternative (but accepted) way
+    MATCHED         {np.array}  1D  the matched spelling indices (-1 rejected, 0 true target, k>0 alternative k-1)
+    """
+
+    matched = trie.match(predictions, words)
+    lds_correct = matched > 0
+    new_targets = np.where(lds_correct[:,None], predictions, targets).astype(np.int64)
+
+    return new_targets, np.mean(lds_correct), matched
+
+
+
+def trie_decode(sess, model, inputs, trie, words=None):
+    """
+    Trie-constrained greedy decoding. Uses the step-wise decoder of the model (see bLSTM.inference) and restricts the argmax 
+    at each step to the continuations that are still in the trie of the word. The result is thus the (greedily) most probable
+    spelling that a LdS teacher would accept.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with a restored model
+    MODEL           {bLSTM} with the inference graph built
+    INPUTS          {np.array}  2D  of shape batch_size x input_seq_len (without <GO>)
+    TRIE            {SpellingTrie} built from the targets and the alternative targets
+    WORDS           {np.array}  1D  optional, the indices of the words in the trie (defaults to all words, in order)
+
+    Returns:
+    --------------
+    PREDICTIONS     {np.array}  2D  of shape batch_size x seq_len
+    MATCHED         {np.array}  1D  the spelling indices (0 true target, k>0 alternative k-1)
+    LOG_PROBS       {np.array}  1D  the log-likelihood of the predictions under the model
+    """
+
+    nodes = trie.roots.copy() if words is None else trie.roots[words]
+    state = sess.run(model.enc_last_state, feed_dict={model.keep_prob:1.0, model.inputs:inputs})
+    tokens = np.zeros(len(inputs), dtype=np.int32) + model.go_id
+    predictions = np.zeros((len(inputs), trie.seq_len), dtype=np.int32)
+    log_probs = np.zeros(len(inputs))
+
+    for t in range(trie.seq_len):
+        logits, state = sess.run([model.dec_step_logits, model.dec_state_out], 
+            feed_dict={model.dec_step_input:tokens, model.dec_state_in:state})
+
+        # log softmax
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        logits = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+        # Only the continuations in the trie are allowed
+        rows, allowed_tokens, _ = trie.children(nodes)
+        masked = np.full(logits.shape, -np.inf)
+        masked[rows, allowed_tokens] = logits[rows, allowed_tokens]
+
+        tokens = masked.argmax(axis=-1).astype(np.int32)
+        log_probs += logits[np.arange(len(tokens)), tokens]
+        predictions[:,t] = tokens
+        nodes = trie.step(nodes, tokens)
+
+    return predictions, trie.terminal[np.maximum(nodes, 0)], log_probs
+
+
+
+def score_spellings(sess, model, inputs, spellings, batch_size=1000):
+    """
+    Computes the log-likelihood of arbitrary candidate spellings of every word by teacher forcing (see bLSTM.scoring).
+    Every word is encoded once and all its candidates are scored in the same batch.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with a restored model
+    MODEL           {bLSTM} with the scoring graph built
+    INPUTS          {np.array}  2D  of shape num_words x input_seq_len (without <GO>)
+    SPELLINGS       {list} with one list of candidate spellings (each of length seq_len, without <GO>) per word, 
+                        e.g. from accepted_spellings
+    BATCH_SIZE      {int} amount of words per sess.run
+
+    Returns:
+    --------------
+    LOG_LIKELIHOOD  {list} with one np.array of log-likelihoods (one per candidate) per word
+    """
+
+    log_likelihood = []
+    for start in range(0, len(inputs), batch_size):
+        batch = spellings[start:start+batch_size]
+        candidates = np.array([spelling for word_spellings in batch for spelling in word_spellings])
+        words = np.repeat(np.arange(len(batch)), [len(word_spellings) for word_spellings in batch])
+
+        scores = sess.run(model.candidate_log_likelihood, feed_dict={model.keep_prob:1.0, model.inputs:inputs[start:start+batch_size], 
+            model.candidates:candidates, model.candidate_words:words})
+        log_likelihood.extend(np.split(scores, np.cumsum([len(word_spellings) for word_spellings in batch])[:-1]))
+
+    return log_likelihood
+
+
+
+def lds_acceptance(log_likelihood):
+    """
+    Probability that the model writes a word correctly, respectively in an alternative way that is accepted in LdS sense.
+    
+    Parameters:
+    --------------
+    LOG_LIKELIHOOD  {list} from score_spellings on the output of accepted_spellings (true target first)
+
+    Returns:
+    --------------
+    P_CORRECT       {np.array}  1D  probability of the true target per word
+    P_LDS           {np.array}  1D  probability of any of the alternative targets per word
+    RANKING         {list} with the indices of the alternative targets per word, most likely first
+    """
+
+    p_correct = np.array([np.exp(ll[0]) for ll in log_likelihood])
+    p_lds = np.array([np.exp(ll[1:]).sum() for ll in log_likelihood])
+    ranking = [np.argsort(-ll[1:]) for ll in log_likelihood]
+
+    return p_correct, p_lds, ranking
+
+
+
+def teacher_targets(sess, model, inputs, targets, trie, pad_id, buckets=None, batch_size=10000):
+    """
+    Hard targets for knowledge distillation (see bLSTM.distillation): the greedy prediction of a trained teacher MODEL if
+    it is an accepted alternative spelling of the word (LdS sense), the true target otherwise.
+
+    Parameters:
+    --------------
+    SESS            {tf.Session} with the restored teacher
+    MODEL           {bLSTM} the teacher, with the inference graph built
+    INPUTS          {np.array}  2D  of shape num_words x input_seq_len (without <GO>)
+    TARGETS         {np.array}  2D  of shape num_words x output_seq_len (without <GO>)
+    TRIE            {SpellingTrie} built from TARGETS and their alternative targets
+    PAD_ID          {int} the <PAD> index of the output dictionary
+    BUCKETS         {tuple} optional, (bucket_ids, bucket_lengths) the teacher was trained with (see greedy_decode)
+    BATCH_SIZE      {int} amount of words decoded per sess.run
+
+    Returns:
+    --------------
+    NEW_TARGETS     {np.array}  2D  of shape num_words x output_seq_len
+    RAT             {float} ratio of words the teacher writes in an alternative (but accepted) way
+    """
+
+    predictions = np.concatenate([greedy_decode(sess, model, inputs[k:k+batch_size], pad_id,
+        (buckets[0][k:k+batch_size], buckets[1]) if buckets is not None else None) for k in range(0, len(inputs), batch_size)])
+    new_targets, rat, _ = lds_compare_trie(predictions, targets, trie)
+
+    return new_targets, rat
+
+
+
 def num_to_str(inputs,logits,labels,alt_targs,dict_in,dict_out):
     """
     Method receives the numerical arrays and prints the strings